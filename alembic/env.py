@@ -17,7 +17,8 @@ if config.config_file_name is not None:
 from cave_bot.model import generate_models, get_table_names
 from cave_bot.config import Config
 secrets_config = Config()
-week_postfix, table_names = get_table_names()
+# partitioned schema - cell and user_record are same tables every week
+week_postfix, table_names = get_table_names(is_partitioned = secrets_config.db_partitioned)
 models = generate_models(table_names)
 target_metadata = models.Base.metadata
 
@@ -0,0 +1,38 @@
+"""user_record indexes
+
+Revision ID: 3f9c2a7d5e41
+Revises: e1ac0dea79ba
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from cave_bot.model import get_user_record_indexes
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d5e41'
+down_revision: Union[str, None] = 'e1ac0dea79ba'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# tables are created weekly - user_record_<week>
+def get_user_record_tables(inspector):
+    return [x for x in inspector.get_table_names() if x.startswith('user_record_')]
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table_name in get_user_record_tables(inspector):
+        existed = [x['name'] for x in inspector.get_indexes(table_name)]
+        for name, columns in get_user_record_indexes(table_name).items():
+            if name not in existed:
+                op.create_index(name, table_name, columns)
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table_name in get_user_record_tables(inspector):
+        existed = [x['name'] for x in inspector.get_indexes(table_name)]
+        for name in get_user_record_indexes(table_name).keys():
+            if name in existed:
+                op.drop_index(name, table_name = table_name)
@@ -0,0 +1,62 @@
+"""packed int colors
+
+Revision ID: 5b2e8d1c9a07
+Revises: 3f9c2a7d5e41
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from cave_bot.const import DEFAULT_USER_CONFIG, color_to_int, color_from_int, color_to_str
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e8d1c9a07'
+down_revision: Union[str, None] = '3f9c2a7d5e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['user_config', 'color_scheme']
+COLOR_COLUMNS = [x for x in DEFAULT_USER_CONFIG.keys() if x.endswith('_color')]
+
+def str_to_color(value):
+    return [int(x) for x in value.split(',')]
+
+# new column is filled from old one, then replaces it
+# to_color - old value to color, from_color - color to new value
+def convert(table_name, new_type, to_color, from_color):
+    bind = op.get_bind()
+    existed = [x['name'] for x in sa.inspect(bind).get_columns(table_name)]
+    columns = [x for x in COLOR_COLUMNS if x in existed]
+
+    with op.batch_alter_table(table_name) as batch_op:
+        for name in columns:
+            batch_op.add_column(sa.Column(f'{name}_new', new_type, nullable=True))
+
+    table = sa.table(table_name, sa.column('id'), *[sa.column(x) for x in columns], *[sa.column(f'{x}_new') for x in columns])
+    rows = bind.execute(sa.select(table.c.id, *[table.c[x] for x in columns])).all()
+    for row in rows:
+        values = {}
+        for i, name in enumerate(columns):
+            color = DEFAULT_USER_CONFIG[name]
+            if row[i + 1] is not None:
+                color = to_color(row[i + 1])
+            values[f'{name}_new'] = from_color(color)
+        bind.execute(table.update().where(table.c.id == row[0]).values(**values))
+
+    with op.batch_alter_table(table_name) as batch_op:
+        for name in columns:
+            batch_op.drop_column(name)
+            batch_op.alter_column(
+                f'{name}_new', new_column_name=name, existing_type=new_type,
+                nullable=False, server_default=str(from_color(DEFAULT_USER_CONFIG[name])),
+            )
+
+def upgrade() -> None:
+    for table_name in TABLES:
+        convert(table_name, sa.Integer(), str_to_color, color_to_int)
+
+def downgrade() -> None:
+    for table_name in TABLES:
+        convert(table_name, sa.String(length=15), color_from_int, color_to_str)
@@ -1,19 +1,26 @@
 #!python3
 import inspect
+import time
+import asyncio
+from contextlib import asynccontextmanager, AsyncExitStack
 import discord
 from discord.ext import commands, tasks
 import os
 import traceback
+from datetime import datetime, timezone, timedelta
 
 from .bot_util import init_ctx, MyCommandError, \
                      strict_channels, strict_users, response_by_report
-from ..utils import get_last_monday, get_week_start_as_str, get_mock_class_with_attr, \
+from ..utils import get_last_monday, get_next_monday, get_week_start_as_str, get_mock_class_with_attr, \
                      profile_start, profile_end
 from ..model import generate_models, get_table_names
-from ..db_init import Db
+from ..db_init import Db, flush_stats_to_str
+from ..db_writer import write_queue_stats_to_str
 from ..db_process import DbProcess
+from ..db_async import AsyncDbProcess
+from ..db_archive import Archive, archive_stats_to_str
 from ..controller import Controller
-from ..const import UserRole as ur
+from ..const import UserRole as ur, MapType
 from .. import parser
 from ..helpo import help
 from ..logger import Logger
@@ -21,30 +28,63 @@ from ..render.ascii import RenderAscii
 from ..render.image import RenderImage
 from ..render.theme import RenderTheme
 
+WEEK_PREPARE_BEFORE = timedelta(hours=1)
+WARM_UP_MAP_TYPES = [MapType.normal, MapType.hard, MapType.nightmare]
+
 async def preprocess(ctx):
    init_ctx(ctx)
-   ctx.bot.reset(ctx)
+   await ctx.bot.reset(ctx)
    if ctx.bot.is_profile:
       profile_start(ctx)
-   # ctx.bot.db_process.start_session()
 
 async def postprocess(ctx):
    if ctx.bot.is_profile and ctx.bot.pr:
       profile_end(ctx)
 
+   if getattr(ctx, 'command_failed', False):
+      ctx.bot.db_process.set_rollback_only()
+
    await response_by_report(ctx)
-   # ctx.bot.db_process.end_session()
+
+# db work of command is one unit of work, replies are sent after it's closed
+# command with extras unit_of_work False opens it itself - only around db work, not network calls
+# command with extras db_loaded False uses only eager tables (roles) and doesn't wait for deferred ones
+async def before_command(ctx):
+   if ctx.command.extras.get('db_loaded', True):
+      await ctx.bot.db_loaded.wait()
+   await preprocess(ctx)
+   if ctx.command.extras.get('unit_of_work', True):
+      ctx.unit_of_work = AsyncExitStack()
+      await ctx.unit_of_work.enter_async_context(ctx.bot.unit_of_work())
+
+async def after_command(ctx):
+   if getattr(ctx, 'command_failed', False):
+      ctx.bot.db_process.set_rollback_only()
+   if unit_of_work:= getattr(ctx, 'unit_of_work', None):
+      # group and it's subcommand are invoked one by one, each with own unit of work
+      ctx.unit_of_work = None
+      await unit_of_work.aclose()
+   await postprocess(ctx)
 
 class MyBot(commands.Bot):
 
    def run(self):
       super(MyBot, self).run(self.config.token)
 
-   def init_db(self):
-      week_postfix, table_names = get_table_names()
+   def init_db(self, lazy_load = False):
+      week_postfix, table_names = get_table_names(is_partitioned = self.config.db_partitioned)
       models = generate_models(table_names)
-      self.db = Db(models, self.config.db_connection_str)
+      self.db = Db(
+         models, self.config.db_connection_str, 
+         journal_path = self.config.db_journal_path, 
+         lazy_load = lazy_load, 
+         working_store_path = self.config.db_working_store_path,
+      )
       self.db_process = DbProcess(self.db)
+      self.adb = AsyncDbProcess(self.db_process)
+      self.db_loaded = asyncio.Event()
+      if not self.db.is_deferred():
+         self.db_loaded.set()
 
       self.week_postfix = week_postfix
 
@@ -63,13 +103,23 @@ class MyBot(commands.Bot):
       self.help_command = commands.DefaultHelpCommand(
          width=1000, 
          no_category = 'Default',
-         command_attrs = {'aliases': ['h']}
+         command_attrs = {'aliases': ['h'], 'extras': {'db_loaded': False}}
       )
       self.config = config
 
+      self.start_time = time.perf_counter()
       self.db = None
       self.db_process = None
-      self.init_db()
+      self.adb = None
+      self.db_loaded = None
+      self.db_load_task = None
+      self.warm_up_task = None
+      # (week_postfix, db, db_process, controller), prepared by week_rollover
+      self.next_week = None
+      # prepare and swap of week are done by one caller at once - week_rollover or reset
+      self.week_lock = asyncio.Lock()
+      self.archive = Archive(self.config.db_archive_dir)
+      self.init_db(lazy_load = True)
 
       self.controller = Controller(self.db_process, self.config.admin_id)
       self.logger = Logger('output')
@@ -86,24 +136,153 @@ class MyBot(commands.Bot):
       # but it required MyBot instance, which is bad design
       self.on_ready = self.event(self.on_ready)
       self.on_message = self.event(self.on_message)
-      self._before_invoke = preprocess
-      self._after_invoke = postprocess
+      self._before_invoke = before_command
+      self._after_invoke = after_command
       self.add_not_registered_self_commands()
 
-   def reset_view(self):
-      self.controller = Controller(self.db_process, self.config.admin_id)
-      self.render_image.reset_storage()
+   async def setup_hook(self):
+      if self.db.is_deferred():
+         self.db_load_task = asyncio.create_task(self.load_deferred_tables())
+      self.warm_up_task = asyncio.create_task(self.warm_up())
+
+   # commands wait for db_loaded, but bot is already logged in
+   async def load_deferred_tables(self):
+      try:
+         for table in self.db.deferred_tables:
+            rows = await asyncio.to_thread(self.db.read_table, table)
+            await self.adb.run(self.db.insert_deferred_rows, table, rows)
+         await self.adb.run(self.db.finish_deferred_load)
+      except Exception:
+         # commands would wait forever
+         traceback.print_exc()
+         await self.close()
+         raise
+      self.db_loaded.set()
+      print('ready: {:.3f}s after start'.format(time.perf_counter() - self.start_time))
+
+   # first command of each map doesn't wait for view, fonts and images
+   async def warm_up(self):
+      await self.db_loaded.wait()
+      start = time.perf_counter()
+      try:
+         await asyncio.gather(
+            self.controller.warm_up(WARM_UP_MAP_TYPES),
+            *[asyncio.to_thread(self.render_image.init_cache_by_map_type, x) for x in WARM_UP_MAP_TYPES],
+         )
+      except Exception:
+         # lazy init is done by commands
+         traceback.print_exc()
+         return
+      print('warmed up: {:.3f}s, {:.3f}s after start'.format(time.perf_counter() - start, time.perf_counter() - self.start_time))
 
-   def reset(self, ctx):
-      if self.week_postfix != get_week_start_as_str():
-         self.dump_memory_db_to_connection()
-         self.db.memory_db.dispose()
-         self.db.load_db.dispose()
-         self.init_db()
-         self.reset_view()
+   # under db lock - controller writes roles, it's built in worker thread as other db work
+   async def reset_view(self):
+      print('unit of work rolled back, reset view')
+      self.controller = await asyncio.to_thread(Controller, self.db_process, self.config.admin_id)
+      self.render_image.reset_storage()
+      # views are built again ahead of commands, when unit of work releases db lock
+      self.warm_up_task = asyncio.create_task(self.warm_up_controller(self.controller))
+
+   async def warm_up_controller(self, controller):
+      try:
+         await controller.warm_up(WARM_UP_MAP_TYPES)
+      except Exception:
+         # lazy init is done by commands
+         traceback.print_exc()
+
+   # in case, week_rollover was late
+   # inside of unit of work db lock is taken - swap is done by next message
+   # memory db isn't complete, till deferred tables are loaded - swap is done by week_rollover then
+   async def reset(self, ctx):
+      if self.week_postfix != get_week_start_as_str() and not self.db_process.in_unit_of_work() \
+            and self.db_loaded.is_set():
+         await self.swap_week()
          ctx.report.set_key('Info')
          ctx.report.msg.add('Restarted, reseted week!!!\n')
 
+   # tables and models of next week are created ahead, db is forked - shares engines and data
+   # called under week_lock
+   async def prepare_next_week(self):
+      is_partitioned = self.config.db_partitioned
+      week_postfix, table_names = get_table_names(get_next_monday(), is_partitioned)
+      if self.week_postfix == week_postfix:
+         # late - current week is next
+         week_postfix, table_names = get_table_names(is_partitioned = is_partitioned)
+      models = generate_models(table_names)
+      db = await self.adb.run(self.db.fork, models)
+      db_process = DbProcess(db)
+      # forked db shares db lock, roles of next week are written under it
+      controller = await AsyncDbProcess(db_process).run(Controller, db_process, self.config.admin_id)
+      # first commands of new week don't build views
+      await self.warm_up_controller(controller)
+      self.next_week = (week_postfix, db, db_process, controller)
+      print(f'prepared week {week_postfix}')
+
+   async def swap_week(self):
+      async with self.week_lock:
+         # other caller swapped, while this one waited
+         if self.week_postfix == get_week_start_as_str():
+            return
+         if self.next_week is None or self.next_week[0] != get_week_start_as_str():
+            await self.prepare_next_week()
+
+         previous_week_postfix = self.week_postfix
+         # no unit of work is in progress, swap has no awaits - atomic for commands
+         async with self.db_process.unit_of_work():
+            if self.week_postfix == get_week_start_as_str() or self.next_week is None:
+               return
+            self.week_postfix, self.db, self.db_process, self.controller = self.next_week
+            self.next_week = None
+            self.adb = AsyncDbProcess(self.db_process)
+            self.render_theme = RenderTheme(self.db_process)
+            self.render_image.reset_storage()
+      print(f'swapped to week {self.week_postfix}')
+
+      asyncio.create_task(self.flush_previous_week(previous_week_postfix))
+
+   async def flush_previous_week(self, week_postfix):
+      stats = await self.adb.run(self.db.save_to_load_db)
+      print('previous week flushed: ' + flush_stats_to_str(stats))
+      # nobody writes previous week after swap, it's tables could be archived
+      await self.adb.run(self.db.release_retired, week_postfix)
+      archived = await self.archive_weeks()
+      print('archived: ' + archive_stats_to_str(archived))
+
+   # under week_lock - tables of next week, created ahead, are kept
+   async def archive_weeks(self):
+      async with self.week_lock:
+         keep_weeks = []
+         if self.next_week is not None:
+            keep_weeks.append(self.next_week[0])
+         return await self.adb.run(self.archive.archive_weeks, self.db, keep_weeks)
+
+   @tasks.loop(minutes=1.0)
+   async def week_rollover(self):
+      if not self.db_loaded.is_set():
+         return
+      if self.week_postfix != get_week_start_as_str():
+         await self.swap_week()
+         return
+
+      is_soon = get_next_monday() - datetime.now(tz=timezone.utc) < WEEK_PREPARE_BEFORE
+      if is_soon and self.next_week is None:
+         async with self.week_lock:
+            if self.next_week is None:
+               await self.prepare_next_week()
+
+   # one db transaction, rolled back if anything inside failed
+   @asynccontextmanager
+   async def unit_of_work(self):
+      # views already have changes, which are not in db anymore
+      async with self.db_process.unit_of_work(on_rolled_back = self.reset_view) as scope:
+         yield scope
+
+   async def close(self):
+      if self.db_loaded.is_set():
+         await self.adb.run(self.db.save_to_load_db)
+      self.db.close()
+      await super().close()
+
    async def on_command_error(self, ctx, error):
       error_class_name = type(error).__name__
       if not error_class_name in ['CommandInvokeError'] and \
@@ -135,30 +314,43 @@ class MyBot(commands.Bot):
 
    async def on_ready(self):
       print(f'We have logged in as {self.user}')
+      print('logged in: {:.3f}s after start'.format(time.perf_counter() - self.start_time))
       for extension in self.initial_extensions:
          await self.load_extension(extension)
 
+      await self.db_loaded.wait()
+      # weeks, swapped before crash, are replayed from journal
+      if len(self.db.retired_tables) > 0:
+         asyncio.create_task(self.flush_previous_week(None))
       await self.spawn_scan()
 
       if not self.dump_memory_db_to_connection.is_running():
          self.dump_memory_db_to_connection.start()      
+      if not self.week_rollover.is_running():
+         self.week_rollover.start()
 
    async def on_message(self, message):
       if message.author == self.user:
          return
          
+      # chat is parsed at once, reports wait for user config and records
+      if parser.is_data_msg(message.content):
+         await self.db_loaded.wait()
       mock_ctx = get_mock_class_with_attr({"channel": message.channel, 'message': message, 'bot': self})
       await preprocess(mock_ctx)
       
-      parser.parse_msg(mock_ctx, self)      
-      await postprocess(mock_ctx)
+      async with self.unit_of_work():
+         # parsing writes reports, it's run in worker thread, as other db calls
+         await self.adb.run(parser.parse_msg, mock_ctx, self)
 
-      await self.process_commands(message)
+         last_msg_datetime = message.created_at
 
-      last_msg_datetime = message.created_at
+         if last_msg_datetime:
+            self.db_process.set_last_scan(last_msg_datetime)
+      await postprocess(mock_ctx)
 
-      if last_msg_datetime:
-         self.db_process.set_last_scan(last_msg_datetime)
+      # each command takes unit of work by before_command
+      await self.process_commands(message)
 
    # spawn_scan must imitate hard run of command "!scan"
    async def spawn_scan(self):
@@ -178,27 +370,29 @@ class MyBot(commands.Bot):
         
    @strict_channels()
    @strict_users(ur.admin)
-   @commands.command(hidden=True)
+   @commands.command(hidden=True, extras = {'unit_of_work': False})
    async def scan(ctx, limit=2000):
       self = ctx.bot
       ctx.report.off = True
 
       event_start = get_last_monday()
-      last_scan = self.db_process.get_last_scan() or event_start
+      last_scan = await self.adb.get_last_scan() or event_start
       after = max([event_start, last_scan])
 
+      # history is fetched without db lock
       messages = [message async for message in ctx.channel.history(limit=limit, after=after)]
 
-      last_msg_datetime = None
-      for msg in messages:
-         if msg.author == self.user:
-            continue
-         ctx.message = msg
-         parser.parse_msg(ctx, self)
-         last_msg_datetime = msg.created_at
+      async with self.unit_of_work():
+         last_msg_datetime = None
+         for msg in messages:
+            if msg.author == self.user:
+               continue
+            ctx.message = msg
+            await self.adb.run(parser.parse_msg, ctx, self)
+            last_msg_datetime = msg.created_at
 
-      if last_msg_datetime:
-         self.db_process.set_last_scan(last_msg_datetime)
+         if last_msg_datetime:
+            self.db_process.set_last_scan(last_msg_datetime)
 
       ctx.report.off = False
       msg = f'scanned {len(messages)} from {after}'
@@ -226,5 +420,7 @@ class MyBot(commands.Bot):
    
    @tasks.loop(minutes=30.0)
    async def dump_memory_db_to_connection(self):
-      self.db.save_to_load_db()
-      print('dumped')
+      # not in the middle of someone's transaction, event loop is not blocked
+      stats = await self.adb.run(self.db.save_to_load_db)
+      print('dumped: ' + flush_stats_to_str(stats))
+      print(write_queue_stats_to_str(self.db.writer.get_stats()))
@@ -15,13 +15,13 @@ class AdminCog(commands.Cog, name='Admin', description = "Admin commands - manip
     
     @strict_channels()
     @strict_users(ur.admin)
-    @commands.command(aliases=['al'], brief = "list user priveleges", description = help['adminlist_description'])
+    @commands.command(aliases=['al'], brief = "list user priveleges", description = help['adminlist_description'], extras = {'unit_of_work': False, 'db_loaded': False})
     async def adminlist(self, ctx):
         await self.bot.controller.report_user_roles(self.bot, ctx.report)
 
     @strict_channels()
     @strict_users(ur.admin)
-    @commands.command(aliases=['ba'], brief = "ban user - no interraction with bot", description = help['banadd_description'])
+    @commands.command(aliases=['ba'], brief = "ban user - no interraction with bot", description = help['banadd_description'], extras = {'db_loaded': False})
     async def banadd(self, ctx, users: commands.Greedy[discord.User]):
         for user in users:
             ctx.report.set_key(f'{user.name}')
@@ -29,7 +29,7 @@ class AdminCog(commands.Cog, name='Admin', description = "Admin commands - manip
 
     @strict_channels()
     @strict_users(ur.admin)
-    @commands.command(aliases=['bd'], brief = "delete user ban", description = help['deleteban_description'])
+    @commands.command(aliases=['bd'], brief = "delete user ban", description = help['deleteban_description'], extras = {'db_loaded': False})
     async def bandelete(self, ctx, users: commands.Greedy[discord.User]):
         for user in users:
             ctx.report.set_key(f'{user.name}')
@@ -64,9 +64,15 @@ class AdminCog(commands.Cog, name='Admin', description = "Admin commands - manip
 
     @strict_channels()
     @strict_users(ur.admin)
-    @commands.command(aliases=['re'], brief = "reset week", description=help['reset_description'])
+    @commands.command(aliases=['ct'], brief = "list cells with different reports", description=help['contested_description'])
+    async def contested(self, ctx, limit: Optional[int] = help['contested_limit']):
+        self.bot.controller.report_contested_cells(ctx, limit)
+
+    @strict_channels()
+    @strict_users(ur.admin)
+    @commands.command(aliases=['re'], brief = "reset week", description=help['reset_description'], extras = {'unit_of_work': False})
     async def reset(self, ctx):
-        self.bot.reset(ctx)
+        await self.bot.reset(ctx)
 
 async def setup(bot):
     await bot.add_cog(AdminCog(bot))
\ No newline at end of file
@@ -33,13 +33,13 @@ class ColorSchemeCog(commands.Cog, name='ColorScheme', description = "Config com
 
 	@strict_channels()
 	@strict_users(ur.nobody)
-	@scheme.command(aliases=['se'], brief = "search color_schemes and load what you like, embeds", description = help['scheme_search'])
+	@scheme.command(aliases=['se'], brief = "search color_schemes and load what you like, embeds", description = help['scheme_search'], extras = {'unit_of_work': False})
 	async def search(self, ctx, user: Optional[discord.User], name: Optional[str]):
 		await self.bot.controller.search_scheme(user, name, ctx)
 
 	@strict_channels()
 	@strict_users(ur.nobody)
-	@scheme.command(aliases=['set'], brief = "search color_schemes and load what you like, text table", description = help['scheme_search'])
+	@scheme.command(aliases=['set'], brief = "search color_schemes and load what you like, text table", description = help['scheme_search'], extras = {'unit_of_work': False})
 	async def search_table(self, ctx, user: Optional[discord.User], name: Optional[str]):
 		await self.bot.controller.search_as_table_scheme(user, name, ctx)
 
@@ -7,6 +7,10 @@ from ...const import UserRole as ur
 from ...helpo import help
 from ..bot_util import strict_channels, strict_users
 from ...utils import print_memory_tracker
+from ...db_init import flush_stats_to_str
+from ...db_writer import write_queue_stats_to_str
+from ...db_archive import archive_stats_to_str
+from ...const import MapType
 
 class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin commands - manipulate with other admins data"):
 
@@ -15,7 +19,7 @@ class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin c
     
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases=['aa'], brief = "add user with admin role - more commands available", description = help['addadmin_description'])
+    @commands.command(aliases=['aa'], brief = "add user with admin role - more commands available", description = help['addadmin_description'], extras = {'db_loaded': False})
     async def adminadd(self, ctx, users: commands.Greedy[discord.User]):
         for user in users:
             ctx.report.set_key(f'{user.name}')
@@ -23,7 +27,7 @@ class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin c
 
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases=['ad'], brief = "delete user with admin", description = help['deleteadmin_description'])
+    @commands.command(aliases=['ad'], brief = "delete user with admin", description = help['deleteadmin_description'], extras = {'db_loaded': False})
     async def admindelete(self, ctx, users: commands.Greedy[discord.User]):
         for user in users:
             ctx.report.set_key(f'{user.name}')
@@ -31,13 +35,13 @@ class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin c
 
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases=['dm'], brief = "dump memory objects")
+    @commands.command(aliases=['dm'], brief = "dump memory objects", extras = {'db_loaded': False})
     async def dumpmemory(self, ctx):
         print_memory_tracker(ctx)
 
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases=['gc'], brief = "attempt to run garbage collector manually")
+    @commands.command(aliases=['gc'], brief = "attempt to run garbage collector manually", extras = {'db_loaded': False})
     async def gccollect(self, ctx):
         gc.collect()
         ctx.report.msg.add('collected')
@@ -46,12 +50,41 @@ class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin c
     @strict_users(ur.super_admin)
     @commands.command(brief = "save from memory db to connected db")
     async def save(self, ctx):
-        self.bot.db.save_to_load_db()
-        ctx.report.msg.add('saved')
+        stats = await self.bot.adb.run(self.bot.db.save_to_load_db)
+        ctx.report.msg.add('saved: ' + flush_stats_to_str(stats))
 
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases=['pro'], brief = "profile peformance")
+    @commands.command(aliases=['arc'], brief = "archive finished weeks or show archived week - dd_mm_yyyy", extras = {'unit_of_work': False})
+    async def archive(self, ctx, week: Optional[str]):
+        archive = self.bot.archive
+        if week is None:
+            # week lock is taken before db lock, as by week swap
+            archived = await self.bot.archive_weeks()
+            ctx.report.msg.add('archived: ' + archive_stats_to_str(archived))
+            ctx.report.msg.add('weeks in archive: ' + ', '.join(archive.get_archived_weeks()))
+            return
+
+        archived_week = archive.read_week(week)
+        if archived_week is None:
+            ctx.report.err.add(f'week {week} is not archived')
+            return
+        ctx.report.msg.add(f'week {week}: {archived_week.get_records_amount()} records')
+        for map_type in MapType:
+            if map_type == MapType.unknown:
+                continue
+            view = self.bot.controller.get_archived_view(archived_week, map_type)
+            ctx.report.msg.add(f'{map_type.name}: {view.get_explored_cells()} cells explored')
+
+    @strict_channels()
+    @strict_users(ur.super_admin)
+    @commands.command(aliases=['wq'], brief = "show queue of writes to connected db", extras = {'db_loaded': False})
+    async def writequeue(self, ctx):
+        ctx.report.msg.add(write_queue_stats_to_str(self.bot.db.writer.get_stats()))
+
+    @strict_channels()
+    @strict_users(ur.super_admin)
+    @commands.command(aliases=['pro'], brief = "profile peformance", extras = {'db_loaded': False})
     async def profile(self, ctx):
         if self.bot.is_profile == True:
             ctx.report.msg.add('profiling off')
@@ -71,25 +104,28 @@ class SuperAdminCog(commands.Cog, name='SuperAdmin', description = "SuperAdmin c
 
     @strict_channels()
     @strict_users(ur.super_admin)
-    @commands.command(aliases = ['rwd'], brief = "reset week db")
+    @commands.command(aliases = ['rwd'], brief = "reset week db", extras = {'unit_of_work': False})
     async def reset_week_db(self, ctx):
         allowed_partial_table_names_to_reset = ['last_scan', 'cell_', 'user_record_']
         db = self.bot.db
-        with db.memory_db.connect() as mdb:
-            for table in db.m.Base.metadata.sorted_tables:
-                is_reset = False
-                for part in allowed_partial_table_names_to_reset:
-                    if part in table.name:
-                        is_reset = True
-                        break
-                if not is_reset:
-                    continue
-                ctx.report.msg.add(f'drop -> {table.name}')
-                mdb.execute(table.delete())
+        async with self.bot.unit_of_work():
+            with db.memory_db.connect() as mdb:
+                for table in db.m.Base.metadata.sorted_tables:
+                    is_reset = False
+                    for part in allowed_partial_table_names_to_reset:
+                        if part in table.name:
+                            is_reset = True
+                            break
+                    if not is_reset:
+                        continue
+                    ctx.report.msg.add(f'drop -> {table.name}')
+                    mdb.execute(table.delete().where(*db.get_week_criteria(table)))
+                    db.table_cleared(table)
 
-            mdb.commit()
+                mdb.commit()
 
-        self.bot.reset_view()
+            self.bot.reset_view()
+        # scan takes unit of work only for parsing, not for channel history
         await self.bot.spawn_scan()
 
 async def setup(bot):
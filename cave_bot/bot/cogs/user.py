@@ -41,7 +41,7 @@ class UserCog(commands.Cog, name='User', description = "User commands - manipula
 
 	@strict_channels()
 	@strict_users(ur.nobody)
-	@commands.command(aliases=['c'], brief = "show cell by coords - which item which player reportes")
+	@commands.command(aliases=['c'], brief = "show cell by coords - which item which player reportes", extras = {'unit_of_work': False})
 	async def cell(self, ctx, coords: commands.Greedy[CoordsConverter] = help['coord_descr']):
 		for coord in coords:
 			ctx.report.set_key(f'{coord}')
@@ -49,19 +49,20 @@ class UserCog(commands.Cog, name='User', description = "User commands - manipula
 
 	@strict_channels()
 	@strict_users(ur.nobody)
-	@commands.command(aliases=['m'], brief = "render map as image or text", description = help['map_description'])
+	@commands.command(aliases=['m'], brief = "render map as image or text", description = help['map_description'], extras = {'unit_of_work': False})
 	async def map(self, ctx, me: Optional[Literal['me']] = help['me_descr'], ascii: Optional[Literal['ascii']] = help['ascii']):
 		if me:
 			me = ctx.message.author.id
 		async with ctx.typing():
-			if ascii:
-				self.bot.render_ascii.render(me, self.bot, ctx)
-			else:
-				self.bot.render_image.render(me, self.bot, ctx)
+			async with self.bot.unit_of_work():
+				if ascii:
+					self.bot.render_ascii.render(me, self.bot, ctx)
+				else:
+					self.bot.render_image.render(me, self.bot, ctx)
 
 	@strict_channels()
 	@strict_users(ur.nobody)
-	@commands.command(aliases=['l', 'lead'], brief = "show player scores, depending on opening cells")
+	@commands.command(aliases=['l', 'lead'], brief = "show player scores, depending on opening cells", extras = {'unit_of_work': False})
 	async def leaderboard(self, ctx, limit: Optional[int] = help['lead_limit']):
 		await self.bot.controller.show_leaderboard(ctx, limit)
 
@@ -1,7 +1,7 @@
 from os import getenv
 from dotenv import load_dotenv
 
-from .const import DEFAULT_DB_NAME
+from .const import DEFAULT_DB_NAME, DEFAULT_DB_JOURNAL_NAME, DEFAULT_DB_ARCHIVE_DIR
 from .utils import build_path
 
 load_dotenv()
@@ -53,9 +53,33 @@ class Config:
       
       return conn_str
 
+   def get_db_journal_path(self):
+      journal_path = getenv('DB_JOURNAL', default = None)
+      if journal_path is None:
+         journal_path = build_path(['db'], DEFAULT_DB_JOURNAL_NAME)
+      return journal_path
+
+   # one cell and user_record table for all weeks instead of tables per week
+   def get_db_partitioned(self):
+      return getenv('DB_PARTITIONED', default = '0').lower() in ['1', 'true', 'yes']
+
+   def get_db_archive_dir(self):
+      archive_dir = getenv('DB_ARCHIVE_DIR', default = None)
+      if archive_dir is None:
+         archive_dir = build_path(['db', DEFAULT_DB_ARCHIVE_DIR])
+      return archive_dir
+
+   # None - working set in process memory
+   def get_db_working_store_path(self):
+      return getenv('DB_WORKING_STORE', default = None)
+
    def __init__(self):
       self.allowed_channel_ids = self.init_allowed_channel_ids()
       self.scan_allowed_channel_ids = self.init_allowed_channel_ids()
       self.admin_id = getenv('ADMIN_ID', None)
       self.token = getenv('DISCORD_TOKEN')
-      self.db_connection_str = self.get_db_connection_str()
\ No newline at end of file
+      self.db_connection_str = self.get_db_connection_str()
+      self.db_journal_path = self.get_db_journal_path()
+      self.db_working_store_path = self.get_db_working_store_path()
+      self.db_archive_dir = self.get_db_archive_dir()
+      self.db_partitioned = self.get_db_partitioned()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import enum
+import functools
 import sqlalchemy as sa
 
 class CellType(enum.IntEnum):
@@ -105,6 +106,8 @@ for k, v in map_type_aliases_config.items():
       map_type_aliases[element] = k
 
 DEFAULT_DB_NAME = 'cave.db'
+DEFAULT_DB_JOURNAL_NAME = 'journal.jsonl'
+DEFAULT_DB_ARCHIVE_DIR = 'archive'
 MSG_CONSTRAINT = 2000 - len("```ansi\n\n```")
 
 color_scheme = {
@@ -126,22 +129,22 @@ color_scheme = {
 }
 
 map_colour_alias_to_rgb = {
-   "empty": [0, 0, 0, 0],
-   "white": [255, 255, 255, 50],
-   "black": [0, 0, 0, 50],
-   "red": [255, 0, 0, 20],
-   "green": [83, 255, 77, 20],
-   "brightblue": [95, 135, 255, 20],
-   "orange": [255, 153, 51, 100],
-   "epic": [153, 51, 255, 100],
-   "yellow": [255, 255, 0, 20],
-   "blue": [133, 179, 255, 20],
-   "white": [255, 255, 255, 50],
-   "grey": [140, 140, 140, 50],
-   "light_yellow": [255, 255, 153, 50],
-   "white_blue": [101, 131, 144, 100],
-   "black_blue": [20, 26, 36, 100],
-   "white_grey": [150, 150, 150, 100],
+   "empty": (0, 0, 0, 0),
+   "white": (255, 255, 255, 50),
+   "black": (0, 0, 0, 50),
+   "red": (255, 0, 0, 20),
+   "green": (83, 255, 77, 20),
+   "brightblue": (95, 135, 255, 20),
+   "orange": (255, 153, 51, 100),
+   "epic": (153, 51, 255, 100),
+   "yellow": (255, 255, 0, 20),
+   "blue": (133, 179, 255, 20),
+   "white": (255, 255, 255, 50),
+   "grey": (140, 140, 140, 50),
+   "light_yellow": (255, 255, 153, 50),
+   "white_blue": (101, 131, 144, 100),
+   "black_blue": (20, 26, 36, 100),
+   "white_grey": (150, 150, 150, 100),
 }
 c = map_colour_alias_to_rgb
 
@@ -183,6 +186,20 @@ def color_to_str(color):
    res = ','.join([str(x) for x in color])
    return res
 
+# color - (r, g, b, alpha in pct), packed to signed 32 bit integer
+def color_to_int(color):
+   r, g, b, a = color
+   value = (r << 24) | (g << 16) | (b << 8) | a
+   if value >= 2 ** 31:
+      value -= 2 ** 32
+   return value
+
+# few distinct colors, same tuple is returned for same value
+@functools.lru_cache(maxsize = 1024)
+def color_from_int(value):
+   value &= 0xFFFFFFFF
+   return ((value >> 24) & 0xFF, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
 SERVER_DEFAULT_USER_CONFIG = {
    'map_type': "30",
    'subscribe_id' : "1",
@@ -7,17 +7,30 @@ from .controller_.config import Config
 from .controller_.color_scheme import ColorScheme
 from .controller_.leaderboard import Leaderboard
 from .view import View
+from .user_records import UserRecordsCache
+from .reporters import ReportersIndex
+from .mutation_bus import MutationBus, RecordMutation
+from .db_async import AsyncDbProcess
 
 class Controller:
    def __init__(self, db_process, admin_id):
       self.db_process = db_process
+      self.adb = AsyncDbProcess(db_process)
       self.view = {}
+      self.user_records = UserRecordsCache(db_process)
+      self.reporters = ReportersIndex(db_process)
       self.user_roles = {}
 
+      # derived state of user records, not built yet is loaded from db later
+      self.bus = MutationBus()
+      self.bus.subscribe(self.apply_mutations_to_view)
+      self.bus.subscribe(self.user_records.apply_mutations)
+      self.bus.subscribe(self.reporters.apply_mutations)
+
       self.role = Role(db_process, admin_id)
       self.config = Config(db_process)
       self.color_scheme = ColorScheme(db_process, admin_id)
-      self.leaderboard = Leaderboard(db_process)
+      self.leaderboard = Leaderboard(db_process, self.reporters)
 
    def get_view(self, map_type):
       if view:= self.view.get(map_type):
@@ -28,11 +41,26 @@ class Controller:
       self.view[map_type] = view
       return view
 
-   def init_view(self, view):
-      cells = self.db_process.get_all_cells(view.map_type)
-      for cell in cells:
-         counters = [getattr(cell, x.name) for x in ct]
-         view.update_cell(cell.x, cell.y, counters)
+   # source - db_process or ArchivedWeek
+   def init_view(self, view, source = None):
+      if source is None:
+         source = self.db_process
+      view.load_cells(source.iter_cell_counters(view.map_type))
+
+   # views and reporters of maps are built ahead of first command, in worker thread
+   # under db lock - reports can't be applied between read and build
+   async def warm_up(self, map_types):
+      def warm_up_map(map_type):
+         self.get_view(map_type)
+         self.reporters.get_map(map_type)
+
+      for map_type in map_types:
+         await self.adb.run(warm_up_map, map_type)
+
+   def get_archived_view(self, archived_week, map_type):
+      view = View(map_type)
+      self.init_view(view, archived_week)
+      return view
 
    def detect_user_map_type(self, user, ctx, with_error = True):
       user_config = self.db_process.get_user_config(user.id)
@@ -139,26 +167,33 @@ class Controller:
       await self.color_scheme.unsubscribe(user, ctx)
 
 #  Leaderboard functions
+   # db lock isn't held, while user names are fetched
    async def show_leaderboard(self, ctx, limit):
       user = ctx.message.author
-      map_type = self.detect_user_map_type(user, ctx)
-      if map_type == MapType.unknown:
-         ctx.report.reaction.add(r.fail)
-         return
+      async with self.db_process.unit_of_work():
+         map_type = self.detect_user_map_type(user, ctx)
+         if map_type == MapType.unknown:
+            ctx.report.reaction.add(r.fail)
+            return
 
-      view = self.get_view(map_type)
+         view = self.get_view(map_type).snapshot()
+         score_by_user_id, map_config = self.leaderboard.get_scores(view, map_type)
 
-      await self.leaderboard.show(user, view, map_type, ctx, limit)
+      await self.leaderboard.show(user, score_by_user_id, map_type, map_config, ctx, limit)
 
 # Cell functions
 
-   def update_cell(self, coords, view, cell_counters = None):
-      view.set_update_tracker('up')
-      if cell_counters is None:
-         cell_counters = self.db_process.get_cell_type_counters(*coords, view.map_type)
-      
-      view.update_cell(*coords, cell_counters)
-      return view.get_update_tracker('up')
+   def apply_mutations_to_view(self, map_type, mutations):
+      if view:= self.view.get(map_type):
+         view.apply_mutations(mutations)
+
+   # mutations are written to db already, returns coords of cells, which most cell type changed
+   def publish(self, map_type, mutations):
+      view = self.get_view(map_type)
+      coords_arr = set([(x.x, x.y) for x in mutations])
+      cell_types_was = {x: view.get_cell_type(*x) for x in coords_arr}
+      self.bus.publish(map_type, mutations)
+      return set([x for x in coords_arr if view.get_cell_type(*x) != cell_types_was[x]])
 
    def get_total_cells(self, cell_type, map_type, user_id = None):
       view = self.get_view(map_type)
@@ -166,19 +201,9 @@ class Controller:
       if not user_id:
          amount = view.get_cell_type_amount(cell_type)
       else:
-         records = self.db_process.get_user_records_by_cell_type(user_id, cell_type, map_type)
-         if records is not None:
-            amount = len(records)
+         amount = self.user_records.get(user_id, map_type).get_cell_type_amount(cell_type)
       return amount
 
-   def order_user_records(self, user_records):
-      hash = {}
-      for r in user_records:
-         key = f'{r.x}-{r.y}'
-         hash[key] = r
-
-      return hash
-
    def add(self, what, coords_arr, ctx, map_type = MapType.unknown):
       if map_type == MapType.unknown:
          map_type = self.detect_user_map_type(ctx.message.author, ctx)
@@ -190,28 +215,29 @@ class Controller:
       view = self.get_view(map_type)
       user_id = ctx.message.author.id
 
-      user_records = self.db_process.get_all_user_record(user_id, map_type)
-      user_records = self.order_user_records(user_records)
-
       cell_type_new = what
-      for coords in coords_arr:
-         user_record = user_records.get(f'{coords[0]}-{coords[1]}')
-
-         cell_type_was = None
-         if user_record is not None:
-            cell_type_was = user_record.cell_type
-         
+      reports = [(*coords, cell_type_new) for coords in coords_arr]
+      user_records = self.user_records.get(user_id, map_type)
+      user_cell_types = {}
+      for x, y, _ in reports:
+         if (cell_type:= user_records.get(x, y)) is not None:
+            user_cell_types[(x, y)] = cell_type
+      cell_types_was, _ = self.db_process.apply_user_reports(
+         user_id, map_type, reports, ctx.message.created_at, user_cell_types
+      )
+
+      mutations = []
+      for (x, y, _), cell_type_was in zip(reports, cell_types_was):
+         if cell_type_was != cell_type_new:
+            mutations.append(RecordMutation(user_id, x, y, cell_type_was, cell_type_new, ctx.message.created_at))
+      changed_coords = self.publish(map_type, mutations)
+
+      for coords, cell_type_was in zip(coords_arr, cell_types_was):
          if cell_type_was is not None and cell_type_was == cell_type_new:
             ctx.report.reaction.add(r.user_data_equal)
             continue
 
-         is_cell_type_changed = False
-         if cell_type_was:
-            cell_counters = self.db_process.update_cell(*coords, cell_type_was, map_type, -1)
-            is_cell_type_changed |= self.update_cell(coords, view, cell_counters)
-
-         cell_counters = self.db_process.update_user_record_and_cell(user_id, coords, cell_type_new, map_type, ctx.message.created_at)
-         is_cell_type_changed |= self.update_cell(coords, view, cell_counters)
+         is_cell_type_changed = (coords[0], coords[1]) in changed_coords
 
          if cell_type_was is None:
             ctx.report.reaction.add(r.user_data_new)
@@ -239,15 +265,13 @@ class Controller:
       if map_type == MapType.unknown:
          ctx.report.reaction.add(r.fail)
          return
-      
-      view = self.get_view(map_type)
 
       author_role = self.role.get(ctx.message.author)
       if user.id != ctx.message.author.id and \
          not self.role.user_have_role_less_than(user, author_role, ctx.report):
          return
 
-      cell_type_was = self.db_process.get_user_record(user.id, *coords, map_type)
+      cell_type_was = self.user_records.get(user.id, map_type).get(*coords)
 
       if cell_type_was is None:
          ctx.report.reaction.add(r.user_data_equal)
@@ -255,9 +279,9 @@ class Controller:
 
       self.db_process.delete_user_record_and_update_cell(user.id, coords, cell_type_was, map_type)
       ctx.report.reaction.add(r.user_data_deleted)
-      is_cell_type_changed = self.update_cell(coords, view)
+      changed_coords = self.publish(map_type, [RecordMutation(user.id, *coords, cell_type_was, None)])
 
-      if is_cell_type_changed:
+      if len(changed_coords) > 0:
          ctx.report.reaction.add(r.cell_update)
 
    def deleteall(self, user, ctx):
@@ -266,27 +290,23 @@ class Controller:
          ctx.report.reaction.add(r.fail)
          return
 
-      view = self.get_view(map_type)
-
       author_role = self.role.get(ctx.message.author)
       if user.id != ctx.message.author.id and \
          not self.role.user_have_role_less_than(user, author_role, ctx.report):
          return
 
-      user_records = self.db_process.get_all_user_record(user.id, map_type)
+      user_records = self.user_records.get(user.id, map_type).get_records()
 
       self.report(ctx.message.author, 'c', ctx, map_type)
 
-      for user_record in user_records:
-         x             = user_record.x
-         y             = user_record.y
-         cell_type = user_record.cell_type
-
+      mutations = []
+      for x, y, cell_type in user_records:
          self.db_process.delete_user_record_and_update_cell(user.id, [x, y], cell_type, map_type)
          ctx.report.reaction.add(r.user_data_deleted)
-         is_cell_type_changed = self.update_cell([x, y], view)
-         if is_cell_type_changed:
-            ctx.report.reaction.add(r.cell_update)
+         mutations.append(RecordMutation(user.id, x, y, cell_type, None))
+
+      for _ in self.publish(map_type, mutations):
+         ctx.report.reaction.add(r.cell_update)
 
    def report(self, user, is_compact, ctx, map_type = None):
       author_role = self.role.get(ctx.message.author)
@@ -309,12 +329,8 @@ class Controller:
          msg_arr = []
          compact = {}
 
-         user_records = self.db_process.get_all_user_record(user.id, map_type)
-         for user_record in user_records:
-            x             = user_record.x
-            y             = user_record.y
-            cell_type = user_record.cell_type
-
+         user_records = self.user_records.get(user.id, map_type).get_records()
+         for x, y, cell_type in user_records:
             coords_as_str = f'{x}-{y}'
             ct_name = cell_type.name
             msg_arr.append(f'{coords_as_str} : {ct_name}')
@@ -333,22 +349,52 @@ class Controller:
 
          ctx.report.msg.add(msg_arr)
 
-   async def report_cell(self, coords, ctx, bot):
+   def report_contested_cells(self, ctx, limit):
       map_type = self.detect_user_map_type(ctx.message.author, ctx)
       if map_type == MapType.unknown:
          ctx.report.reaction.add(r.fail)
          return
 
       view = self.get_view(map_type)
-      users_and_types_by_coords = self.db_process.get_users_and_types_by_coords(*coords, map_type)
+      contested_cells = view.get_contested_cells()
+      if limit is not None:
+         contested_cells = contested_cells[:limit]
+
+      msg_arr = []
+      for x, y, margin in contested_cells:
+         cell = view.get_cell(x, y)
+         counters = [(cell.get_cell_type_counter(cell_type), cell_type) for cell_type in ct]
+         counters.sort(key = lambda x: x[0], reverse = True)
+         counters_as_str = ' | '.join([f'{cell_type.name} ({counter})' for counter, cell_type in counters if counter > 0])
+         msg_arr.append(f'{x}-{y} : margin {margin} : {counters_as_str}')
+
+      if len(msg_arr) == 0:
+         msg_arr.append('no contested cells')
+
+      msg_arr.insert(0, f'Map: {map_type.name}')
+
+      ctx.report.msg.add(msg_arr)
+
+   # db lock isn't held, while user names are fetched
+   async def report_cell(self, coords, ctx, bot):
+      async with self.db_process.unit_of_work():
+         map_type = self.detect_user_map_type(ctx.message.author, ctx)
+         if map_type == MapType.unknown:
+            ctx.report.reaction.add(r.fail)
+            return
+
+         view = self.get_view(map_type)
+         reporters = self.reporters.get(map_type, *coords)
+         reporters.sort(key = lambda x: x[2])
+         cell = view.get_cell(*coords)
+
       map_ct_to_usernames = OrderedDict()
-      for (cell_type, user_id) in users_and_types_by_coords:
+      for (_, user_id, cell_type) in reporters:
          if cell_type not in map_ct_to_usernames:
             map_ct_to_usernames[cell_type] = []
          user_name = await bot.get_user_name_by_id(user_id)
          map_ct_to_usernames[cell_type].append(user_name)
 
-      cell = view.get_cell(*coords)
       msg_arr = []
       for key, value in map_ct_to_usernames.items():
          value.sort()
@@ -61,8 +61,10 @@ class ColorScheme:
       self.db_process.delete_color_scheme(scheme.user_id, scheme.name)
       ctx.report.reaction.add(Reactions.ok)
 
+   # db lock isn't held, while user names are fetched, if it's not called in unit of work
    async def search_as_table(self, user, partial_name, ctx):
-      color_schemes = self.db_process.search_color_schemes(user and user.id, partial_name)
+      async with self.db_process.unit_of_work():
+         color_schemes = self.db_process.search_color_schemes(user and user.id, partial_name)
       tabl = prettytable.PrettyTable(['user', 'scheme'])
       for color_scheme in color_schemes:
          user_name = await ctx.bot.get_user_name_by_id(color_scheme.user_id)
@@ -74,7 +76,8 @@ class ColorScheme:
       ctx.report.msg.add(msg_arr)       
 
    async def search(self, user, partial_name, ctx):
-      color_schemes = self.db_process.search_color_schemes(user and user.id, partial_name)
+      async with self.db_process.unit_of_work():
+         color_schemes = self.db_process.search_color_schemes(user and user.id, partial_name)
       embeds_and_files = []
       for color_scheme in color_schemes:
          user_name = await ctx.bot.get_user_name_by_id(color_scheme.user_id)
@@ -16,13 +16,11 @@ class Config:
          user_config = self.db_process.get_user_config(user.id)
          color_was = getattr(user_config, config_key)
          if len(color) == 1:
-            color_was[3] = color[0]
-            color = color_was
+            color = (*color_was[:3], color[0])
          elif len(color) == 3:
-            alpha_was = color_was[3]
-            color.append(alpha_was)
+            color = (*color, color_was[3])
 
-      self.set(user, config_key, color, report)
+      self.set(user, config_key, tuple(color), report)
       report.reaction.add(Reactions.ok)
 
    def reset(self, user, report):
@@ -2,16 +2,10 @@ from ..const import CellType as ct, map_cell_name_to_shortest_alias
 import prettytable
 
 class Leaderboard:
-   def __init__(self, db_process):
+   # reporters - ReportersIndex
+   def __init__(self, db_process, reporters):
       self.db_process = db_process
-
-   def add_potential_winner(self, winners, user_record):
-      key = f'{user_record.x}-{user_record.y}'
-      if key not in winners:
-         winners[key] = user_record
-
-      if winners[key].time > user_record.time:
-         winners[key] = user_record
+      self.reporters = reporters
 
    def is_artifact(self, cell_type):
       if cell_type in [
@@ -28,19 +22,19 @@ class Leaderboard:
 
    def process_winners(self, winners, map_type, map_config):
       score_by_user_id = {}
-      for r in winners.values():
-         is_art = self.is_artifact(r.cell_type)
-         cell_type_name = r.cell_type.name
+      for user_id, cell_type, _ in winners.values():
+         is_art = self.is_artifact(cell_type)
+         cell_type_name = cell_type.name
          if is_art:
             cell_type_name = 'artifact'
          total_cells = getattr(map_config, cell_type_name, 1)
 
          score = self.calculate_score(map_type, total_cells)
 
-         if r.user_id not in score_by_user_id:
-            score_by_user_id[r.user_id] = {}
+         if user_id not in score_by_user_id:
+            score_by_user_id[user_id] = {}
 
-         record = score_by_user_id[r.user_id]
+         record = score_by_user_id[user_id]
          if 'score' not in record:
             record['score'] = 0
          record['score'] += score
@@ -96,18 +90,15 @@ class Leaderboard:
 
       return tabl
          
-   async def show(self, user, view, map_type, ctx, limit):
-      user_records = self.db_process.get_user_record_by_map(map_type)
-      winners = {}
-      for user_record in user_records:
-         if user_record.cell_type != view.get_cell_type(user_record.x, user_record.y):
-            continue
-         self.add_potential_winner(winners, user_record)
-      
+   # db part of leaderboard, done in unit of work
+   def get_scores(self, view, map_type):
+      # first reported wins
+      winners = self.reporters.get_first_finders(map_type, view.get_most_grid().tolist())
       map_config = self.db_process.get_map_config(map_type)
-      
-      score_by_user_id = self.process_winners(winners, map_type, map_config)
-      
+      return self.process_winners(winners, map_type, map_config), map_config
+
+   # user names are fetched, db isn't used
+   async def show(self, user, score_by_user_id, map_type, map_config, ctx, limit):
       max_len = len(score_by_user_id.keys())
       if limit is None:
          limit = max_len
@@ -0,0 +1,244 @@
+import os
+import re
+import sys
+import json
+import zlib
+import struct
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+from datetime import datetime, timezone
+import sqlalchemy as sa
+
+from .const import CellType as ct, MapType
+from .utils import get_last_monday
+
+ARCHIVE_VERSION = 1
+ARCHIVE_CACHE_WEEKS = 4
+# time is stored as microseconds since epoch, None as min value
+ARCHIVE_NO_TIME = -2 ** 63
+WEEK_TABLE_PATTERN = re.compile(r'^(cell|user_record)_(\d{2}_\d{2}_\d{4})$')
+
+CELL_COLUMNS = [('x', 'h'), ('y', 'h'), ('map_type', 'h'), *[(x.name, 'i') for x in ct]]
+USER_RECORD_COLUMNS = [
+   ('user_id', 'q'), ('x', 'h'), ('y', 'h'), ('map_type', 'h'), ('cell_type', 'h'), ('time', 'q'),
+]
+
+def time_to_int(value):
+   if value is None:
+      return ARCHIVE_NO_TIME
+   if value.tzinfo is None:
+      value = value.replace(tzinfo=timezone.utc)
+   delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+   return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def int_to_time(value):
+   if value == ARCHIVE_NO_TIME:
+      return None
+   return datetime.fromtimestamp(value / 1_000_000, tz=timezone.utc)
+
+# rows of one table as typed column arrays, rows are ordered by map_type, x, y
+# so every map type is one slice - ranges are in header
+def pack_table(connection, table_name, columns):
+   table = sa.Table(table_name, sa.MetaData(), autoload_with=connection)
+   stmt = sa.select(*[table.c[name] for name, _ in columns]).order_by(
+      table.c.map_type, table.c.x, table.c.y
+   )
+   arrays = [array(typecode) for _, typecode in columns]
+   names = [name for name, _ in columns]
+   time_i = names.index('time') if 'time' in names else None
+   map_type_i = names.index('map_type')
+
+   ranges = {}
+   rows = 0
+   for row in connection.execute(stmt):
+      for i, value in enumerate(row):
+         if i == time_i:
+            value = time_to_int(value)
+         elif value is None:
+            value = 0
+         arrays[i].append(value)
+
+      map_type = row[map_type_i]
+      if map_type not in ranges:
+         ranges[map_type] = [rows, rows]
+      rows += 1
+      ranges[map_type][1] = rows
+
+   header = {'rows': rows, 'columns': columns, 'ranges': {str(k): v for k, v in ranges.items()}}
+   return header, arrays
+
+def unpack_table(header, data, offset, byteorder):
+   columns = {}
+   for name, typecode in header['columns']:
+      values = array(typecode)
+      size = values.itemsize * header['rows']
+      values.frombytes(data[offset:offset + size])
+      if byteorder != sys.byteorder:
+         values.byteswap()
+      columns[name] = values
+      offset += size
+
+   ranges = {MapType(int(k)): v for k, v in header['ranges'].items()}
+   return columns, ranges, offset
+
+# finished week, read from archive file - same bulk reads as DbProcess
+class ArchivedWeek:
+   def __init__(self, week_postfix, cell, user_record):
+      self.week_postfix = week_postfix
+      self.cell_columns, self.cell_ranges = cell
+      self.user_record_columns, self.user_record_ranges = user_record
+
+   # [(x, y, counters)]
+   def iter_cell_counters(self, map_type):
+      start, end = self.cell_ranges.get(map_type, [0, 0])
+      xs = self.cell_columns['x'][start:end]
+      ys = self.cell_columns['y'][start:end]
+      counters = [self.cell_columns[x.name][start:end] for x in ct]
+      return [
+         (xs[i], ys[i], [x[i] for x in counters]) for i in range(end - start)
+      ]
+
+   def iter_user_records(self, map_type, columns = ('x', 'y', 'cell_type'), user_id = None):
+      start, end = self.user_record_ranges.get(map_type, [0, 0])
+      values = []
+      for name in columns:
+         column = self.user_record_columns[name][start:end]
+         if name == 'cell_type':
+            cell_types = {x.value: x for x in ct}
+            column = [cell_types[x] for x in column]
+         elif name == 'map_type':
+            column = [MapType(x) for x in column]
+         elif name == 'time':
+            column = [int_to_time(x) for x in column]
+         values.append(column)
+
+      rows = list(zip(*values))
+      if user_id is not None:
+         user_ids = self.user_record_columns['user_id'][start:end]
+         rows = [row for i, row in enumerate(rows) if user_ids[i] == user_id]
+      return rows
+
+   def get_records_amount(self):
+      return len(self.user_record_columns['user_id'])
+
+# past weeks are exported from persistent db to one compressed file per week,
+# their tables are dropped
+class Archive:
+   def __init__(self, dir):
+      self.dir = dir
+      Path(dir).mkdir(parents=True, exist_ok=True)
+      self.cache = OrderedDict()
+
+   def get_path(self, week_postfix):
+      return os.path.join(self.dir, f'week_{week_postfix}.bin')
+
+   def get_archived_weeks(self):
+      weeks = []
+      for path in Path(self.dir).glob('week_*.bin'):
+         weeks.append(path.stem[len('week_'):])
+      return sorted(weeks, key = lambda x: datetime.strptime(x, '%d_%m_%Y'))
+
+   # finished weeks, which have both tables in persistent db and are not used by db anymore
+   # current week and later ones (next week is created ahead) are never archived, as keep_weeks
+   def get_weeks_to_archive(self, db, keep_weeks = ()):
+      used = set([x.name for x in db.get_flush_tables()])
+      current_week = get_last_monday().date()
+      tables = {}
+      for table_name in sa.inspect(db.load_db).get_table_names():
+         match = WEEK_TABLE_PATTERN.match(table_name)
+         if match is None or table_name in used:
+            continue
+         week_postfix = match.group(2)
+         if week_postfix in keep_weeks or datetime.strptime(week_postfix, '%d_%m_%Y').date() >= current_week:
+            continue
+         tables.setdefault(week_postfix, []).append(table_name)
+
+      weeks = [k for k, v in tables.items() if len(v) == 2]
+      return sorted(weeks, key = lambda x: datetime.strptime(x, '%d_%m_%Y'))
+
+   def export_week(self, engine, week_postfix):
+      with engine.connect() as connection:
+         cell_header, cell_arrays = pack_table(connection, 'cell_' + week_postfix, CELL_COLUMNS)
+         user_record_header, user_record_arrays = pack_table(
+            connection, 'user_record_' + week_postfix, USER_RECORD_COLUMNS
+         )
+
+      header = json.dumps({
+         'version': ARCHIVE_VERSION,
+         'week': week_postfix,
+         'byteorder': sys.byteorder,
+         'cell': cell_header,
+         'user_record': user_record_header,
+      }).encode('utf8')
+      body = b''.join([x.tobytes() for x in [*cell_arrays, *user_record_arrays]])
+      data = zlib.compress(struct.pack('<I', len(header)) + header + body, 9)
+
+      # file is complete or absent, tables are dropped only after it
+      path = self.get_path(week_postfix)
+      tmp_path = path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+         f.write(data)
+         f.flush()
+         os.fsync(f.fileno())
+      os.replace(tmp_path, path)
+      self.cache.pop(week_postfix, None)
+
+      return {
+         'week': week_postfix,
+         'cells': cell_header['rows'],
+         'records': user_record_header['rows'],
+         'bytes': len(data),
+      }
+
+   def read_week(self, week_postfix):
+      if week_postfix in self.cache:
+         self.cache.move_to_end(week_postfix)
+         return self.cache[week_postfix]
+
+      path = self.get_path(week_postfix)
+      if not os.path.exists(path):
+         return None
+      with open(path, 'rb') as f:
+         data = zlib.decompress(f.read())
+
+      [header_len] = struct.unpack_from('<I', data)
+      offset = 4 + header_len
+      header = json.loads(data[4:offset].decode('utf8'))
+      cell_columns, cell_ranges, offset = unpack_table(header['cell'], data, offset, header['byteorder'])
+      user_record_columns, user_record_ranges, offset = unpack_table(
+         header['user_record'], data, offset, header['byteorder']
+      )
+
+      week = ArchivedWeek(
+         week_postfix, (cell_columns, cell_ranges), (user_record_columns, user_record_ranges)
+      )
+      self.cache[week_postfix] = week
+      if len(self.cache) > ARCHIVE_CACHE_WEEKS:
+         self.cache.popitem(last = False)
+      return week
+
+   def drop_week(self, db, week_postfix):
+      for engine in [db.memory_db, db.load_db]:
+         metadata = sa.MetaData()
+         existed = sa.inspect(engine).get_table_names()
+         for table_name in ['user_record_' + week_postfix, 'cell_' + week_postfix]:
+            if table_name in existed:
+               sa.Table(table_name, metadata, autoload_with=engine).drop(engine)
+
+   def archive_weeks(self, db, keep_weeks = ()):
+      archived = []
+      for week_postfix in self.get_weeks_to_archive(db, keep_weeks):
+         stats = self.export_week(db.load_db, week_postfix)
+         week = self.read_week(week_postfix)
+         if week.get_records_amount() != stats['records']:
+            raise Exception(f'archive of week {week_postfix} is broken, tables are not dropped')
+         self.drop_week(db, week_postfix)
+         archived.append(stats)
+         print('archived week {week}: {cells} cells, {records} records, {bytes} bytes'.format(**stats))
+      return archived
+
+def archive_stats_to_str(archived):
+   if len(archived) == 0:
+      return 'nothing to archive'
+   return ', '.join(['{week} ({records} records, {bytes} bytes)'.format(**x) for x in archived])
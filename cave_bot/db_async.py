@@ -0,0 +1,23 @@
+import asyncio
+
+# awaitable variant of DbProcess - same methods, executed in worker thread,
+# so event loop (discord heartbeat, other commands) is not blocked by db io
+# call joins unit of work of current task, or opens own one
+class AsyncDbProcess:
+   def __init__(self, db_process):
+      self.db_process = db_process
+
+   def __getattr__(self, name):
+      attr = getattr(self.db_process, name)
+      if not callable(attr):
+         return attr
+
+      async def call(*args, **kwargs):
+         return await self.run(attr, *args, **kwargs)
+      return call
+
+   # any sync db function, e.g. Db.save_to_load_db
+   async def run(self, f, *args, **kwargs):
+      async with self.db_process.unit_of_work():
+         # context is copied to thread, so session of unit of work is used there
+         return await asyncio.to_thread(f, *args, **kwargs)
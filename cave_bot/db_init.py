@@ -1,3 +1,6 @@
+import time
+import copy
+import asyncio
 import sqlalchemy as sa
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.inspection import inspect
@@ -5,6 +8,25 @@ from sqlite3 import Connection as SQLite3Connection
 
 from .const import UserRole as ur, DEFAULT_USER_CONFIG
 from .utils import copy_dict_with_exclude
+from .db_tracker import ChangeTracker
+from .db_journal import Journal
+from .db_writer import WriteBehindQueue
+from .db_util import is_sqlite, upsert_rows, filter_by_pks, chunks
+from .db_archive import WEEK_TABLE_PATTERN
+from .model import generate_models
+
+UPSERT_CHUNK_SIZE = 500
+COPY_CHUNK_SIZE = 5000
+BACKUP_PAGES = 1024
+# negative - in KiB, small - pages are cached by os anyway, rss is bounded by it
+# no mmap - mapped pages of file are counted in rss as memory db
+WORKING_STORE_CACHE_SIZE = -8 * 1024
+# PRAGMA user_version of working store file
+WORKING_STORE_NOT_LOADED = 0
+# loaded completely once, could have changes, which are not saved to persistent db
+WORKING_STORE_CHANGED = 1
+# all changes are saved, set on close
+WORKING_STORE_SAVED = 2
 
 def get_engine(db_connection_str):
    echo = False
@@ -13,6 +35,63 @@ def get_engine(db_connection_str):
    if not database_exists(engine.url): create_database(engine.url)
    return engine
 
+# one connection, as for memory db, other processes can read file concurrently due to WAL
+def get_working_store_engine(path):
+   if path is None:
+      return sa.create_engine(
+         "sqlite://", poolclass = sa.pool.StaticPool, connect_args = {'check_same_thread': False}
+      )
+
+   engine = sa.create_engine(
+      f'sqlite:///{path}', poolclass = sa.pool.StaticPool, connect_args = {'check_same_thread': False}
+   )
+
+   @sa.event.listens_for(engine, "connect")
+   def set_working_store_pragma(dbapi_connection, connection_record):
+      cursor = dbapi_connection.cursor()
+      cursor.execute("PRAGMA journal_mode=WAL;")
+      cursor.execute("PRAGMA synchronous=NORMAL;")
+      cursor.execute(f"PRAGMA cache_size={WORKING_STORE_CACHE_SIZE};")
+      cursor.execute("PRAGMA temp_store=MEMORY;")
+      cursor.close()
+
+   print(f'working store {engine.url}')
+   return engine
+
+def sqlite_backup(engine_from, engine_to, progress = None):
+   start = time.perf_counter()
+   on_progress = None
+   if progress:
+      on_progress = lambda status, remaining, total: progress('pages', total - remaining)
+
+   conn_from = engine_from.raw_connection()
+   conn_to = engine_to.raw_connection()
+   try:
+      conn_from.driver_connection.backup(conn_to.driver_connection, pages = BACKUP_PAGES, progress = on_progress)
+   finally:
+      conn_from.close()
+      conn_to.close()
+
+   print('backup {} -> {}: {:.3f}s'.format(engine_from.url, engine_to.url, time.perf_counter() - start))
+
+def flush_stats_to_str(stats):
+   if 'touched' in stats:
+      return 'backup, touched {} rows'.format(stats['touched'])
+   return 'upserted {}, deleted {} rows'.format(stats['upserted'], stats['deleted'])
+
+# partitioned schema - orm statements see only rows of week of their models
+# forked db shares Session, so week is taken from mapped class
+def scope_to_week(orm_execute_state):
+   if not (orm_execute_state.is_select or orm_execute_state.is_update or orm_execute_state.is_delete):
+      return
+   options = []
+   for mapper in orm_execute_state.all_mappers:
+      week = getattr(mapper.class_, 'partition_week', None)
+      if week is not None:
+         options.append(sa.orm.with_loader_criteria(mapper.class_, mapper.class_.week == week))
+   if options:
+      orm_execute_state.statement = orm_execute_state.statement.options(*options)
+
 @sa.event.listens_for(sa.engine.Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, connection_record):
     if isinstance(dbapi_connection, SQLite3Connection):
@@ -21,28 +100,254 @@ def _set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
 
 class Db:
-   def __init__(self, models, db_connection_str):
+   def __init__(self, models, db_connection_str, copy_chunk_size = COPY_CHUNK_SIZE, use_sqlite_backup = True, journal_path = None, lazy_load = False, working_store_path = None):
+      start = time.perf_counter()
       self.m = models
-      self.memory_db = sa.create_engine("sqlite://")
+      self.copy_chunk_size = copy_chunk_size
+      # memory db has only current week in partitioned schema
+      self.use_sqlite_backup = use_sqlite_backup and models.week is None
+      # working db - in-memory or file (working store), shared with worker threads of AsyncDbProcess
+      # name memory_db is kept for both
+      self.memory_db = get_working_store_engine(working_store_path)
       self.load_db = get_engine(db_connection_str)
 
+      # file of working store survives restart, then it's not reloaded
+      store_state = self.get_working_store_state()
+      is_store_reused = store_state != WORKING_STORE_NOT_LOADED
       self.m.Base.metadata.create_all(self.memory_db)
       self.m.Base.metadata.create_all(self.load_db)
+      self.create_missing_indexes(self.memory_db)
+      self.create_missing_indexes(self.load_db)
+
+      # tables, loaded later by load_deferred_tables, memory db can't be saved before
+      self.deferred_tables = []
+      if is_store_reused:
+         print('working store is reused, not loaded')
+      elif lazy_load and not self.is_backup_available(self.load_db, self.memory_db):
+         # page copy of whole file is faster, than reading of eager tables only - it's not deferred
+         self.deferred_tables = self.get_deferred_tables()
+         eager_tables = [x for x in self.m.Base.metadata.sorted_tables if x not in self.deferred_tables]
+         self.copy_tables(self.load_db, self.memory_db, eager_tables)
+      else:
+         self.copy_database(self.load_db, self.memory_db)
 
-      self.load_from_one_db_to_another(self.load_db, self.memory_db)
+      self.tracker = ChangeTracker()
+      self.last_flush_stats = None
+      # memory db is one sqlite connection, so units of work can't interleave
+      self.lock = asyncio.Lock()
+      # tables of previous week after fork, still flushed to persistent db
+      self.retired_tables = []
+      if is_store_reused and store_state == WORKING_STORE_CHANGED and journal_path is None:
+         # changes, not saved before crash, are unknown - compare tables completely on next save
+         # with journal they are marked by replay, it has all changes since last save
+         for table in self.m.Base.metadata.sorted_tables:
+            self.tracker.mark_table(table.name)
+      if is_store_reused or not self.is_deferred():
+         self.set_working_store_state(WORKING_STORE_CHANGED)
 
       self.Session = self.get_session(self.memory_db)
+      if self.m.week is not None:
+         sa.event.listen(self.Session, 'do_orm_execute', scope_to_week)
+      self.tracker.listen(self.Session)
+      sa.event.listen(self.Session, 'after_flush', self.after_flush)
+      sa.event.listen(self.Session, 'after_commit', self.after_commit)
+      sa.event.listen(self.Session, 'after_rollback', self.after_rollback)
       self.LoadSession = self.get_session(self.load_db)
+      self.writer = WriteBehindQueue(self.write_record_to_load_db)
+
+      self.journal = None
+      if journal_path:
+         self.journal = Journal(journal_path)
+         # writes of eager tables, done while deferred are loaded, are appended after not saved ones
+         self.journal.listen(self.Session)
+         # journal has records of all tables, replayed after all are loaded
+         if not self.is_deferred():
+            self.replay_journal()
 
       with self.Session() as s:
          last_scan_record = s.query(self.m.LastScan).first()
          print(f'last_scan: {str(last_scan_record and last_scan_record.last_scan)}')
+      print('db loaded: {:.3f}s, deferred tables: {}'.format(
+         time.perf_counter() - start, [x.name for x in self.deferred_tables]
+      ))
+
+   # db for tables of other week - same engines, sessions, tracker, writer and journal
+   # only new tables are created, nothing is copied
+   def fork(self, models):
+      db = copy.copy(self)
+      db.m = models
+      table_names = [x.name for x in models.Base.metadata.sorted_tables]
+      db.retired_tables = [x for x in self.m.Base.metadata.sorted_tables if x.name not in table_names]
+
+      models.Base.metadata.create_all(self.memory_db)
+      models.Base.metadata.create_all(self.load_db)
+      db.create_missing_indexes(self.memory_db)
+      db.create_missing_indexes(self.load_db)
+      return db
+
+   def get_flush_tables(self):
+      return [*self.retired_tables, *self.m.Base.metadata.sorted_tables]
+
+   # previous week is flushed - it's tables are not needed anymore,
+   # in partitioned schema it's rows are removed from memory db
+   def release_retired(self, week):
+      self.retired_tables = []
+      if self.m.week is None or week == self.m.week:
+         return
+      with self.memory_db.connect() as connection:
+         for table in reversed(self.m.Base.metadata.sorted_tables):
+            if 'week' in table.c:
+               connection.execute(table.delete().where(table.c.week == week))
+         connection.commit()
+
+   # for core statements on whole table, in partitioned schema - rows of current week
+   def get_week_criteria(self, table):
+      if self.m.week is None or 'week' not in table.c:
+         return []
+      return [table.c.week == self.m.week]
+
+   # roles, cells of current week and last scan are enough to start
+   def get_deferred_tables(self):
+      eager_table_names = [self.m.Role.__tablename__, self.m.Cell.__tablename__, self.m.LastScan.__tablename__]
+      return [x for x in self.m.Base.metadata.sorted_tables if x.name not in eager_table_names]
+
+   # user_version - WORKING_STORE_* state, memory db is never loaded
+   def get_working_store_state(self):
+      if self.memory_db.url.database is None:
+         return WORKING_STORE_NOT_LOADED
+      with self.memory_db.connect() as connection:
+         return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+   def set_working_store_state(self, state):
+      if self.memory_db.url.database is None:
+         return
+      with self.memory_db.connect() as connection:
+         connection.exec_driver_sql(f'PRAGMA user_version = {state}')
+         connection.commit()
+
+   def is_deferred(self):
+      return len(self.deferred_tables) > 0
+
+   # reading from persistent db is slow part, it doesn't touch memory db
+   def read_table(self, table):
+      start = time.perf_counter()
+      with self.load_db.connect() as db_from:
+         rows = [dict(row._mapping) for row in db_from.execute(
+            sa.select(table.c).where(*self.get_week_criteria(table))
+         )]
+      print('read {}: {} rows, {:.3f}s'.format(table.name, len(rows), time.perf_counter() - start))
+      return rows
+
+   def insert_deferred_rows(self, table, rows):
+      with self.memory_db.connect() as db_to:
+         # working store could be partly loaded before restart
+         db_to.execute(table.delete().where(*self.get_week_criteria(table)))
+         for chunk in chunks(rows, self.copy_chunk_size):
+            db_to.execute(table.insert(), chunk)
+         db_to.commit()
+
+   def finish_deferred_load(self):
+      self.deferred_tables = []
+      self.set_working_store_state(WORKING_STORE_CHANGED)
+      if self.journal:
+         self.replay_journal()
+
+   def load_deferred_tables(self):
+      for table in self.deferred_tables:
+         self.insert_deferred_rows(table, self.read_table(table))
+      self.finish_deferred_load()
+
+   # create_all skips existed tables, indexes added later are created separately
+   def create_missing_indexes(self, engine):
+      for table in self.m.Base.metadata.sorted_tables:
+         for index in table.indexes:
+            index.create(bind = engine, checkfirst = True)
+
+   def replay_journal(self):
+      def on_replayed(table, pk):
+         if pk is None:
+            self.tracker.mark_table(table.name)
+         else:
+            self.tracker.mark(table.name, pk)
+
+      self.load_journal_retired_tables()
+      tables = dict([(x.name, x) for x in self.get_flush_tables()])
+      with self.memory_db.connect() as mdb:
+         self.journal.replay(mdb, tables, on_replayed)
+
+   # weeks, swapped before crash, could have changes in journal only - week tables are loaded
+   # from persistent db and flushed, as retired tables after fork
+   def load_journal_retired_tables(self):
+      table_names = set([x.name for x in self.get_flush_tables()])
+      weeks = set()
+      for table_name in self.journal.get_table_names():
+         if table_name not in table_names and (match:= WEEK_TABLE_PATTERN.match(table_name)):
+            weeks.add(match.group(2))
+
+      for week_postfix in sorted(weeks):
+         week_table_names = {'Cell': 'cell_' + week_postfix, 'UserRecord': 'user_record_' + week_postfix}
+         models = generate_models({
+            **dict([(x, getattr(self.m, x).__tablename__) for x in ['Role', 'LastScan', 'UserConfig', 'ColorScheme', 'MapConfig']]),
+            **week_table_names,
+         })
+         tables = [x for x in models.Base.metadata.sorted_tables if x.name in week_table_names.values()]
+         for table in tables:
+            table.create(bind = self.load_db, checkfirst = True)
+            table.create(bind = self.memory_db, checkfirst = True)
+         self.copy_tables(self.load_db, self.memory_db, tables)
+         self.retired_tables.extend(tables)
+         print(f'week {week_postfix} is in journal, loaded as retired')
+
+   def after_flush(self, session, flush_context):
+      session.info['is_changed'] = True
+
+   # records for persistent db are written only, if memory db transaction was commited
+   def after_commit(self, session):
+      session.info.pop('is_changed', None)
+      for args in session.info.pop('write_behind', []):
+         self.writer.put(*args)
+
+   def after_rollback(self, session):
+      session.info.pop('is_changed', None)
+      session.info.pop('write_behind', None)
+
+   # for records, changed by statements, which are not tracked by session flush
+   def record_changed(self, session, obj):
+      self.tracker.mark_instance(obj)
+      if self.journal:
+         session.info.setdefault('journal', []).append(self.journal.build_entry('upsert', obj))
+      session.info['is_changed'] = True
+
+   # same, but for rows of core statements, row - dict by column names
+   def rows_changed(self, session, table, rows):
+      pk_names = [c.name for c in table.primary_key.columns]
+      for row in rows:
+         self.tracker.mark(table.name, tuple(row[x] for x in pk_names))
+         if self.journal:
+            session.info.setdefault('journal', []).append(self.journal.build_row_entry('upsert', table, row))
+      session.info['is_changed'] = True
+
+   def table_cleared(self, table):
+      self.tracker.mark_table(table.name)
+      if self.journal:
+         self.journal.table_cleared(table)
+
+   def close(self):
+      self.writer.stop()
+      # working store is same, as persistent db - next start doesn't compare tables
+      if not self.is_deferred() and self.tracker.is_empty():
+         self.set_working_store_state(WORKING_STORE_SAVED)
+      if self.journal:
+         self.journal.close()
+      self.memory_db.dispose()
+      self.load_db.dispose()
 
    def drop_tables(self):
+      self.writer.flush()
       self.m.Base.metadata.drop_all(bind = self.load_db)
 
    def get_session(self, engine):
-      Session = sa.orm.sessionmaker()
+      Session = sa.orm.sessionmaker(expire_on_commit = False)
       Session.configure(bind=engine)
       return Session
    
@@ -60,9 +365,40 @@ class Db:
       record = session.query(model).filter_by(**filters).first()
       return record
 
-   def add_record_to_load_db_by_record(self, record, model):
+   def get_primary_key_by_hash(self, hash, model):
+      pk = []
+      for key in inspect(model).primary_key:
+         if key.name not in hash:
+            return None
+         pk.append(hash[key.name])
+      return tuple(pk)
+
+   def add_record_to_load_db_by_record(self, record, model, session = None):
       relationships = inspect(model).relationships.keys()
       hash = copy_dict_with_exclude(record.__dict__, ['_sa_instance_state', *relationships])
+      self.put_to_writer(session, 'upsert', model, hash)
+
+   def delete_record_from_load_db_by_record(self, record, model, session = None):
+      relationships = inspect(model).relationships.keys()
+      hash = copy_dict_with_exclude(record.__dict__, ['_sa_instance_state', *relationships])
+      self.put_to_writer(session, 'delete', model, hash)
+
+   # with session - postponed till memory db commit
+   def put_to_writer(self, session, op, model, hash):
+      args = (op, model, hash, self.get_primary_key_by_hash(hash, model))
+      if session is None:
+         self.writer.put(*args)
+      else:
+         session.info.setdefault('write_behind', []).append(args)
+         session.info['is_changed'] = True
+
+   def write_record_to_load_db(self, op, model, hash):
+      if op == 'upsert':
+         self.upsert_record_to_load_db(model, hash)
+      elif op == 'delete':
+         self.delete_record_from_load_db(model, hash)
+
+   def upsert_record_to_load_db(self, model, hash):
       with self.LoadSession() as s:
          obj = self.query_record_by_hash_and_model(hash, model, s)
          if obj is None:
@@ -74,8 +410,7 @@ class Db:
          s.add(obj)
          s.commit()
 
-   def delete_record_from_load_db_by_record(self, record, model):
-      hash = copy_dict_with_exclude(record.__dict__, ['_sa_instance_state'])
+   def delete_record_from_load_db(self, model, hash):
       with self.LoadSession() as s:
          obj = self.query_record_by_hash_and_model(hash, model, s)
          if obj:
@@ -83,13 +418,124 @@ class Db:
             s.commit()
 
    def save_to_load_db(self):
-      self.load_from_one_db_to_another(self.memory_db, self.load_db)
+      if self.is_deferred():
+         # persistent db would lose records, not loaded yet
+         print('deferred tables are not loaded, nothing saved')
+         return {'upserted': 0, 'deleted': 0}
+
+      self.writer.flush()
+      keys, tables = self.tracker.pop()
+      try:
+         if self.is_backup_available(self.memory_db, self.load_db):
+            stats = self.backup_changes(keys, tables)
+         else:
+            stats = self.flush_changes(keys, tables)
+      except Exception:
+         self.tracker.restore(keys, tables)
+         raise
+
+      if self.journal:
+         self.journal.truncate()
+      self.last_flush_stats = stats
+      return stats
+
+   def backup_changes(self, keys, tables):
+      touched = sum([len(x) for x in keys.values()])
+      if touched == 0 and len(tables) == 0:
+         return {'touched': 0}
+
+      sqlite_backup(self.memory_db, self.load_db)
+      return {'touched': touched}
+
+   def flush_changes(self, keys, tables):
+      stats = {'upserted': 0, 'deleted': 0}
+      sorted_tables = self.get_flush_tables()
+      with self.memory_db.connect() as db_from:
+         with self.load_db.connect() as db_to:
+            # children first, otherwise foreign keys would fire
+            for table in reversed(sorted_tables):
+               if table.name in tables:
+                  stats['deleted'] += db_to.execute(
+                     table.delete().where(*self.get_week_criteria(table))
+                  ).rowcount
+
+            deleted_pks = {}
+            for table in sorted_tables:
+               if table.name in tables:
+                  stats['upserted'] += self.copy_table(db_from, db_to, table)
+               elif table.name in keys:
+                  upserted, deleted_pks[table.name] = self.flush_table_upserts(db_from, db_to, table, keys[table.name])
+                  stats['upserted'] += upserted
+
+            for table in reversed(sorted_tables):
+               if pks:= deleted_pks.get(table.name):
+                  for chunk in chunks(pks, UPSERT_CHUNK_SIZE):
+                     db_to.execute(table.delete().where(filter_by_pks(table, chunk)))
+                  stats['deleted'] += len(pks)
+
+            db_to.commit()
+      return stats
+
+   def get_existed_rows(self, db_from, table, pks):
+      rows = []
+      for chunk in chunks(list(pks), UPSERT_CHUNK_SIZE):
+         rows.extend(db_from.execute(sa.select(table.c).where(filter_by_pks(table, chunk))))
+      return rows
+
+   def flush_table_upserts(self, db_from, db_to, table, pks):
+      pk_names = [c.name for c in table.primary_key.columns]
+      existed_pks = set()
+      rows = []
+      for row in self.get_existed_rows(db_from, table, pks):
+         existed_pks.add(tuple(getattr(row, x) for x in pk_names))
+         rows.append(dict(row._mapping))
+
+      for chunk in chunks(rows, UPSERT_CHUNK_SIZE):
+         upsert_rows(db_to, table, chunk)
+
+      # touched, but not existed in memory anymore -> was deleted
+      deleted_pks = [pk for pk in pks if pk not in existed_pks]
+      return len(rows), deleted_pks
+
+   def copy_table(self, db_from, db_to, table, progress = None):
+      start = time.perf_counter()
+      copied = 0
+      # streams source rows by chunks, each chunk is inserted with one executemany
+      result = db_from.execution_options(yield_per = self.copy_chunk_size).execute(
+         sa.select(table.c).where(*self.get_week_criteria(table))
+      )
+      for partition in result.partitions():
+         db_to.execute(table.insert(), [row._mapping for row in partition])
+         copied += len(partition)
+         if progress:
+            progress(table.name, copied)
+
+      print('copied {}: {} rows, {:.3f}s'.format(table.name, copied, time.perf_counter() - start))
+      return copied
+
+   # backup replaces whole database - only if both have same tables, otherwise tables of previous weeks
+   # would be copied to memory on load or lost in file on save
+   def is_backup_available(self, engine_from, engine_to):
+      if not (self.use_sqlite_backup and is_sqlite(engine_from) and is_sqlite(engine_to)):
+         return False
+      return set(sa.inspect(engine_from).get_table_names()) == set(sa.inspect(engine_to).get_table_names())
+
+   # sqlite -> sqlite copies whole database page by page, if it has only live tables
+   def copy_database(self, engine_from, engine_to, progress = None):
+      if self.is_backup_available(engine_from, engine_to):
+         sqlite_backup(engine_from, engine_to, progress)
+      else:
+         self.load_from_one_db_to_another(engine_from, engine_to, progress)
+
+   def load_from_one_db_to_another(self, engine_from, engine_to, progress = None):
+      self.copy_tables(engine_from, engine_to, self.m.Base.metadata.sorted_tables, progress)
 
-   def load_from_one_db_to_another(self, engine_from, engine_to):
+   # tables - in order of sorted_tables
+   def copy_tables(self, engine_from, engine_to, tables, progress = None):
       with engine_from.connect() as db_from:
          with engine_to.connect() as db_to:
-            for table in self.m.Base.metadata.sorted_tables:
-               db_to.execute(table.delete())
-               for row in db_from.execute(sa.select(table.c)):
-                  db_to.execute(table.insert().values(row._mapping))
-            db_to.commit()
\ No newline at end of file
+            for table in reversed(tables):
+               db_to.execute(table.delete().where(*self.get_week_criteria(table)))
+            for table in tables:
+               self.copy_table(db_from, db_to, table, progress)
+            db_to.commit()
@@ -0,0 +1,149 @@
+import os
+from pathlib import Path
+import time
+import json
+from datetime import datetime
+import sqlalchemy as sa
+
+from .db_util import upsert_rows, filter_by_pks
+
+JOURNAL_FSYNC_GROUP = 32
+JOURNAL_FSYNC_INTERVAL = 1.0
+
+def encode_value(column, value):
+   if value is None:
+      return None
+   if isinstance(column.type, sa.TypeDecorator):
+      value = column.type.process_bind_param(value, None)
+   if isinstance(value, datetime):
+      value = value.isoformat()
+   return value
+
+def decode_value(column, value):
+   if value is None:
+      return None
+   if isinstance(column.type, sa.DateTime):
+      value = datetime.fromisoformat(value)
+   if isinstance(column.type, sa.TypeDecorator):
+      value = column.type.process_result_value(value, None)
+   return value
+
+# append-only log of memory db row changes, written on every commit
+# replayed on start, if bot died before memory db was dumped
+class Journal:
+   def __init__(self, path):
+      self.path = path
+      Path(path).parent.mkdir(parents=True, exist_ok=True)
+      self.file = open(path, 'a', encoding='utf8')
+      self.not_synced = 0
+      self.last_sync = time.monotonic()
+
+   def listen(self, Session):
+      sa.event.listen(Session, 'after_flush', self.after_flush)
+      sa.event.listen(Session, 'after_commit', self.after_commit)
+      sa.event.listen(Session, 'after_rollback', self.after_rollback)
+
+   def after_flush(self, session, flush_context):
+      entries = session.info.setdefault('journal', [])
+      for obj in [*session.new, *session.dirty]:
+         entries.append(self.build_entry('upsert', obj))
+      for obj in session.deleted:
+         entries.append(self.build_entry('delete', obj))
+
+   def after_commit(self, session):
+      entries = session.info.pop('journal', [])
+      self.append(entries)
+
+   def after_rollback(self, session):
+      session.info.pop('journal', None)
+
+   def build_entry(self, op, obj):
+      mapper = sa.inspect(obj).mapper
+      row = {}
+      for column in mapper.local_table.columns:
+         attr = mapper.get_property_by_column(column)
+         row[column.name] = getattr(obj, attr.key)
+      return self.build_row_entry(op, mapper.local_table, row)
+
+   def build_row_entry(self, op, table, row):
+      columns = table.primary_key.columns if op == 'delete' else table.columns
+      encoded_row = {}
+      for column in columns:
+         encoded_row[column.name] = encode_value(column, row[column.name])
+      return {'op': op, 'table': table.name, 'row': encoded_row}
+
+   def table_cleared(self, table):
+      self.append([{'op': 'clear', 'table': table.name}])
+
+   def append(self, entries):
+      if len(entries) == 0:
+         return
+      for entry in entries:
+         self.file.write(json.dumps(entry) + '\n')
+      self.file.flush()
+      self.not_synced += len(entries)
+
+      is_interval_passed = time.monotonic() - self.last_sync > JOURNAL_FSYNC_INTERVAL
+      if self.not_synced >= JOURNAL_FSYNC_GROUP or is_interval_passed:
+         self.sync()
+
+   def sync(self):
+      if self.not_synced == 0:
+         return
+      os.fsync(self.file.fileno())
+      self.not_synced = 0
+      self.last_sync = time.monotonic()
+
+   def truncate(self):
+      self.file.truncate(0)
+      os.fsync(self.file.fileno())
+      self.not_synced = 0
+      self.last_sync = time.monotonic()
+
+   def close(self):
+      self.sync()
+      self.file.close()
+
+   def read(self):
+      entries = []
+      with open(self.path, 'r', encoding='utf8') as f:
+         for line in f:
+            try:
+               entries.append(json.loads(line))
+            except json.JSONDecodeError:
+               # last line could be cut by crash
+               break
+      return entries
+
+   def get_table_names(self):
+      return set([x['table'] for x in self.read()])
+
+   # tables - by name, entries of other tables are skipped
+   def replay(self, connection, tables, on_replayed):
+      entries = self.read()
+      skipped = 0
+      for entry in entries:
+         table = tables.get(entry['table'])
+         if table is None:
+            skipped += 1
+            continue
+
+         if entry['op'] == 'clear':
+            connection.execute(table.delete())
+            on_replayed(table, None)
+            continue
+
+         row = {}
+         for name, value in entry['row'].items():
+            row[name] = decode_value(table.c[name], value)
+         pk = tuple(row[c.name] for c in table.primary_key.columns)
+
+         if entry['op'] == 'upsert':
+            upsert_rows(connection, table, [row])
+         elif entry['op'] == 'delete':
+            connection.execute(table.delete().where(filter_by_pks(table, [pk])))
+         on_replayed(table, pk)
+
+      connection.commit()
+      print(f'journal replayed: {len(entries) - skipped} entries, skipped {skipped}')
+      return len(entries) - skipped
@@ -1,19 +1,25 @@
+from contextvars import ContextVar
+from contextlib import contextmanager, asynccontextmanager
+import sqlalchemy as sa
+from sqlalchemy.orm.attributes import set_committed_value
+
 from .const import CellType, DEFAULT_USER_CONFIG
 from .utils import time_to_global_timezone
+from .db_util import get_dialect_insert
 
 def decorator(f):
    def session_wrap(self, *args, **kwargs):
-      if self.is_session_invoked_outer:
+      with self.session_scope():
          return f(self, *args, **kwargs)
-      
-      self._start_session()
-      result = f(self, *args, **kwargs)
-      self._end_session()
-   
-      return result
    
    return session_wrap
 
+class SessionScope:
+   def __init__(self, session):
+      self.session = session
+      self.is_failed = False
+      self.is_rolled_back = False
+
 def for_all_methods(decorator, include_with_partial, exclude):
    def decorate(cls):
       for attr in cls.__dict__: # there's propably a better way to do this
@@ -31,15 +37,24 @@ def for_all_methods(decorator, include_with_partial, exclude):
       return cls
    return decorate
 
-@for_all_methods(decorator, ['cell', 'last_scan', 'user', 'map', 'color_scheme'], ['get_array_of_cell_orm_cell_type_fields', 'build_counters_by_cell'])
+@for_all_methods(decorator, ['cell', 'last_scan', 'user', 'map', 'color_scheme'], [
+   'get_array_of_cell_orm_cell_type_fields', 'build_counters_by_cell',
+   'upsert_user_record_rows', 'apply_cell_deltas', 'sync_identity_map',
+])
 class DbProcess:
    def __init__(self, db):
       self.db = db
       self.cell_query_fields = self.get_array_of_cell_orm_cell_type_fields()
 
-      self.is_session_invoked_outer = False
-      self._is_opened = False
-      self.s = None
+      # session of current call or unit of work, each asyncio task has own context
+      self._scope = ContextVar(f'db_process_scope_{id(self)}', default = None)
+
+   @property
+   def s(self):
+      scope = self._scope.get()
+      if scope is not None:
+         return scope.session
+      return None
 
    def get_array_of_cell_orm_cell_type_fields(self):
       arr = []
@@ -47,28 +62,67 @@ class DbProcess:
          arr.append(getattr(self.db.m.Cell, ct.name))
       return arr
 
-   def _start_session(self):
-      if self._is_opened:
+   # joins outer scope, if it's opened, otherwise session lives till the end of block
+   @contextmanager
+   def session_scope(self):
+      scope = self._scope.get()
+      if scope is not None:
+         try:
+            yield scope
+         except BaseException:
+            scope.is_failed = True
+            raise
          return
-      
-      self._is_opened = True
-      self.s = self.db.Session()
 
-   def _end_session(self):
-      if not self._is_opened:
+      scope = SessionScope(self.db.Session())
+      token = self._scope.set(scope)
+      try:
+         yield scope
+      except BaseException:
+         scope.is_failed = True
+         raise
+      finally:
+         self._scope.reset(token)
+         self._close_scope(scope)
+
+   def _close_scope(self, scope):
+      s = scope.session
+      try:
+         # is_changed - set on flush and by statements, executed without unit of work
+         is_changed = s.new or s.dirty or s.deleted or s.info.get('is_changed', False)
+         if scope.is_failed:
+            scope.is_rolled_back = bool(is_changed)
+            s.rollback()
+         elif is_changed:
+            s.commit()
+      finally:
+         s.close()
+
+   # one transaction for all calls inside, e.g. per discord message
+   # on_rolled_back - async, awaited under db lock, before next unit of work starts
+   @asynccontextmanager
+   async def unit_of_work(self, on_rolled_back = None):
+      if self._scope.get() is not None:
+         with self.session_scope() as scope:
+            yield scope
          return
-      self._is_opened = False
-      if self.s.new or self.s.dirty or self.s.deleted:
-         self.s.commit()
-      self.s.close()
 
-   def start_session(self):
-      self._start_session()
-      self.is_session_invoked_outer = True
+      async with self.db.lock:
+         scope = None
+         try:
+            with self.session_scope() as scope:
+               yield scope
+         finally:
+            if scope is not None and scope.is_rolled_back and on_rolled_back is not None:
+               await on_rolled_back()
+
+   def in_unit_of_work(self):
+      return self._scope.get() is not None
 
-   def end_session(self):
-      self._end_session()
-      self.is_session_invoked_outer = False
+   def set_rollback_only(self):
+      scope = self._scope.get()
+      if scope is not None:
+         scope.is_failed = True
 
    def get_all_cells(self, map_type):
       return self.s.query(self.db.m.Cell).filter(
@@ -84,6 +138,17 @@ class DbProcess:
          counters.append(val)
       return counters
    
+   # core read for bulk queries, no orm objects and type decorators per row
+   # returns [(x, y, counters)]
+   def iter_cell_counters(self, map_type):
+      table = self.db.m.Cell.__table__
+      stmt = sa.select(
+         # counters of old rows could be null, as in build_counters_by_cell
+         table.c.x, table.c.y, *[sa.func.coalesce(table.c[x.name], 0) for x in CellType]
+      ).where(table.c.map_type == map_type, *self.db.get_week_criteria(table))
+
+      return [(row[0], row[1], list(row[2:])) for row in self.s.execute(stmt)]
+
    def get_cell_type_counters(self, x, y, map_type):
       cell = self.s.query(self.db.m.Cell).filter(
          self.db.m.Cell.x   == x,
@@ -93,22 +158,44 @@ class DbProcess:
       if cell is not None:
          return self.build_counters_by_cell(cell)
 
-   def update_cell(self, x, y, cell_type, map_type, delta):
-      cell = self.s.query(self.db.m.Cell).filter(
-         self.db.m.Cell.x   == x,
-         self.db.m.Cell.y   == y,
-         self.db.m.Cell.map_type == map_type,
-      ).first()
-      if cell is None:
-         cell = self.db.m.Cell(x = x, y = y, map_type = map_type)
-         setattr(cell, cell_type.name, 0)
+   # partitioned schema - week of core inserted rows, primary key is needed for tracking
+   def get_week_values(self):
+      if self.db.m.week is None:
+         return {}
+      return {'week': self.db.m.week}
+
+   def get_insert(self):
+      return get_dialect_insert(self.s.get_bind().dialect.name)
+
+   def upsert_returning(self, stmt, model, filters):
+      if self.s.get_bind().dialect.insert_returning:
+         obj = self.s.execute(
+            stmt.returning(model), execution_options = {'populate_existing': True}
+         ).scalar()
+      else:
+         self.s.execute(stmt)
+         obj = self.s.query(model).filter(*filters).populate_existing().first()
 
-      val = getattr(cell, cell_type.name)
-      if (val + delta) >= 0:
-         val += delta
-         setattr(cell, cell_type.name, val)
+      if obj is not None:
+         self.db.record_changed(self.s, obj)
+      return obj
 
-      self.s.add(cell)
+   def update_cell(self, x, y, cell_type, map_type, delta):
+      Cell = self.db.m.Cell
+      counter = getattr(Cell, cell_type.name)
+      # counter never goes below 0
+      new_counter = sa.case((counter + delta >= 0, counter + delta), else_ = counter)
+
+      stmt = self.get_insert()(Cell).values(
+         x = x, y = y, map_type = map_type, **{cell_type.name: max(delta, 0)}
+      )
+      stmt = stmt.on_conflict_do_update(
+         index_elements = Cell.__table__.primary_key.columns,
+         set_ = {cell_type.name: new_counter},
+      )
+      cell = self.upsert_returning(stmt, Cell, [
+         Cell.x == x, Cell.y == y, Cell.map_type == map_type,
+      ])
       return self.build_counters_by_cell(cell)
 
    def get_last_scan(self):
@@ -176,6 +263,30 @@ class DbProcess:
          self.db.m.UserRecord.map_type == map_type,
       ).order_by(self.db.m.UserRecord.x, self.db.m.UserRecord.y).all()
    
+   # core read for bulk queries, returns [tuple of columns] ordered by coords
+   def iter_user_records(self, map_type, columns = ('x', 'y', 'cell_type'), user_id = None):
+      table = self.db.m.UserRecord.__table__
+      select_columns = []
+      for name in columns:
+         column = table.c[name]
+         if name == 'cell_type':
+            # converted by lookup, cheaper than type decorator
+            column = sa.type_coerce(column, sa.Integer)
+         select_columns.append(column)
+
+      stmt = sa.select(*select_columns).where(table.c.map_type == map_type, *self.db.get_week_criteria(table))
+      if user_id is not None:
+         stmt = stmt.where(table.c.user_id == user_id)
+      stmt = stmt.order_by(table.c.x, table.c.y)
+
+      rows = self.s.execute(stmt).all()
+      if 'cell_type' not in columns:
+         return [tuple(row) for row in rows]
+
+      i = columns.index('cell_type')
+      cell_types = {x.value: x for x in CellType}
+      return [(*row[:i], cell_types[row[i]], *row[i+1:]) for row in rows]
+
    def get_user_record_by_map(self, map_type):
       return self.s.query(self.db.m.UserRecord).filter(
          self.db.m.UserRecord.map_type == map_type,
@@ -196,23 +307,21 @@ class DbProcess:
       ).order_by(self.db.m.UserRecord.cell_type).all()
 
    def update_user_record(self, user_id, x, y, cell_type, map_type, time):
-      user_record = self.s.query(self.db.m.UserRecord).filter(
-         self.db.m.UserRecord.user_id == user_id, 
-         self.db.m.UserRecord.x == x, 
-         self.db.m.UserRecord.y == y,
-         self.db.m.UserRecord.map_type == map_type
-      ).first()
-      # don't update field time
-      if user_record and user_record.cell_type == cell_type:
-         return
-      if user_record is None:      
-         user_record = self.db.m.UserRecord(
-            user_id = user_id, x = x, y = y, map_type = map_type)
-         
-      user_record.time = time
-      user_record.cell_type = cell_type
-
-      self.s.add(user_record)
+      UserRecord = self.db.m.UserRecord
+      stmt = self.get_insert()(UserRecord).values(
+         user_id = user_id, x = x, y = y, map_type = map_type,
+         cell_type = cell_type, time = time,
+      )
+      stmt = stmt.on_conflict_do_update(
+         index_elements = UserRecord.__table__.primary_key.columns,
+         set_ = {'cell_type': stmt.excluded.cell_type, 'time': stmt.excluded.time},
+         # don't update field time
+         where = UserRecord.cell_type != stmt.excluded.cell_type,
+      )
+      self.upsert_returning(stmt, UserRecord, [
+         UserRecord.user_id == user_id, UserRecord.x == x, 
+         UserRecord.y == y, UserRecord.map_type == map_type,
+      ])
 
    def delete_user_record(self, user_id, x, y, map_type):
       user_record = self.s.query(self.db.m.UserRecord).filter(
@@ -229,6 +338,127 @@ class DbProcess:
       self.update_user_record(user_id, *coords, cell_type, map_type, time)
       return self.update_cell(*coords, cell_type, map_type, +1)
 
+   # reports - [(x, y, cell_type)], applied in few statements instead of statements per coords
+   # returns cell types, user had before each report and new counters by (x, y)
+   # user_cell_types - (x, y) -> cell type of user records, if known by caller, select is skipped
+   def apply_user_reports(self, user_id, map_type, reports, time, user_cell_types = None):
+      UserRecord = self.db.m.UserRecord
+      coords_arr = list({(x, y) for x, y, _ in reports})
+      if len(coords_arr) == 0:
+         return [], {}
+
+      if user_cell_types is not None:
+         user_cell_types = dict(user_cell_types)
+      else:
+         user_cell_types = {}
+         for x, y, cell_type in self.s.execute(
+            sa.select(UserRecord.x, UserRecord.y, UserRecord.cell_type).where(
+               UserRecord.user_id == user_id,
+               UserRecord.map_type == map_type,
+               sa.tuple_(UserRecord.x, UserRecord.y).in_(coords_arr),
+            )
+         ):
+            user_cell_types[(x, y)] = cell_type
+
+      cell_types_was = []
+      deltas = {}
+      for x, y, cell_type_new in reports:
+         cell_type_was = user_cell_types.get((x, y))
+         cell_types_was.append(cell_type_was)
+         if cell_type_was == cell_type_new:
+            continue
+
+         cell_deltas = deltas.setdefault((x, y), {})
+         if cell_type_was is not None:
+            cell_deltas[cell_type_was.name] = cell_deltas.get(cell_type_was.name, 0) - 1
+         cell_deltas[cell_type_new.name] = cell_deltas.get(cell_type_new.name, 0) + 1
+         user_cell_types[(x, y)] = cell_type_new
+
+      if len(deltas) == 0:
+         return cell_types_was, {}
+
+      record_rows = []
+      for (x, y) in deltas:
+         record_rows.append({
+            **self.get_week_values(),
+            'user_id': user_id, 'x': x, 'y': y, 'map_type': map_type,
+            'cell_type': user_cell_types[(x, y)], 'time': time,
+         })
+      self.upsert_user_record_rows(record_rows)
+      cell_rows = self.apply_cell_deltas(map_type, deltas)
+
+      counters_by_coords = {}
+      for row in cell_rows:
+         counters_by_coords[(row['x'], row['y'])] = [row[x.name] or 0 for x in CellType]
+
+      return cell_types_was, counters_by_coords
+
+   def upsert_user_record_rows(self, rows):
+      table = self.db.m.UserRecord.__table__
+      stmt = self.get_insert()(table)
+      stmt = stmt.on_conflict_do_update(
+         index_elements = table.primary_key.columns,
+         set_ = {'cell_type': stmt.excluded.cell_type, 'time': stmt.excluded.time},
+      )
+      self.s.execute(stmt, rows)
+      self.sync_identity_map(self.db.m.UserRecord, rows)
+      self.db.rows_changed(self.s, table, rows)
+
+   # deltas - (x, y) -> {cell_type_name: delta}, executed as one executemany
+   # returns rows of changed cells - dicts by column names
+   def apply_cell_deltas(self, map_type, deltas):
+      table = self.db.m.Cell.__table__
+      names = [x.name for x in CellType]
+
+      values = {'x': sa.bindparam('c_x'), 'y': sa.bindparam('c_y'), 'map_type': map_type}
+      set_ = {}
+      for name in names:
+         column = table.c[name]
+         delta = sa.bindparam(f'd_{name}', type_ = sa.Integer)
+         values[name] = sa.bindparam(f'i_{name}', type_ = sa.Integer)
+         # counter never goes below 0
+         set_[name] = sa.case((column + delta >= 0, column + delta), else_ = column)
+
+      stmt = self.get_insert()(table).values(**values)
+      stmt = stmt.on_conflict_do_update(
+         index_elements = table.primary_key.columns,
+         set_ = set_,
+      )
+
+      params = []
+      for (x, y), cell_deltas in deltas.items():
+         param = {'c_x': x, 'c_y': y}
+         for name in names:
+            delta = cell_deltas.get(name, 0)
+            param[f'd_{name}'] = delta
+            param[f'i_{name}'] = max(delta, 0)
+         params.append(param)
+
+      # changed rows are returned by upsert itself, without select after it
+      if self.s.get_bind().dialect.insert_executemany_returning:
+         rows = [dict(x._mapping) for x in self.s.execute(stmt.returning(*table.c), params)]
+      else:
+         self.s.execute(stmt, params)
+         rows = [dict(x._mapping) for x in self.s.execute(sa.select(table.c).where(
+            table.c.map_type == map_type,
+            sa.tuple_(table.c.x, table.c.y).in_(list(deltas.keys())),
+            *self.db.get_week_criteria(table),
+         ))]
+      self.sync_identity_map(self.db.m.Cell, rows)
+      self.db.rows_changed(self.s, table, rows)
+      return rows
+
+   # core statements bypass orm, objects, loaded in session before, get new values
+   def sync_identity_map(self, model, rows):
+      pk_names = [x.name for x in model.__table__.primary_key.columns]
+      for row in rows:
+         key = self.s.identity_key(model, tuple(row[x] for x in pk_names))
+         obj = self.s.identity_map.get(key)
+         if obj is None:
+            continue
+         for name, value in row.items():
+            set_committed_value(obj, name, value)
+
    def delete_user_record_and_update_cell(self, user_id, coords, cell_type, map_type):
       self.delete_user_record(user_id, *coords, map_type)
       self.update_cell(*coords, cell_type, map_type, -1)
@@ -265,7 +495,7 @@ class DbProcess:
       for field, value in user_config_dict.items():
          setattr(user_config, field, value)
 
-      self.db.add_record_to_load_db_by_record(user_config, self.db.m.UserConfig)
+      self.db.add_record_to_load_db_by_record(user_config, self.db.m.UserConfig, self.s)
       self.s.add(user_config)
 
    def delete_user_config(self, user_id):
@@ -276,7 +506,7 @@ class DbProcess:
       ).first()
 
       if config is not None:
-         self.db.delete_record_from_load_db_by_record(config, self.db.m.UserConfig)
+         self.db.delete_record_from_load_db_by_record(config, self.db.m.UserConfig, self.s)
          self.s.delete(config)
       
    def get_map_max_amount(self, map_type, cell_name):
@@ -329,7 +559,7 @@ class DbProcess:
       for field, value in color_scheme_dict.items():
          setattr(color_scheme, field, value)
       
-      self.db.add_record_to_load_db_by_record(color_scheme, self.db.m.ColorScheme)
+      self.db.add_record_to_load_db_by_record(color_scheme, self.db.m.ColorScheme, self.s)
 
       self.s.add(color_scheme)
    
@@ -348,10 +578,10 @@ class DbProcess:
          if not user_config.is_subscribed:
             continue
          user_config.is_subscribed = False
-         self.db.add_record_to_load_db_by_record(user_config, self.db.m.UserConfig)
+         self.db.add_record_to_load_db_by_record(user_config, self.db.m.UserConfig, self.s)
          self.s.merge(user_config)
 
-      self.db.delete_record_from_load_db_by_record(scheme, self.db.m.ColorScheme)
+      self.db.delete_record_from_load_db_by_record(scheme, self.db.m.ColorScheme, self.s)
       self.s.delete(scheme)
 
    def search_color_schemes(self, user_id, partial_name):
@@ -0,0 +1,46 @@
+import sqlalchemy as sa
+
+class ChangeTracker:
+   def __init__(self):
+      # table_name -> set of primary key tuples, touched since last flush
+      self.keys = {}
+      # tables, changed in bulk (core delete etc.), flushed completely
+      self.tables = set()
+
+   def listen(self, Session):
+      sa.event.listen(Session, 'after_flush', self.after_flush)
+
+   def after_flush(self, session, flush_context):
+      for obj in [*session.new, *session.dirty, *session.deleted]:
+         self.mark_instance(obj)
+
+   def mark_instance(self, obj):
+      mapper = sa.inspect(obj).mapper
+      pk = tuple(mapper.primary_key_from_instance(obj))
+      self.mark(mapper.local_table.name, pk)
+
+   def mark(self, table_name, pk):
+      if table_name in self.tables:
+         return
+      if table_name not in self.keys:
+         self.keys[table_name] = set()
+      self.keys[table_name].add(pk)
+
+   def mark_table(self, table_name):
+      self.tables.add(table_name)
+      self.keys.pop(table_name, None)
+
+   def is_empty(self):
+      return len(self.keys) == 0 and len(self.tables) == 0
+
+   def pop(self):
+      keys, tables = self.keys, self.tables
+      self.keys, self.tables = {}, set()
+      return keys, tables
+
+   def restore(self, keys, tables):
+      for table_name in tables:
+         self.mark_table(table_name)
+      for table_name, pks in keys.items():
+         for pk in pks:
+            self.mark(table_name, pk)
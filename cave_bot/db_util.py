@@ -0,0 +1,58 @@
+import sqlalchemy as sa
+
+def is_sqlite(engine):
+   return engine.dialect.name == 'sqlite'
+
+def get_dialect_insert(dialect_name):
+   if dialect_name == 'sqlite':
+      from sqlalchemy.dialects.sqlite import insert
+      return insert
+   if dialect_name == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+      return insert
+   if dialect_name == 'mysql':
+      from sqlalchemy.dialects.mysql import insert
+      return insert
+   return None
+
+def get_upsert_stmt(dialect_name, table):
+   insert = get_dialect_insert(dialect_name)
+   if insert is None:
+      return None
+
+   pk_names = [c.name for c in table.primary_key.columns]
+   other_names = [c.name for c in table.columns if c.name not in pk_names]
+   stmt = insert(table)
+   if dialect_name == 'mysql':
+      if len(other_names) == 0:
+         return stmt.prefix_with('IGNORE')
+      return stmt.on_duplicate_key_update({x: stmt.inserted[x] for x in other_names})
+
+   if len(other_names) == 0:
+      return stmt.on_conflict_do_nothing(index_elements = pk_names)
+   return stmt.on_conflict_do_update(
+      index_elements = pk_names, 
+      set_ = {x: stmt.excluded[x] for x in other_names}
+   )
+
+def filter_by_pks(table, pks):
+   pk_cols = list(table.primary_key.columns)
+   if len(pk_cols) == 1:
+      return pk_cols[0].in_([pk[0] for pk in pks])
+   return sa.tuple_(*pk_cols).in_(pks)
+
+def upsert_rows(connection, table, rows):
+   stmt = get_upsert_stmt(connection.dialect.name, table)
+   if stmt is not None:
+      connection.execute(stmt, rows)
+      return
+
+   # unknown dialect - delete + insert by primary keys
+   pk_names = [c.name for c in table.primary_key.columns]
+   pks = [tuple(row[x] for x in pk_names) for row in rows]
+   connection.execute(table.delete().where(filter_by_pks(table, pks)))
+   connection.execute(table.insert(), rows)
+
+def chunks(arr, size):
+   for i in range(0, len(arr), size):
+      yield arr[i:i + size]
@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import OrderedDict
+
+WRITE_QUEUE_SIZE = 1000
+
+# background thread, writing records to persistent db
+# repeated writes of one primary key are coalesced into the last one
+# writes over maxsize are dropped - changed rows are marked by ChangeTracker, next save sends them
+class WriteBehindQueue:
+   def __init__(self, write, maxsize = WRITE_QUEUE_SIZE):
+      self.write = write
+      self.maxsize = maxsize
+      self.pending = OrderedDict()
+      self.cond = threading.Condition()
+      self.thread = None
+      self.is_stopped = False
+      self.in_progress = 0
+
+      self.written = 0
+      self.coalesced = 0
+      self.errors = 0
+      self.overflow = 0
+
+   def start(self):
+      if self.thread is not None:
+         return
+      self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+      self.thread.start()
+
+   def put(self, op, model, hash, pk):
+      # records without primary key (autogenerated) can't be coalesced
+      key = object()
+      if pk is not None:
+         key = (model.__tablename__, pk)
+
+      with self.cond:
+         if self.is_stopped:
+            self.write(op, model, hash)
+            return
+
+         # called on event loop and in commit hooks, never waits for writer thread
+         if len(self.pending) >= self.maxsize and key not in self.pending:
+            self.overflow += 1
+            return
+
+         enqueued_at = time.monotonic()
+         if key in self.pending:
+            # moved to the end, so it's written after records it could depend on
+            enqueued_at = self.pending.pop(key)[3]
+            self.coalesced += 1
+
+         self.pending[key] = (op, model, hash, enqueued_at)
+         self.cond.notify_all()
+
+      self.start()
+
+   def run(self):
+      while True:
+         with self.cond:
+            while len(self.pending) == 0 and not self.is_stopped:
+               self.cond.wait()
+            if len(self.pending) == 0:
+               return
+            _, (op, model, hash, _) = self.pending.popitem(last=False)
+            self.in_progress += 1
+            self.cond.notify_all()
+
+         is_written = False
+         try:
+            self.write(op, model, hash)
+            is_written = True
+         except Exception as e:
+            print(f'write-behind {op} {model.__tablename__} failed: {e}')
+         finally:
+            with self.cond:
+               self.in_progress -= 1
+               if is_written:
+                  self.written += 1
+               else:
+                  self.errors += 1
+               self.cond.notify_all()
+
+   def flush(self):
+      with self.cond:
+         while len(self.pending) > 0 or self.in_progress > 0:
+            if self.thread is None:
+               break
+            self.cond.wait()
+
+   def stop(self):
+      self.flush()
+      with self.cond:
+         self.is_stopped = True
+         self.cond.notify_all()
+      if self.thread is not None:
+         self.thread.join()
+         self.thread = None
+
+   def get_stats(self):
+      with self.cond:
+         lag = 0.0
+         if len(self.pending) > 0:
+            lag = time.monotonic() - min([x[3] for x in self.pending.values()])
+         return {
+            'depth': len(self.pending) + self.in_progress,
+            'lag': lag,
+            'written': self.written,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'overflow': self.overflow,
+         }
+
+def write_queue_stats_to_str(stats):
+   return 'write queue: depth {}, lag {:.3f}s, written {}, coalesced {}, errors {}, overflow {}'.format(
+      stats['depth'], stats['lag'], stats['written'], stats['coalesced'], stats['errors'], stats['overflow']
+   )
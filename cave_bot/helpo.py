@@ -116,6 +116,12 @@ help = {
 'reset_description': """
    if new monday detected - all data get and load to new db
 """,
+'contested_description': """
+   cells, where users reported different items, least margin between top items first
+   !contested
+   !ct 10
+""",
+'contested_limit': commands.parameter(description="limit output to first N cells"),
 'map_level_descr': commands.parameter(description=map_level_values),
 'lead_limit': commands.parameter(description="limit output to first N scores"),
 'color_descr': """
@@ -5,7 +5,7 @@ from sqlalchemy import Integer, Column, DateTime, BigInteger, TypeDecorator, \
                         ForeignKeyConstraint, ForeignKey
 from datetime import datetime, timezone
 
-from .const import CellType as ct, UserRole, MapType, DEFAULT_USER_CONFIG, color_to_str
+from .const import CellType as ct, UserRole, MapType, DEFAULT_USER_CONFIG, color_to_int, color_from_int
 from .utils import get_week_start_as_str
 
 class CellTypeValue(TypeDecorator):
@@ -39,20 +39,20 @@ class MapTypeValue(TypeDecorator):
       return MapType(value)
    
 class ColorValue(TypeDecorator):
-   impl = String(15)
+   impl = Integer
    cache_ok = True
 
    def process_bind_param(self, color, dialect):
-      return color_to_str(color)
+      return color_to_int(color)
 
-   def process_result_value(self, color_str, dialect):
-      color = color_str.split(',')
-      color = [int(x) for x in color]
-      return color
+   def process_result_value(self, value, dialect):
+      return color_from_int(value)
    
 class Models:
-   def __init__(self, Cell, UserRecord, LastScan, Role, UserConfig, ColorScheme, MapConfig, Base):
+   def __init__(self, Cell, UserRecord, LastScan, Role, UserConfig, ColorScheme, MapConfig, Base, week = None):
       self.Base = Base
+      # partitioned schema - week of rows in cell and user_record, None - table per week
+      self.week = week
       self.Cell = Cell
       self.UserRecord = UserRecord
       self.LastScan = LastScan
@@ -61,8 +61,9 @@ class Models:
       self.UserConfig = UserConfig
       self.ColorScheme = ColorScheme
 
-def get_table_names():
-   week_postfix = get_week_start_as_str()
+# partitioned - one cell and user_record table for all weeks, rows has week column
+def get_table_names(monday = None, is_partitioned = False):
+   week_postfix = get_week_start_as_str(monday)
    table_names = {
       'Role': 'role',
       'LastScan': 'last_scan',
@@ -72,15 +73,40 @@ def get_table_names():
       'Cell': 'cell_' + week_postfix,
       'UserRecord': 'user_record_' + week_postfix,
    }
+   if is_partitioned:
+      table_names['Cell'] = 'cell'
+      table_names['UserRecord'] = 'user_record'
+      table_names['week'] = week_postfix
    return week_postfix, table_names
 
+# for queries by coords (!cell), primary key starts with user_id
+# index covers query completely, including order by cell_type
+# by map reads (first finders) are served by ReportersIndex, no index for them
+# partitioned - queries are always scoped to week, it leads indexes
+def get_user_record_indexes(table_name, is_partitioned = False):
+   prefix = ['week'] if is_partitioned else []
+   return {
+      f'ix_{table_name}_map_type_x_y': [*prefix, 'map_type', 'x', 'y', 'cell_type', 'user_id'],
+   }
+
 def generate_models(table_names):
    class Base(DeclarativeBase):
       pass
 
+   week_postfix = table_names.get('week')
+   # primary key starts with week, so it's index for week as well
+   def get_week_spec():
+      if week_postfix is None:
+         return {}
+      return {
+         'week': Column(String(10), primary_key = True, default = week_postfix),
+         'partition_week': week_postfix,
+      }
+
    # class Cell
    cell_spec = {
       '__tablename__': table_names['Cell'],
+      **get_week_spec(),
       'x'            : Column(Integer, primary_key = True),
       'y'            : Column(Integer, primary_key = True),
       'map_type'     : Column(MapTypeValue, default = MapType.unknown, primary_key = True)
@@ -90,14 +116,20 @@ def generate_models(table_names):
 
    Cell = type('Cell', (Base,), cell_spec)
 
-   class UserRecord(Base):
-      __tablename__ = table_names['UserRecord']
-      user_id       = Column(BigInteger, primary_key = True)
-      x             = Column(Integer, primary_key = True)
-      y             = Column(Integer, primary_key = True)
-      map_type      = Column(MapTypeValue, default = MapType.unknown, primary_key = True)
-      cell_type     = Column(CellTypeValue)
-      time          = Column(DateTime(timezone=True))
+   user_record_indexes = get_user_record_indexes(table_names['UserRecord'], week_postfix is not None)
+   user_record_spec = {
+      '__tablename__': table_names['UserRecord'],
+      **get_week_spec(),
+      'user_id'      : Column(BigInteger, primary_key = True),
+      'x'            : Column(Integer, primary_key = True),
+      'y'            : Column(Integer, primary_key = True),
+      'map_type'     : Column(MapTypeValue, default = MapType.unknown, primary_key = True),
+      'cell_type'    : Column(CellTypeValue),
+      'time'         : Column(DateTime(timezone=True)),
+      '__table_args__': tuple(sa.Index(name, *columns) for name, columns in user_record_indexes.items()),
+   }
+
+   UserRecord = type('UserRecord', (Base,), user_record_spec)
 
    class LastScan(Base):
       __tablename__ = table_names['LastScan']
@@ -205,4 +237,4 @@ def generate_models(table_names):
 
    MapConfig = type('MapConfig', (Base,), map_config_spec)
 
-   return Models(Cell, UserRecord, LastScan, Role, UserConfig, ColorScheme, MapConfig, Base)
+   return Models(Cell, UserRecord, LastScan, Role, UserConfig, ColorScheme, MapConfig, Base, week_postfix)
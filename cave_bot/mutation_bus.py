@@ -0,0 +1,39 @@
+import enum
+
+class MutationKind(enum.Enum):
+   added   = 1
+   changed = 2
+   removed = 3
+
+# change of one user record, cell_type_was - None for added, cell_type - None for removed
+class RecordMutation:
+   def __init__(self, user_id, x, y, cell_type_was, cell_type, time = None):
+      self.user_id = user_id
+      self.x = x
+      self.y = y
+      self.cell_type_was = cell_type_was
+      self.cell_type = cell_type
+      self.time = time
+
+   @property
+   def kind(self):
+      if self.cell_type_was is None:
+         return MutationKind.added
+      if self.cell_type is None:
+         return MutationKind.removed
+      return MutationKind.changed
+
+# in-process stream of user record mutations, written to db already
+# derived state subscribes and applies batch in one pass - subscriber(map_type, mutations)
+class MutationBus:
+   def __init__(self):
+      self.subscribers = []
+
+   def subscribe(self, subscriber):
+      self.subscribers.append(subscriber)
+
+   def publish(self, map_type, mutations):
+      if len(mutations) == 0:
+         return
+      for subscriber in self.subscribers:
+         subscriber(map_type, mutations)
@@ -9,6 +9,13 @@ MATCH_MAP = re.compile(r"Cave Difficulty\s*:\s*([\d\w]+)")
 MATCH_REPORT = re.compile(r"(\d+\-\d+)\s*:\s*([\w' ]+)")
 MATCH_COMPACT_REPORT = regex.compile(r"([\w' ]+)\s*:\s*(\d+\-\d+\s*)+")
 
+# message with reports or map difficulty, others are parsed without user config and records
+def is_data_msg(content):
+   for e in content.split("\n"):
+      if MATCH_MAP.match(e) or MATCH_REPORT.match(e) or MATCH_COMPACT_REPORT.match(e):
+         return True
+   return False
+
 def convert_coords_due_bug(x, y, size, report):
    absolute_number = (x-1)  * 20 + y
    a = int(absolute_number / size) + 1
@@ -94,7 +101,8 @@ def parse_msg(ctx, bot):
    arr = ctx.message.content.split("\n")
    i = 1
 
-   map_type = bot.controller.detect_user_map_type(ctx.message.author, ctx, with_error = False)
+   # detected by first report, chat messages don't read user config
+   map_type = None
    is_new_version = False
    is_bug_converter = False
 
@@ -111,11 +119,15 @@ def parse_msg(ctx, bot):
       if match := MATCH_REPORT.match(e):
          coords = match.group(1).strip()
          what = match.group(2).strip()
+         if map_type is None:
+            map_type = bot.controller.detect_user_map_type(ctx.message.author, ctx, with_error = False)
          validate_and_add(what, [coords], bot, map_type, ctx, is_new_version, is_bug_converter)
       elif match:= MATCH_COMPACT_REPORT.match(e):
          what = match.group(1).strip()
          coords_arr = match.captures(2)
          coords_arr = [x.strip() for x in coords_arr]
+         if map_type is None:
+            map_type = bot.controller.detect_user_map_type(ctx.message.author, ctx, with_error = False)
          validate_and_add(what, coords_arr, bot, map_type, ctx, is_new_version, is_bug_converter)
       else:
          ctx.report.log.add({'error': f'not match'})
\ No newline at end of file
@@ -1,6 +1,7 @@
 from . import color_util
 from ..const import CellType as ct, MapType
 from ..reaction import Reactions
+from ..view import CELL_TYPES
 
 color_scheme = {
    ct.unknown              : None,
@@ -67,9 +68,14 @@ class RenderAscii:
          ctx.report.reaction.add(Reactions.fail)
          return
       
-      view = bot.controller.get_view(map_type)
+      view = bot.controller.get_view(map_type).snapshot()
+
+      known_coords = set()
+      if user_id:
+         known_coords = bot.controller.user_records.get(user_id, map_type).get_known_coords()
 
       arr = []
+      most_grid = view.get_most_grid().tolist()
       # arr.append(color_util.ansi_message_start())
       for i in range(0, map_type.value):
          line = ""
@@ -78,8 +84,8 @@ class RenderAscii:
          for j in range(0, map_type.value):
             # if j % 5 == 0 and j > 0:
             #    line += " "
-            cell_type =view.get_cell_type(i+1, j+1)
-            if user_id and bot.db_process.get_user_record(user_id, i+1, j+1, map_type) is not None:
+            cell_type = CELL_TYPES[most_grid[i][j]]
+            if (i+1, j+1) in known_coords:
                cell_type = ct.unknown
 
             c = self.get_char(cell_type, i, j)
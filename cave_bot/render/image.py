@@ -8,6 +8,7 @@ from .color_util import is_text_black
 from .gradient_color import get_gradient_color
 from .img_storage import ImageStorage
 from ..reaction import Reactions
+from ..view import CELL_TYPES
 from ..bot.bot_util import pil_image_to_dfile
 
 def add_img(background, foreground, align, shift=None, foregound_on_background=True):
@@ -81,8 +82,7 @@ class RenderImage():
       self.cache = {}
       self.storage = ImageStorage()
 
-   def init_cache_by_map_type(self, view):
-      map_type = view.map_type
+   def init_cache_by_map_type(self, map_type):
       if map_type in self.cache:
          return
       
@@ -93,7 +93,6 @@ class RenderImage():
 
       sizes = self.get_sizes_spec(self.cell_config, map_type)
       images = self.get_common_images(sizes['cell_width'])
-      view.set_update_tracker('image_map')
 
       self.cache[map_type] = ImageCache(map_type, font_descr, font_cell, sizes, images)
       return self.cache[map_type]
@@ -263,9 +262,7 @@ class RenderImage():
       return getattr(user_config, key)
    
    def color_from_config(self, color):
-      color = color.copy()
-      color[-1] = int(color[-1] / 100 * 255)
-      return tuple(color)
+      return (*color[:3], int(color[3] / 100 * 255))
 
    def get_color_by_cell(self, cell_type, is_known, user_config):
       color = None
@@ -344,14 +341,6 @@ class RenderImage():
 
       self.add_text(back, text_spec, pos_spec)
 
-   def order_user_records(self, user_records):
-      hash = {}
-      for r in user_records:
-         key = f'{r.x}-{r.y}'
-         hash[key] = True
-
-      return hash
-
    def generate_from_grayscale(self, grayscale_img, alpha_channel, bg_color, border_color):
       img = ImageOps.colorize(grayscale_img, black = bg_color, white = border_color, whitepoint=140, blackpoint=30)
       img.putalpha(alpha_channel)
@@ -369,15 +358,15 @@ class RenderImage():
       )
       back.draw = ImageDraw.Draw(back)
 
-      user_records = {}
+      known_coords = set()
       if user_id:
-         user_records = bot.db_process.get_all_user_record(user_id, map_type)
-         user_records = self.order_user_records(user_records)
+         known_coords = bot.controller.user_records.get(user_id, map_type).get_known_coords()
 
+      most_grid = view.get_most_grid().tolist()
       for i in range(0, map_type.value):
          for j in range(0, map_type.value):
-            is_known = user_id and f'{i+1}-{j+1}' in user_records
-            cell_type = view.get_cell_type(i+1, j+1)
+            is_known = user_id and (i+1, j+1) in known_coords
+            cell_type = CELL_TYPES[most_grid[i][j]]
             img, img_name = self.get_img_by_cell(cell_type, is_known, cache.images, user_config)
             color = self.get_color_by_cell(cell_type, is_known, user_config)
             coords = self.get_cell_coords(i, j, cache.sizes)
@@ -405,15 +394,10 @@ class RenderImage():
          ctx.report.reaction.add(Reactions.fail)
          return
 
-      view = bot.controller.get_view(map_type)
-      self.init_cache_by_map_type(view)
+      view = bot.controller.get_view(map_type).snapshot()
+      self.init_cache_by_map_type(map_type)
 
       img, using_save = None, False
-      
-      is_view_updated = view.get_update_tracker('image_map')
-      if is_view_updated:
-         view.set_update_tracker('image_map')
-         self.storage.reset()
 
       user_config = bot.db_process.get_user_config(ctx.message.author.id)
       if user_config is None:
@@ -421,8 +405,8 @@ class RenderImage():
 
       is_config_default =  self.is_user_config_default(user_config)
 
-      if not user_id and is_view_updated is False and is_config_default:
-         img = self.storage.get_image([map_type.name])
+      if not user_id and is_config_default:
+         img = self.storage.get_image([map_type.name, view.version])
          if img:
             using_save = True
 
@@ -435,7 +419,8 @@ class RenderImage():
       ctx.report.file.add(file)
       
       if not using_save and not user_id and is_config_default:
-         self.storage.add_image([map_type.name], img)
+         self.storage.reset_by_key_prefix([map_type.name])
+         self.storage.add_image([map_type.name, view.version], img)
 
    def get_description_image(self, cell_type_name, images, user_config):
       img = None
@@ -14,5 +14,10 @@ class ImageStorage:
       key = self.key_arr_to_str(key_arr)
       return self.storage.get(key)
    
+   # images of older versions
+   def reset_by_key_prefix(self, key_arr):
+      prefix = self.key_arr_to_str(key_arr) + '_'
+      self.storage = {k: v for k, v in self.storage.items() if not k.startswith(prefix)}
+
    def reset(self):
       self.storage = {}
@@ -8,9 +8,7 @@ class RenderTheme:
       self.db_process = db_process
 
    def color_from_config(self, color):
-      color = color.copy()
-      color[-1] = int(color[-1] / 100 * 255)
-      return tuple(color)
+      return (*color[:3], int(color[3] / 100 * 255))
 
    def get_colors(self, scheme):
       colors = []
@@ -39,9 +37,7 @@ class RenderTheme:
       w, h = 50, 50
       total_length = len(colors) * w
 
-      bg_color = scheme.background_color.copy()
-      bg_color[-1] = 100
-      bg_color = self.color_from_config(bg_color)
+      bg_color = self.color_from_config((*scheme.background_color[:3], 100))
 
       img = Image.new('RGBA', (total_length, h), bg_color)
       overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
@@ -0,0 +1,76 @@
+from bisect import insort
+
+from .utils import time_to_global_timezone
+
+# reporters of each cell - [(time, user_id, cell_type)] sorted by time, first is first finder
+# map is loaded from db on first read, kept by mutations of user records
+class ReportersIndex:
+   def __init__(self, db_process):
+      self.db_process = db_process
+      # map_type -> (x, y) -> reporters
+      self.index = {}
+
+   def get_map(self, map_type):
+      if (reporters_by_coords:= self.index.get(map_type)) is not None:
+         return reporters_by_coords
+
+      reporters_by_coords = {}
+      for user_id, x, y, cell_type, time in self.db_process.iter_user_records(
+         map_type, ['user_id', 'x', 'y', 'cell_type', 'time']
+      ):
+         reporters_by_coords.setdefault((x, y), []).append((time_to_global_timezone(time), user_id, cell_type))
+      for reporters in reporters_by_coords.values():
+         reporters.sort(key = lambda x: x[0])
+
+      self.index[map_type] = reporters_by_coords
+      return reporters_by_coords
+
+   def get(self, map_type, x, y):
+      return list(self.get_map(map_type).get((x, y), []))
+
+   # first reporter of cell type, by (x, y) -> (user_id, cell_type, time)
+   # most_grid - cell types by values, [x-1][y-1]
+   def get_first_finders(self, map_type, most_grid):
+      first_finders = {}
+      for (x, y), reporters in self.get_map(map_type).items():
+         most = most_grid[x-1][y-1]
+         for time, user_id, cell_type in reporters:
+            if cell_type.value == most:
+               first_finders[(x, y)] = (user_id, cell_type, time)
+               break
+      return first_finders
+
+   # records - [(x, y, cell_type)], not loaded map would be loaded with them
+   def set(self, user_id, map_type, records, time):
+      reporters_by_coords = self.index.get(map_type)
+      if reporters_by_coords is None:
+         return
+
+      time = time_to_global_timezone(time)
+      for x, y, cell_type in records:
+         reporters = reporters_by_coords.setdefault((x, y), [])
+         reporters[:] = [r for r in reporters if r[1] != user_id]
+         insort(reporters, (time, user_id, cell_type), key = lambda x: x[0])
+
+   # mutations - [RecordMutation], MutationBus subscriber
+   def apply_mutations(self, map_type, mutations):
+      if map_type not in self.index:
+         return
+      for mutation in mutations:
+         if mutation.cell_type is None:
+            self.delete(mutation.user_id, map_type, [(mutation.x, mutation.y)])
+         else:
+            self.set(mutation.user_id, map_type, [(mutation.x, mutation.y, mutation.cell_type)], mutation.time)
+
+   def delete(self, user_id, map_type, coords_arr):
+      reporters_by_coords = self.index.get(map_type)
+      if reporters_by_coords is None:
+         return
+
+      for x, y in coords_arr:
+         reporters = reporters_by_coords.get((x, y))
+         if reporters is None:
+            continue
+         reporters[:] = [r for r in reporters if r[1] != user_id]
+         if len(reporters) == 0:
+            del reporters_by_coords[(x, y)]
@@ -0,0 +1,87 @@
+import sys
+import time
+import asyncio
+import tempfile
+import statistics
+from pathlib import Path
+
+from ..model import generate_models
+from ..db_init import Db
+from ..db_process import DbProcess
+from ..db_async import AsyncDbProcess
+from ..db_util import chunks
+from ..const import MapType as mt
+from .bench_user_record_indexes import get_table_names, generate_rows
+
+RECORDS = 200_000
+COMMANDS = 20
+HEARTBEAT = 0.01
+
+# measures, how late event loop wakes up, while commands are executed
+async def heartbeat(lags, is_done):
+   while not is_done.is_set():
+      start = time.perf_counter()
+      await asyncio.sleep(HEARTBEAT)
+      lags.append(time.perf_counter() - start - HEARTBEAT)
+
+async def run_commands(db, db_process, is_async):
+   adb = AsyncDbProcess(db_process)
+   user_record_table = db.m.UserRecord.__table__
+
+   async def leaderboard():
+      start = time.perf_counter()
+      columns = ['user_id', 'x', 'y', 'cell_type', 'time']
+      if is_async:
+         await adb.iter_user_records(mt.normal, columns)
+      else:
+         async with db_process.unit_of_work():
+            db_process.iter_user_records(mt.normal, columns)
+      return time.perf_counter() - start
+
+   async def dump():
+      start = time.perf_counter()
+      db.tracker.mark_table(user_record_table.name)
+      if is_async:
+         await adb.run(db.save_to_load_db)
+      else:
+         async with db_process.unit_of_work():
+            db.save_to_load_db()
+      return time.perf_counter() - start
+
+   lags = []
+   is_done = asyncio.Event()
+   heartbeat_task = asyncio.create_task(heartbeat(lags, is_done))
+   await asyncio.sleep(HEARTBEAT)
+
+   commands = [leaderboard() for _ in range(COMMANDS)]
+   commands.insert(COMMANDS // 2, dump())
+   latencies = await asyncio.gather(*commands)
+
+   is_done.set()
+   await heartbeat_task
+
+   print('{}: commands mean {:.1f}ms, max {:.1f}ms; event loop lag max {:.1f}ms, mean {:.1f}ms'.format(
+      'async' if is_async else 'sync',
+      statistics.mean(latencies) * 1000, max(latencies) * 1000,
+      max(lags) * 1000, statistics.mean(lags) * 1000,
+   ))
+
+def main():
+   records = RECORDS
+   if len(sys.argv) > 1:
+      records = int(sys.argv[1])
+
+   with tempfile.TemporaryDirectory() as dir:
+      models = generate_models(get_table_names())
+      db = Db(models, f'sqlite:///{Path(dir) / "bench.db"}')
+      with db.memory_db.begin() as connection:
+         for rows in chunks(list(generate_rows(records)), 10_000):
+            connection.execute(db.m.UserRecord.__table__.insert(), rows)
+      db_process = DbProcess(db)
+
+      asyncio.run(run_commands(db, db_process, is_async = False))
+      asyncio.run(run_commands(db, db_process, is_async = True))
+      db.close()
+
+if __name__ == '__main__':
+   main()
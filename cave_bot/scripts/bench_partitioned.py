@@ -0,0 +1,106 @@
+import sys
+import random
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+import sqlalchemy as sa
+
+from ..model import generate_models, get_table_names
+from ..db_init import scope_to_week
+from ..db_util import chunks
+from .bench_user_record_indexes import generate_rows, measure, MAP_TYPES, MAP_SIZE
+
+WEEKS = 8
+RECORDS = 50_000
+REPEATS = 200
+FIRST_MONDAY = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def get_mondays(weeks):
+   return [FIRST_MONDAY + timedelta(weeks=i) for i in range(weeks)]
+
+def fill(engine, models, rows_by_week):
+   models.Base.metadata.create_all(engine)
+   table = models.UserRecord.__table__
+   with engine.begin() as connection:
+      for rows in chunks(rows_by_week, 10_000):
+         connection.execute(table.insert(), rows)
+
+def measure_queries(Session, UserRecord, count_all_weeks):
+   with Session() as s:
+      def by_coords():
+         s.query(UserRecord.cell_type, UserRecord.user_id).filter(
+            UserRecord.x == random.randint(1, MAP_SIZE),
+            UserRecord.y == random.randint(1, MAP_SIZE),
+            UserRecord.map_type == random.choice(MAP_TYPES),
+         ).order_by(UserRecord.cell_type).all()
+
+      def by_map():
+         s.query(UserRecord.user_id, UserRecord.x, UserRecord.y, UserRecord.cell_type).filter(
+            UserRecord.map_type == random.choice(MAP_TYPES),
+         ).all()
+
+      def all_weeks():
+         s.execute(count_all_weeks).all()
+
+      return {
+         'by coords': measure(by_coords, REPEATS),
+         'by map': measure(by_map, 20),
+         'records by user, all weeks': measure(all_weeks, 20),
+      }
+
+def bench_table_per_week(dir, rows_by_week):
+   engine = sa.create_engine(f'sqlite:///{Path(dir) / "per_week.db"}')
+   tables = []
+   for monday, rows in rows_by_week.items():
+      week_postfix, table_names = get_table_names(monday)
+      models = generate_models(table_names)
+      fill(engine, models, rows)
+      tables.append(models.UserRecord.__table__)
+
+   # cross-week query needs sql, built from list of week tables
+   union = sa.union_all(*[sa.select(x.c.user_id) for x in tables]).subquery()
+   count_all_weeks = sa.select(union.c.user_id, sa.func.count()).group_by(union.c.user_id)
+
+   result = measure_queries(sa.orm.sessionmaker(engine), models.UserRecord, count_all_weeks)
+   engine.dispose()
+   return result
+
+def bench_partitioned(dir, rows_by_week):
+   engine = sa.create_engine(f'sqlite:///{Path(dir) / "partitioned.db"}')
+   for monday, rows in rows_by_week.items():
+      week_postfix, table_names = get_table_names(monday, is_partitioned = True)
+      models = generate_models(table_names)
+      fill(engine, models, [{**x, 'week': week_postfix} for x in rows])
+
+   table = models.UserRecord.__table__
+   count_all_weeks = sa.select(table.c.user_id, sa.func.count()).group_by(table.c.user_id)
+
+   Session = sa.orm.sessionmaker(engine)
+   sa.event.listen(Session, 'do_orm_execute', scope_to_week)
+   result = measure_queries(Session, models.UserRecord, count_all_weeks)
+   engine.dispose()
+   return result
+
+def main():
+   weeks, records = WEEKS, RECORDS
+   if len(sys.argv) > 1:
+      weeks = int(sys.argv[1])
+   if len(sys.argv) > 2:
+      records = int(sys.argv[2])
+
+   rows_by_week = {}
+   for monday in get_mondays(weeks):
+      rows_by_week[monday] = list(generate_rows(records))
+
+   with tempfile.TemporaryDirectory() as dir:
+      results = {
+         'per week': bench_table_per_week(dir, rows_by_week),
+         'partitioned': bench_partitioned(dir, rows_by_week),
+      }
+
+   print(f'{weeks} weeks, {records} records per week, queries of last week, times in ms')
+   for name, result in results.items():
+      print('{:>12}: {}'.format(name, ', '.join(['{} {:.3f}'.format(k, v) for k, v in result.items()])))
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,97 @@
+import sys
+import time
+import random
+import sqlalchemy as sa
+from datetime import datetime
+
+from ..model import generate_models
+from ..const import CellType as ct, MapType as mt
+from ..db_util import chunks
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 200
+# by map returns a third of table, fewer repeats
+MAP_REPEATS = 5
+MAP_TYPES = [mt.normal, mt.hard, mt.nightmare]
+MAP_SIZE = 20
+
+def get_table_names():
+   table_names = {}
+   for name in ['Role', 'LastScan', 'Cell', 'UserRecord', 'MapConfig', 'UserConfig', 'ColorScheme']:
+      table_names[name] = f'bench_{name.lower()}'
+   return table_names
+
+def generate_rows(amount):
+   cell_types = [x for x in ct if x != ct.unknown]
+   now = datetime.now()
+   user_id = 0
+   while True:
+      user_id += 1
+      for map_type in MAP_TYPES:
+         for x in range(1, MAP_SIZE + 1):
+            for y in range(1, MAP_SIZE + 1):
+               yield {
+                  'user_id': user_id, 'x': x, 'y': y, 'map_type': map_type,
+                  'cell_type': random.choice(cell_types), 'time': now,
+               }
+               amount -= 1
+               if amount == 0:
+                  return
+
+def measure(f, repeats):
+   start = time.perf_counter()
+   for _ in range(repeats):
+      f()
+   return (time.perf_counter() - start) / repeats * 1000
+
+def measure_queries(Session, UserRecord):
+   with Session() as s:
+      # get_users_and_types_by_coords - every !cell
+      def by_coords():
+         s.query(UserRecord.cell_type, UserRecord.user_id).filter(
+            UserRecord.x == random.randint(1, MAP_SIZE),
+            UserRecord.y == random.randint(1, MAP_SIZE),
+            UserRecord.map_type == random.choice(MAP_TYPES),
+         ).order_by(UserRecord.cell_type).all()
+
+      # iter_user_records - ReportersIndex load, a third of table is returned
+      def by_map():
+         s.execute(sa.select(UserRecord.user_id, UserRecord.x, UserRecord.y, UserRecord.time).where(
+            UserRecord.map_type == random.choice(MAP_TYPES),
+         )).all()
+
+      return measure(by_coords, REPEATS), measure(by_map, MAP_REPEATS)
+
+def bench(amount):
+   models = generate_models(get_table_names())
+   UserRecord = models.UserRecord
+   table = UserRecord.__table__
+   engine = sa.create_engine('sqlite://')
+   models.Base.metadata.create_all(engine)
+   Session = sa.orm.sessionmaker(engine)
+
+   for index in table.indexes:
+      index.drop(engine)
+   with engine.begin() as connection:
+      for rows in chunks(list(generate_rows(amount)), 10_000):
+         connection.execute(table.insert(), rows)
+
+   without_index = measure_queries(Session, UserRecord)
+   for index in table.indexes:
+      index.create(engine)
+   with_index = measure_queries(Session, UserRecord)
+   engine.dispose()
+
+   print('{} records: by coords {:.3f}ms -> {:.3f}ms, by map {:.3f}ms -> {:.3f}ms'.format(
+      amount, without_index[0], with_index[0], without_index[1], with_index[1]
+   ))
+
+def main():
+   sizes = SIZES
+   if len(sys.argv) > 1:
+      sizes = [int(x) for x in sys.argv[1:]]
+   for amount in sizes:
+      bench(amount)
+
+if __name__ == '__main__':
+   main()
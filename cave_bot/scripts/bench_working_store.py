@@ -0,0 +1,84 @@
+import sys
+import time
+import random
+import resource
+import tempfile
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+
+from ..model import generate_models
+from ..db_init import Db
+from ..db_process import DbProcess
+from ..db_util import chunks
+from ..const import CellType as ct, MapType as mt
+from .bench_user_record_indexes import get_table_names, generate_rows, measure, MAP_TYPES, MAP_SIZE
+
+RECORDS = 200_000
+REPEATS = 200
+
+def bench(dir, records, is_store):
+   store_path = None
+   if is_store:
+      store_path = str(Path(dir) / 'working.db')
+   models = generate_models(get_table_names())
+
+   start = time.perf_counter()
+   db = Db(models, f'sqlite:///{Path(dir) / "bench.db"}', use_sqlite_backup = False, working_store_path = store_path)
+   load_time = time.perf_counter() - start
+   db_process = DbProcess(db)
+
+   def by_coords():
+      db_process.get_users_and_types_by_coords(
+         random.randint(1, MAP_SIZE), random.randint(1, MAP_SIZE), random.choice(MAP_TYPES)
+      )
+
+   def report():
+      x, y = random.randint(1, MAP_SIZE), random.randint(1, MAP_SIZE)
+      cell_type = random.choice([ct.empty, ct.spider])
+      db_process.apply_user_reports(random.randint(1, 100), mt.normal, [(x, y, cell_type)], datetime.now())
+
+   def leaderboard():
+      db_process.iter_user_records(mt.normal, ['user_id', 'x', 'y', 'cell_type', 'time'])
+
+   result = {
+      'load': load_time * 1000,
+      'by coords': measure(by_coords, REPEATS),
+      'report': measure(report, REPEATS),
+      'leaderboard': measure(leaderboard, 5),
+      # reports only, reused store has nothing else to compare
+      'save': measure(db.save_to_load_db, 1),
+      'max rss mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+   }
+   db.close()
+   return result
+
+def prepare(dir, records):
+   models = generate_models(get_table_names())
+   db = Db(models, f'sqlite:///{Path(dir) / "bench.db"}', use_sqlite_backup = False)
+   with db.load_db.begin() as connection:
+      for rows in chunks(list(generate_rows(records)), 10_000):
+         connection.execute(db.m.UserRecord.__table__.insert(), rows)
+   db.close()
+
+def main():
+   records = RECORDS
+   if len(sys.argv) > 1:
+      records = int(sys.argv[1])
+
+   # each mode in own process - max rss is not shared
+   context = multiprocessing.get_context('spawn')
+   with tempfile.TemporaryDirectory() as dir:
+      with context.Pool(1) as pool:
+         pool.apply(prepare, (dir, records))
+      results = {}
+      for name, is_store in [('memory', False), ('store', True), ('store reused', True)]:
+         with context.Pool(1) as pool:
+            results[name] = pool.apply(bench, (dir, records, is_store))
+
+   print(f'{records} records, times in ms')
+   for name, result in results.items():
+      print('{:>12}: {}'.format(name, ', '.join(['{} {:.2f}'.format(k, v) for k, v in result.items()])))
+
+if __name__ == '__main__':
+   main()
@@ -5,6 +5,9 @@ from ..model import generate_models, get_table_names
 from ..config import Config
 from ..utils import build_path
 
+def print_progress(table_name, copied):
+   print(f'{table_name}: {copied} rows')
+
 def main():
    config = Config()
    week_postfix, table_names = get_table_names()
@@ -18,7 +21,7 @@ def main():
    save_engine = sa.create_engine(f"sqlite:///{save_db_dir_path}{db_name}")
    db.m.Base.metadata.create_all(save_engine)
    
-   db.load_from_one_db_to_another(db.memory_db, save_engine)
+   db.copy_database(db.memory_db, save_engine, progress = print_progress)
    print('saved to file')
 
 if __name__ == '__main__':
@@ -5,6 +5,9 @@ from ..model import generate_models, get_table_names
 from ..config import Config
 from ..utils import build_path
 
+def print_progress(table_name, copied):
+   print(f'{table_name}: {copied} rows')
+
 def main():
    config = Config()
    week_postfix, table_names = get_table_names()
@@ -17,7 +20,7 @@ def main():
    db_name = week_postfix
    load_engine = sa.create_engine(f"sqlite:///{save_db_dir_path}{db_name}")
    
-   db.load_from_one_db_to_another(load_engine, db.load_db)
+   db.copy_database(load_engine, db.load_db, progress = print_progress)
    print('loaded to remote base')
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import numpy as np
+
+from .view import CELL_TYPES
+
+USER_RECORDS_CACHE_USERS = 512
+
+# records of one user on one map
+# cell_types - (size, size), cell type values, known - (size, size), bitset of reported cells
+class UserRecords:
+   def __init__(self, map_type):
+      self.map_type = map_type
+      size = map_type.value
+      self.cell_types = np.zeros((size, size), dtype = np.int8)
+      self.known = np.zeros((size, size), dtype = bool)
+
+   # rows - [(x, y, cell_type)]
+   def load(self, rows):
+      for x, y, cell_type in rows:
+         self.set(x, y, cell_type)
+
+   def set(self, x, y, cell_type):
+      self.cell_types[x-1, y-1] = cell_type.value
+      self.known[x-1, y-1] = True
+
+   def delete(self, x, y):
+      self.cell_types[x-1, y-1] = 0
+      self.known[x-1, y-1] = False
+
+   def get(self, x, y):
+      if not self.known[x-1, y-1]:
+         return None
+      return CELL_TYPES[self.cell_types[x-1, y-1]]
+
+   # [(x, y, cell_type)] ordered by coords, as DbProcess.iter_user_records
+   def get_records(self):
+      xs, ys = np.nonzero(self.known)
+      cell_types = self.cell_types[xs, ys]
+      return [(x + 1, y + 1, CELL_TYPES[c]) for x, y, c in zip(xs.tolist(), ys.tolist(), cell_types.tolist())]
+
+   def get_known_coords(self):
+      xs, ys = np.nonzero(self.known)
+      return set(zip((xs + 1).tolist(), (ys + 1).tolist()))
+
+   def get_cell_type_amount(self, cell_type):
+      return int(np.count_nonzero(self.known & (self.cell_types == cell_type.value)))
+
+   def __len__(self):
+      return int(np.count_nonzero(self.known))
+
+# UserRecords by (user_id, map_type), least recently used are dropped
+# kept by mutations of user records, not cached users are loaded on read
+class UserRecordsCache:
+   def __init__(self, db_process, limit = USER_RECORDS_CACHE_USERS):
+      self.db_process = db_process
+      self.limit = limit
+      self.cache = OrderedDict()
+
+   def get(self, user_id, map_type):
+      key = (user_id, map_type)
+      if key in self.cache:
+         self.cache.move_to_end(key)
+         return self.cache[key]
+
+      user_records = UserRecords(map_type)
+      user_records.load(self.db_process.iter_user_records(map_type, ['x', 'y', 'cell_type'], user_id))
+      self.cache[key] = user_records
+      if len(self.cache) > self.limit:
+         self.cache.popitem(last = False)
+      return user_records
+
+   # mutations - [RecordMutation], MutationBus subscriber, not cached user would be loaded with them
+   def apply_mutations(self, map_type, mutations):
+      for mutation in mutations:
+         user_records = self.cache.get((mutation.user_id, map_type))
+         if user_records is None:
+            continue
+         if mutation.cell_type is None:
+            user_records.delete(mutation.x, mutation.y)
+         else:
+            user_records.set(mutation.x, mutation.y, mutation.cell_type)
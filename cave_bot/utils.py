@@ -31,8 +31,13 @@ def get_last_monday():
    monday = monday.replace(hour=0, minute=0, second=0, microsecond=0)
    return monday
 
-def get_week_start_as_str():
-   return get_last_monday().strftime('%d_%m_%Y')
+def get_next_monday():
+   return get_last_monday() + timedelta(weeks=1)
+
+def get_week_start_as_str(monday = None):
+   if monday is None:
+      monday = get_last_monday()
+   return monday.strftime('%d_%m_%Y')
 
 def is_time_anaware(dt):
    return not dt.strftime('%Z') == 'UTC'
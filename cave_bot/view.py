@@ -1,91 +1,156 @@
+import numpy as np
+
 from .const import CellType as ct
 
+# cell types by value, values are indexes of counters
+CELL_TYPES = list(ct)
+
+# counters of one cell, read only copy - for reports
 class Cell:
-   def __init__(self, cell_type_counters = None):
-      if cell_type_counters is None:
-         cell_type_counters = [0] * len(ct)
-      
+   def __init__(self, cell_type_counters, most):
       self.val = cell_type_counters
-      self.most = None
+      self.most = most
 
    def get_most_cell_type(self):
-      if self.most is None:
-         self.most = self.calc_cell_type()
-      return self.most
-   
-   def calc_cell_type(self):
-      if not self.val:
-         return ct.unknown
-
-      max_index = self.val.index(max(self.val))
-      return ct(max_index)
-   
-   def get_cell_type_counter(self, cell_type):
-      if not self.val:
-         return 0
+      return CELL_TYPES[self.most]
 
-      return self.val[cell_type.value]
-   
-   def update(self, cell_type_counters):
-      self.val = cell_type_counters
-      most_was = self.most
-      
-      self.most = self.calc_cell_type()
-      
-      if self.most != most_was:
-         return True
-      
-      return False
-      
-class View:
-   def update_cell(self, x, y, cell_type_counters):
-      is_update = self.cells[x-1][y-1].update(cell_type_counters)
-      if is_update:
-         self.update_tracker()
+   def get_cell_type_counter(self, cell_type):
+      return int(self.val[cell_type.value])
 
+# read methods of View over arrays of it
+class ViewReader:
    def get_cell(self, x, y):
-      return self.cells[x-1][y-1]
-   
+      return Cell(self.counters[x-1, y-1].copy(), int(self.most[x-1, y-1]))
+
    def get_cell_type(self, x, y):
-      return self.cells[x-1][y-1].get_most_cell_type()
+      return CELL_TYPES[self.most[x-1, y-1]]
 
    def get_cell_type_amount(self, cell_type):
-      counter = 0
-      for i in range(0, self.map_type.value):
-         for j in range(0, self.map_type.value):
-            if self.get_cell_type(i, j) == cell_type:
-               counter += 1
-
-      return counter
+      return int(self.histogram[cell_type.value])
 
    def get_explored_cells(self):
-      counter = 0
-      for i in range(0, self.map_type.value):
-         for j in range(0, self.map_type.value):
-            if self.get_cell_type(i, j) != ct.unknown:
-               counter += 1
-               
-      return counter
-
-   def update_tracker(self):
-      for k in self.tracker.keys():
-         self.tracker[k] += 1
-
-   def set_update_tracker(self, key):
-      self.tracker[key] = 0
-
-   def get_update_tracker(self, key):
-      return self.tracker.get(key, None)
-
-   def init_grid(self):
-      for i in range(0, self.map_type.value):
-         row = []
-         for j in range(0, self.map_type.value):
-            row.append(Cell())
-         self.cells.append(row)
+      return self.most.size - int(self.histogram[ct.unknown.value])
+
+   # [(x, y, margin)], least margin first
+   def get_contested_cells(self):
+      return sorted([(*coords, margin) for coords, margin in self.contested.items()], key = lambda x: (x[2], x[0], x[1]))
+
+# immutable copy of View of some version, for readers, which await or run in other thread,
+# while reports are applied to View
+class ViewSnapshot(ViewReader):
+   def __init__(self, view):
+      self.map_type = view.map_type
+      self.version = view.version
+      self.counters_version = view.counters_version
+      self.counters = view.counters.copy()
+      self.most = view.most.copy()
+      self.histogram = view.histogram.copy()
+      self.contested = dict(view.contested)
+      for array in [self.counters, self.most, self.histogram]:
+         array.flags.writeable = False
+
+   # read only, not copied
+   def get_most_grid(self):
+      return self.most
+
+   def snapshot(self):
+      return self
 
+# counters - (size, size, len(CellType)), most - (size, size), most popular cell type of each cell
+# argmax takes first max, so cell without reports is unknown
+# histogram - amount of cells by most cell type, kept on each update
+# version - increased on every change of most, key for caches of renders
+# counters_version - increased on every change of counters, key of snapshot
+# contested - (x, y) -> margin between top two counters, for cells with more than one reported cell type
+class View(ViewReader):
    def __init__(self, map_type):
       self.map_type = map_type
-      self.cells = []
-      self.init_grid()
-      self.tracker = {}
\ No newline at end of file
+      size = map_type.value
+      self.counters = np.zeros((size, size, len(ct)), dtype = np.int32)
+      self.most = np.zeros((size, size), dtype = np.int8)
+      self.histogram = np.zeros(len(ct), dtype = np.int64)
+      self.histogram[ct.unknown.value] = self.most.size
+      self.contested = {}
+      self.version = 0
+      self.counters_version = 0
+      self.last_snapshot = None
+
+   def update_cell(self, x, y, cell_type_counters):
+      self.update_cells([(x, y)], [cell_type_counters])
+
+   # coords_arr - [(x, y)], unique, counters_arr - [counters], returns mask of cells with changed most
+   def update_cells(self, coords_arr, counters_arr):
+      if len(coords_arr) == 0:
+         return np.zeros(0, dtype = bool)
+
+      coords = np.asarray(coords_arr, dtype = np.intp) - 1
+      xs, ys = coords[:, 0], coords[:, 1]
+      self.counters[xs, ys] = counters_arr
+
+      most_was = self.most[xs, ys]
+      most = self.counters[xs, ys].argmax(axis = 1)
+      self.most[xs, ys] = most
+
+      self.update_contested(xs, ys)
+      self.counters_version += 1
+
+      changed = most != most_was
+      if changed.any():
+         np.subtract.at(self.histogram, most_was[changed], 1)
+         np.add.at(self.histogram, most[changed], 1)
+         self.version += 1
+      return changed
+
+   # mutations - [RecordMutation] of this map, counter of cell type was -1, of new one +1
+   # returns mask of mutated cells with changed most, in order of first mutation
+   def apply_mutations(self, mutations):
+      counters_by_coords = {}
+      for mutation in mutations:
+         coords = (mutation.x, mutation.y)
+         if coords not in counters_by_coords:
+            counters_by_coords[coords] = self.counters[mutation.x-1, mutation.y-1].copy()
+         counters = counters_by_coords[coords]
+         # counter never goes below 0, as in db
+         if mutation.cell_type_was is not None and counters[mutation.cell_type_was.value] > 0:
+            counters[mutation.cell_type_was.value] -= 1
+         if mutation.cell_type is not None:
+            counters[mutation.cell_type.value] += 1
+
+      coords_arr = list(counters_by_coords.keys())
+      return self.update_cells(coords_arr, [counters_by_coords[x] for x in coords_arr])
+
+   # rows - [(x, y, counters)], as DbProcess.iter_cell_counters returns
+   def load_cells(self, rows):
+      self.counters[:] = 0
+      if len(rows) > 0:
+         xs = np.fromiter((x[0] for x in rows), dtype = np.intp, count = len(rows)) - 1
+         ys = np.fromiter((x[1] for x in rows), dtype = np.intp, count = len(rows)) - 1
+         self.counters[xs, ys] = [x[2] for x in rows]
+      self.most[:] = self.counters.argmax(axis = 2)
+      self.histogram[:] = np.bincount(self.most.ravel(), minlength = len(ct))
+      self.contested = {}
+      self.update_contested(*np.nonzero((self.counters > 0).sum(axis = 2) > 1))
+      self.version += 1
+      self.counters_version += 1
+
+   # xs, ys - indexes of cells with new counters, cost is constant per cell
+   def update_contested(self, xs, ys):
+      counters = self.counters[xs, ys]
+      top_two = -np.partition(-counters, 1, axis = 1)[:, :2]
+      margins = (top_two[:, 0] - top_two[:, 1]).tolist()
+      is_contested = ((counters > 0).sum(axis = 1) > 1).tolist()
+      for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+         if is_contested[i]:
+            self.contested[(x + 1, y + 1)] = margins[i]
+         else:
+            self.contested.pop((x + 1, y + 1), None)
+
+   # cell types by values, [x-1][y-1], for renders
+   def get_most_grid(self):
+      return self.most.copy()
+
+   # full copy on first read after change of counters, then shared by readers till next change
+   def snapshot(self):
+      if self.last_snapshot is None or self.last_snapshot.counters_version != self.counters_version:
+         self.last_snapshot = ViewSnapshot(self)
+      return self.last_snapshot
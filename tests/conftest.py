@@ -0,0 +1,38 @@
+import pytest
+import uuid
+
+from cave_bot.model import generate_models
+from cave_bot.db_process import DbProcess
+from cave_bot.db_init import Db
+from cave_bot.config import Config
+
+# db over tables with unique names in connected db, they are dropped after test
+@pytest.fixture()
+def make_db_process():
+   db_processes = []
+
+   def make(use_sqlite_backup = True, db_connection_str = None):
+      config = Config()
+
+      table_names = {
+         'Role': str(uuid.uuid4()),
+         'LastScan': str(uuid.uuid4()),
+         'Cell': str(uuid.uuid4()),
+         'UserRecord': str(uuid.uuid4()),
+         'MapConfig': str(uuid.uuid4()),
+         'UserConfig': str(uuid.uuid4()),
+         'ColorScheme': str(uuid.uuid4()),
+      }
+      models = generate_models(table_names)
+      db = Db(models, db_connection_str or config.db_connection_str, use_sqlite_backup = use_sqlite_backup)
+      db_process = DbProcess(db)
+      db_processes.append(db_process)
+      return db_process
+
+   yield make
+   for db_process in db_processes:
+      db_process.db.drop_tables()
+
+@pytest.fixture()
+def db_process(make_db_process):
+   return make_db_process()
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.utils import get_mock_class_with_attr
+from cave_bot.bot.bot_util import init_ctx
+from cave_bot.controller import Controller
+from cave_bot.view import View
+from cave_bot.reporters import ReportersIndex
+from cave_bot.user_records import UserRecordsCache
+
+def get_user(user_id):
+   return get_mock_class_with_attr({'id': user_id, 'name': f'user {user_id}'})
+
+def get_ctx(user, hour = 0):
+   message = get_mock_class_with_attr({
+      'author': user, 'created_at': datetime(2024, 1, 1, hour, tzinfo = timezone.utc),
+   })
+   ctx = get_mock_class_with_attr({'message': message})
+   init_ctx(ctx)
+   return ctx
+
+# derived state, built before changes and kept by mutations, is same as built from db
+def test_derived_state_matches_db(db_process):
+   map_type = mt.normal
+   controller = Controller(db_process, None)
+   first, second = get_user(1), get_user(2)
+
+   controller.add(ct.spider, [[1, 1], [1, 2]], get_ctx(first, 1), map_type)
+   controller.get_view(map_type)
+   controller.reporters.get_map(map_type)
+   controller.user_records.get(first.id, map_type)
+   controller.user_records.get(second.id, map_type)
+
+   controller.add(ct.empty, [[1, 1], [2, 2]], get_ctx(second, 2), map_type)
+   controller.add(ct.spider, [[1, 1]], get_ctx(second, 3), map_type)
+   controller.add(ct.empty, [[1, 2], [3, 3]], get_ctx(first, 4), map_type)
+   controller.delete([1, 2], first, get_ctx(first))
+   controller.deleteall(second, get_ctx(second))
+
+   view = View(map_type)
+   view.load_cells(db_process.iter_cell_counters(map_type))
+   assert (controller.get_view(map_type).counters == view.counters).all()
+   assert controller.get_view(map_type).get_contested_cells() == view.get_contested_cells()
+
+   assert controller.reporters.get_map(map_type) == ReportersIndex(db_process).get_map(map_type)
+
+   user_records = UserRecordsCache(db_process)
+   for user in [first, second]:
+      assert controller.user_records.get(user.id, map_type).get_records() == \
+         user_records.get(user.id, map_type).get_records()
+   assert controller.user_records.get(first.id, map_type).get_records() == [(1, 1, ct.spider), (3, 3, ct.empty)]
@@ -0,0 +1,73 @@
+import pytest
+import sqlalchemy as sa
+from datetime import datetime, timezone
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.model import generate_models, get_table_names
+from cave_bot.db_process import DbProcess
+from cave_bot.db_init import Db
+from cave_bot.db_archive import Archive
+from cave_bot.utils import get_next_monday
+
+OLD_MONDAY = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+@pytest.fixture()
+def db_process(tmp_path):
+   week_postfix, table_names = get_table_names(OLD_MONDAY)
+   db = Db(generate_models(table_names), f'sqlite:///{tmp_path / "cave.db"}', use_sqlite_backup = False)
+   yield DbProcess(db)
+   db.close()
+
+def fork_to_current_week(db):
+   week_postfix, table_names = get_table_names()
+   return db.fork(generate_models(table_names))
+
+def test_archive_week(db_process, tmp_path):
+   user_id, map_type = 2879234928, mt.normal
+   time = datetime(2001, 1, 2, 10, 30, tzinfo=timezone.utc)
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+   db_process.update_user_record_and_cell(user_id, [3, 4], ct.spider, map_type, time)
+   db_process.update_user_record_and_cell(user_id + 1, [3, 4], ct.spider, mt.hard, time)
+   db_process.db.save_to_load_db()
+
+   # week is archived only after db moved to next week
+   archive = Archive(str(tmp_path / 'archive'))
+   assert archive.archive_weeks(db_process.db) == []
+   db = fork_to_current_week(db_process.db)
+   db.save_to_load_db()
+   db.release_retired('01_01_2001')
+
+   [stats] = archive.archive_weeks(db)
+   assert stats['records'] == 3
+   assert archive.get_archived_weeks() == ['01_01_2001']
+   table_names = sa.inspect(db.load_db).get_table_names()
+   assert 'user_record_01_01_2001' not in table_names
+   assert 'cell_01_01_2001' not in table_names
+
+   archive.cache.clear()
+   week = archive.read_week('01_01_2001')
+   assert week.iter_user_records(map_type, ['user_id', 'x', 'y', 'cell_type', 'time']) == [
+      (user_id, 1, 2, ct.empty, time),
+      (user_id, 3, 4, ct.spider, time),
+   ]
+   assert week.iter_user_records(mt.hard, ['x', 'y'], user_id = user_id) == []
+   counters = dict([((x, y), c) for x, y, c in week.iter_cell_counters(map_type)])
+   assert counters[(3, 4)][ct.spider.value] == 1
+   assert counters[(1, 2)][ct.empty.value] == 1
+   assert archive.read_week('08_01_2001') is None
+
+def test_archive_keeps_next_week(db_process, tmp_path):
+   db = fork_to_current_week(db_process.db)
+   db.release_retired('01_01_2001')
+   # next week is forked ahead, current db doesn't use it's tables yet
+   next_week, table_names = get_table_names(get_next_monday())
+   db.fork(generate_models(table_names))
+
+   archive = Archive(str(tmp_path / 'archive'))
+   assert archive.get_weeks_to_archive(db) == ['01_01_2001']
+   assert archive.get_weeks_to_archive(db, ['01_01_2001']) == []
+   archive.archive_weeks(db)
+   for engine in [db.memory_db, db.load_db]:
+      table_names = sa.inspect(engine).get_table_names()
+      assert 'cell_' + next_week in table_names
+      assert 'user_record_' + next_week in table_names
@@ -0,0 +1,380 @@
+import pytest
+import uuid
+import sqlite3
+import sqlalchemy as sa
+from datetime import datetime, timezone
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.model import generate_models, get_table_names
+from cave_bot.db_process import DbProcess
+from cave_bot.db_init import Db
+from cave_bot.config import Config
+
+# flush stats are checked, backup would replace them
+@pytest.fixture()
+def db_process(make_db_process):
+   return make_db_process(use_sqlite_backup = False)
+
+# backup is used only for file with live tables
+@pytest.fixture()
+def backup_db_process(make_db_process, tmp_path):
+   return make_db_process(db_connection_str = f'sqlite:///{tmp_path / "cave.db"}')
+
+def count_load_db_user_records(db_process):
+   with db_process.db.LoadSession() as s:
+      return s.query(db_process.db.m.UserRecord).count()
+
+def test_save_to_load_db_nothing_changed(db_process):
+   stats = db_process.db.save_to_load_db()
+
+   assert stats == {'upserted': 0, 'deleted': 0}
+
+def test_save_to_load_db_inserted(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, datetime.now())
+   db_process.update_user_record_and_cell(user_id, [2, 2], ct.spider, map_type, datetime.now())
+
+   stats = db_process.db.save_to_load_db()
+
+   # 2 user records + 2 cells
+   assert stats == {'upserted': 4, 'deleted': 0}
+   assert count_load_db_user_records(db_process) == 2
+
+def test_save_to_load_db_updated(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   db_process.update_user_record(user_id, 1, 2, ct.spider, map_type, datetime.now())
+   stats = db_process.db.save_to_load_db()
+
+   assert stats == {'upserted': 1, 'deleted': 0}
+   with db_process.db.LoadSession() as s:
+      user_record = s.query(db_process.db.m.UserRecord).one()
+      assert user_record.cell_type == ct.spider
+
+def test_save_to_load_db_deleted(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, datetime.now())
+   db_process.update_user_record(user_id, 1, 3, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   db_process.delete_user_record(user_id, 1, 2, map_type)
+   stats = db_process.db.save_to_load_db()
+
+   assert stats == {'upserted': 0, 'deleted': 1}
+   assert count_load_db_user_records(db_process) == 1
+
+def test_save_to_load_db_table_marked(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   table = db_process.db.m.UserRecord.__table__
+   with db_process.db.memory_db.connect() as mdb:
+      mdb.execute(table.delete())
+      mdb.commit()
+   db_process.db.tracker.mark_table(table.name)
+   stats = db_process.db.save_to_load_db()
+
+   assert stats == {'upserted': 0, 'deleted': 1}
+   assert count_load_db_user_records(db_process) == 0
+
+def test_load_from_one_db_to_another_by_chunks(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   for y in range(1, 8):
+      db_process.update_user_record(user_id, 1, y, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   progress = []
+   db = db_process.db
+   db.copy_chunk_size = 3
+   db.load_from_one_db_to_another(db.load_db, db.memory_db, 
+      progress = lambda table_name, copied: progress.append((table_name, copied)))
+
+   table_name = db.m.UserRecord.__tablename__
+   assert [x for x in progress if x[0] == table_name] == [(table_name, 3), (table_name, 6), (table_name, 7)]
+   with db.Session() as s:
+      assert s.query(db.m.UserRecord).count() == 7
+
+def test_backup_to_load_db_nothing_changed(backup_db_process):
+   stats = backup_db_process.db.save_to_load_db()
+
+   assert stats == {'touched': 0}
+
+def test_backup_to_load_db(backup_db_process):
+   db_process = backup_db_process
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, datetime.now())
+   db_process.update_user_record(user_id, 1, 3, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   db_process.delete_user_record(user_id, 1, 2, map_type)
+   stats = db_process.db.save_to_load_db()
+
+   assert stats == {'touched': 1}
+   assert count_load_db_user_records(db_process) == 1
+
+def test_backup_on_startup(backup_db_process):
+   db_process = backup_db_process
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, datetime.now())
+   db_process.db.save_to_load_db()
+
+   db = db_process.db
+   with db.memory_db.connect() as mdb:
+      mdb.execute(db.m.UserRecord.__table__.delete())
+      mdb.commit()
+
+   db.copy_database(db.load_db, db.memory_db)
+   with db.Session() as s:
+      assert s.query(db.m.UserRecord).count() == 1
+
+def test_backup_skipped_for_tables_of_other_weeks(backup_db_process):
+   db_process = backup_db_process
+   db = db_process.db
+   with db.load_db.connect() as connection:
+      connection.exec_driver_sql('CREATE TABLE user_record_01_01_2001 (id INTEGER)')
+      connection.commit()
+   assert not db.is_backup_available(db.load_db, db.memory_db)
+
+   db_process.update_user_record(2879234928, 1, 2, ct.empty, mt.normal, datetime.now())
+   stats = db.save_to_load_db()
+
+   assert stats == {'upserted': 1, 'deleted': 0}
+   assert 'user_record_01_01_2001' in sa.inspect(db.load_db).get_table_names()
+   assert 'user_record_01_01_2001' not in sa.inspect(db.memory_db).get_table_names()
+
+def test_journal_replayed_on_start(db_process, tmp_path):
+   journal_path = str(tmp_path / 'journal.jsonl')
+   db = db_process.db
+   config = Config()
+   db_with_journal = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path)
+   db_process = DbProcess(db_with_journal)
+
+   user_id, map_type, time = 2879234928, mt.normal, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+   db_process.update_user_record_and_cell(user_id, [1, 3], ct.spider, map_type, time)
+   db_process.delete_user_record(user_id, 1, 3, map_type)
+   db_with_journal.close()
+
+   # crash - nothing was dumped
+   restarted_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path)
+   with restarted_db.Session() as s:
+      user_records = s.query(restarted_db.m.UserRecord).all()
+      assert len(user_records) == 1
+      assert user_records[0].cell_type == ct.empty
+      assert user_records[0].time == time
+      cell = s.query(restarted_db.m.Cell).filter(restarted_db.m.Cell.y == 2).one()
+      assert cell.empty == 1
+
+   restarted_db.save_to_load_db()
+   assert count_load_db_user_records(db_process) == 1
+   assert restarted_db.journal.read() == []
+   restarted_db.close()
+
+def test_journal_replayed_for_swapped_week(tmp_path):
+   journal_path = str(tmp_path / 'journal.jsonl')
+   db_connection_str = f'sqlite:///{tmp_path / "cave.db"}'
+   _, previous_table_names = get_table_names(datetime(2001, 1, 1))
+   _, table_names = get_table_names(datetime(2001, 1, 8))
+
+   previous_db = Db(generate_models(previous_table_names), db_connection_str, journal_path = journal_path)
+   user_id, map_type, time = 2879234928, mt.normal, datetime.now()
+   DbProcess(previous_db).update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+   previous_db.close()
+
+   # crash after swap - previous week was not flushed
+   restarted_db = Db(generate_models(table_names), db_connection_str, journal_path = journal_path)
+   assert [x.name for x in restarted_db.retired_tables] == ['cell_01_01_2001', 'user_record_01_01_2001']
+   restarted_db.save_to_load_db()
+   with restarted_db.load_db.connect() as connection:
+      assert connection.exec_driver_sql('select count(*) from user_record_01_01_2001').scalar() == 1
+      assert connection.exec_driver_sql('select empty from cell_01_01_2001').scalar() == 1
+   restarted_db.close()
+
+def test_config_written_to_load_db_in_background(db_process):
+   user_id, map_type = 239485720, mt.nightmare
+   db_process.add_color_scheme(user_id, 'default', {})
+   db_process.set_user_config(user_id, {'map_type': map_type, 'subscribe_id': None})
+   db_process.db.writer.flush()
+
+   with db_process.db.LoadSession() as s:
+      user_config = s.query(db_process.db.m.UserConfig).one()
+      assert user_config.map_type == map_type
+      assert s.query(db_process.db.m.ColorScheme).count() == 1
+
+   db_process.delete_user_config(user_id)
+   db_process.db.writer.flush()
+   with db_process.db.LoadSession() as s:
+      assert s.query(db_process.db.m.UserConfig).count() == 0
+
+def test_lazy_load_deferred_tables(db_process, tmp_path):
+   user_id, map_type, time = 2879234928, mt.normal, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+   db_process.db.save_to_load_db()
+
+   db = db_process.db
+   journal_path = str(tmp_path / 'journal.jsonl')
+   config = Config()
+   lazy_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path, lazy_load = True)
+   assert db.m.UserRecord.__table__ in lazy_db.deferred_tables
+   with lazy_db.Session() as s:
+      assert s.query(db.m.Cell).count() == 1
+      assert s.query(db.m.UserRecord).count() == 0
+
+   assert lazy_db.save_to_load_db() == {'upserted': 0, 'deleted': 0}
+   assert count_load_db_user_records(db_process) == 1
+
+   lazy_db.load_deferred_tables()
+   assert not lazy_db.is_deferred()
+   with lazy_db.Session() as s:
+      assert s.query(db.m.UserRecord).count() == 1
+   lazy_db.close()
+
+def test_lazy_load_uses_backup(backup_db_process):
+   user_id, map_type, time = 2879234928, mt.normal, datetime.now()
+   backup_db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+   backup_db_process.db.save_to_load_db()
+
+   db = backup_db_process.db
+   lazy_db = Db(db.m, str(db.load_db.url), lazy_load = True)
+   assert not lazy_db.is_deferred()
+   with lazy_db.Session() as s:
+      assert s.query(db.m.UserRecord).count() == 1
+   lazy_db.close()
+
+def test_journal_keeps_writes_done_while_deferred(db_process, tmp_path):
+   journal_path = str(tmp_path / 'journal.jsonl')
+   db = db_process.db
+   config = Config()
+   first_scan = datetime(2024, 5, 14, 10, 0, 0, tzinfo = timezone.utc)
+   next_scan = datetime(2024, 5, 14, 11, 0, 0, tzinfo = timezone.utc)
+
+   db_with_journal = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path)
+   DbProcess(db_with_journal).set_last_scan(first_scan)
+   db_with_journal.close()
+
+   # crash - last scan is in journal only, newer one is written while deferred tables are loaded
+   lazy_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path, lazy_load = True)
+   assert lazy_db.is_deferred()
+   DbProcess(lazy_db).set_last_scan(next_scan)
+   lazy_db.load_deferred_tables()
+
+   lazy_process = DbProcess(lazy_db)
+   with lazy_process.session_scope():
+      assert lazy_process.get_last_scan() == next_scan
+   lazy_db.close()
+
+def test_working_store_reused_after_restart(db_process, tmp_path):
+   store_path = str(tmp_path / 'working.db')
+   db = db_process.db
+   config = Config()
+   store_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, working_store_path = store_path)
+   store_db_process = DbProcess(store_db)
+   user_id, map_type = 2879234928, mt.normal
+   store_db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, datetime.now())
+
+   # other process reads working store concurrently
+   with sqlite3.connect(store_path) as connection:
+      table_name = db.m.UserRecord.__tablename__
+      assert connection.execute(f'select count(*) from "{table_name}"').fetchone()[0] == 1
+   store_db.close()
+
+   # crash - nothing was dumped
+   restarted_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, working_store_path = store_path)
+   with restarted_db.Session() as s:
+      assert s.query(db.m.UserRecord).count() == 1
+
+   restarted_db.save_to_load_db()
+   assert count_load_db_user_records(db_process) == 1
+   restarted_db.close()
+
+def test_working_store_saved_before_restart(db_process, tmp_path):
+   store_path = str(tmp_path / 'working.db')
+   db = db_process.db
+   config = Config()
+   store_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, working_store_path = store_path)
+   user_id, map_type = 2879234928, mt.normal
+   DbProcess(store_db).update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, datetime.now())
+   store_db.save_to_load_db()
+   store_db.close()
+
+   # tables are not compared, only new changes are saved
+   restarted_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, working_store_path = store_path)
+   assert restarted_db.tracker.is_empty()
+   DbProcess(restarted_db).update_user_record_and_cell(user_id, [1, 3], ct.spider, map_type, datetime.now())
+   assert restarted_db.save_to_load_db() == {'upserted': 2, 'deleted': 0}
+   assert count_load_db_user_records(db_process) == 2
+   restarted_db.close()
+
+def test_working_store_changes_marked_by_journal(db_process, tmp_path):
+   store_path = str(tmp_path / 'working.db')
+   journal_path = str(tmp_path / 'journal.jsonl')
+   db = db_process.db
+   config = Config()
+   store_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path, working_store_path = store_path)
+   user_id, map_type = 2879234928, mt.normal
+   DbProcess(store_db).update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, datetime.now())
+   store_db.close()
+
+   # crash - tracker is seeded by journal, not by all tables
+   restarted_db = Db(db.m, config.db_connection_str, use_sqlite_backup = False, journal_path = journal_path, working_store_path = store_path)
+   assert len(restarted_db.tracker.tables) == 0
+   assert restarted_db.save_to_load_db() == {'upserted': 2, 'deleted': 0}
+   assert count_load_db_user_records(db_process) == 1
+   restarted_db.close()
+
+def test_fork_for_next_week(db_process):
+   user_id, map_type = 2879234928, mt.normal
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, datetime.now())
+
+   old_m = db_process.db.m
+   table_names = {}
+   for name in ['Role', 'LastScan', 'MapConfig', 'UserConfig', 'ColorScheme']:
+      table_names[name] = getattr(old_m, name).__tablename__
+   table_names['Cell'] = str(uuid.uuid4())
+   table_names['UserRecord'] = str(uuid.uuid4())
+   db = db_process.db.fork(generate_models(table_names))
+   next_db_process = DbProcess(db)
+
+   assert next_db_process.get_user_record_by_map(map_type) == []
+   next_db_process.update_user_record_and_cell(user_id, [1, 2], ct.spider, map_type, datetime.now())
+
+   # record of previous week is not lost, though it's table is not in models anymore
+   stats = db.save_to_load_db()
+   assert stats == {'upserted': 4, 'deleted': 0}
+   assert count_load_db_user_records(db_process) == 1
+   assert count_load_db_user_records(next_db_process) == 1
+   db.drop_tables()
+
+def test_partitioned_schema_scoped_to_week(tmp_path):
+   user_id, map_type = 2879234928, mt.normal
+   week_postfix, table_names = get_table_names(datetime(2001, 1, 1, tzinfo=timezone.utc), is_partitioned = True)
+   db = Db(generate_models(table_names), f'sqlite:///{tmp_path / "cave.db"}')
+   db_process = DbProcess(db)
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.spider, map_type, datetime.now())
+   db.save_to_load_db()
+
+   next_week_postfix, table_names = get_table_names(datetime(2001, 1, 8, tzinfo=timezone.utc), is_partitioned = True)
+   next_db = db.fork(generate_models(table_names))
+   next_db_process = DbProcess(next_db)
+   assert next_db.retired_tables == []
+   assert next_db_process.get_user_record(user_id, 1, 2, map_type) is None
+   assert next_db_process.iter_cell_counters(map_type) == []
+
+   next_db_process.apply_user_reports(user_id, map_type, [(1, 2, ct.empty)], datetime.now())
+   assert next_db_process.get_cell_type_counters(1, 2, map_type)[ct.spider.value] == 0
+   assert db_process.iter_user_records(map_type) == [(1, 2, ct.spider)]
+
+   next_db.save_to_load_db()
+   next_db.release_retired(week_postfix)
+   next_db.close()
+
+   # only current week is loaded to memory db, previous stays in persistent db
+   db = Db(generate_models(table_names), f'sqlite:///{tmp_path / "cave.db"}')
+   with db.memory_db.connect() as connection:
+      assert connection.execute(sa.text('select week from user_record')).scalars().all() == [next_week_postfix]
+   with db.load_db.connect() as connection:
+      assert len(connection.execute(sa.text('select week from user_record')).all()) == 2
+   db.close()
@@ -1,34 +1,13 @@
 import pytest
-import uuid
+import asyncio
+import sqlalchemy as sa
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 
 from cave_bot.const import CellType as ct, UserRole as ur, MapType as mt
-from cave_bot.model import generate_models
-from cave_bot.db_process import DbProcess
-from cave_bot.db_init import Db
+from cave_bot.db_async import AsyncDbProcess
 from cave_bot.utils import time_to_global_timezone
-from cave_bot.config import Config
-
-@pytest.fixture()
-def db_process():
-   config = Config()
-
-   table_names = {
-      'Role': str(uuid.uuid4()),
-      'LastScan': str(uuid.uuid4()),
-      'Cell': str(uuid.uuid4()),
-      'UserRecord': str(uuid.uuid4()),
-      'MapConfig': str(uuid.uuid4()),
-      'UserConfig': str(uuid.uuid4()),
-      'ColorScheme': str(uuid.uuid4()),
-   }
-   models = generate_models(table_names)
-   db = Db(models, config.db_connection_str)
-   db_process = DbProcess(db)
-
-   yield db_process
-   db.drop_tables()
+from cave_bot.view import View
 
 def test_get_cell_type_counters(db_process):
    x, y, map_type, idle_reward_counter, demon_head_counter = 3, 4, mt.normal, 5, 2
@@ -404,6 +383,27 @@ def test_update_user_record_if_set(db_process):
       ).one()
       assert user_record.cell_type == expected_cell_type
 
+def test_update_user_record_same_cell_type_keeps_time(db_process):
+   x, y, user_id, cell_type, map_type = 3, 4, 2879234928, ct.demon_head, mt.hard
+   time_was = datetime(2024, 5, 14, 10, 0, 0)
+   db_process.update_user_record(user_id, x, y, cell_type, map_type, time_was)
+   db_process.update_user_record(user_id, x, y, cell_type, map_type, datetime.now())
+
+   with db_process.db.Session() as s:
+      user_record = s.query(db_process.db.m.UserRecord).one()
+      assert user_record.cell_type == cell_type
+      assert user_record.time == time_was
+
+def test_update_cell_returns_counters(db_process):
+   x, y, map_type = 3, 4, mt.normal
+
+   db_process.update_cell(x, y, ct.spider, map_type, +1)
+   counters = db_process.update_cell(x, y, ct.spider, map_type, +1)
+
+   expected_counters = [0] * len(ct)
+   expected_counters[ct.spider.value] = 2
+   assert counters == expected_counters
+
 def test_delete_user_record_if_not_set(db_process):
    x, y, user_id, map_type = 3, 4, 2879234928, mt.normal
    db_process.delete_user_record(user_id, x, y, map_type)
@@ -551,6 +551,149 @@ def test_delete_user_record_and_update_cell_if_set(db_process):
       assert user_record is None
       assert cell.demon_head == cell_type_was_counter_expected
 
+def test_apply_user_reports(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+   db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+
+   reports = [(1, 1, ct.empty), (1, 2, ct.empty), (1, 3, ct.empty), (1, 3, ct.empty)]
+   cell_types_was, counters_by_coords = db_process.apply_user_reports(user_id, map_type, reports, time)
+
+   assert cell_types_was == [ct.spider, ct.empty, None, ct.empty]
+   assert set(counters_by_coords.keys()) == {(1, 1), (1, 3)}
+   assert counters_by_coords[(1, 1)][ct.spider.value] == 0
+   assert counters_by_coords[(1, 1)][ct.empty.value] == 1
+   assert counters_by_coords[(1, 3)][ct.empty.value] == 1
+
+   with db_process.db.Session() as s:
+      user_records = s.query(db_process.db.m.UserRecord).all()
+      assert len(user_records) == 3
+      assert all([x.cell_type == ct.empty for x in user_records])
+      cell = s.query(db_process.db.m.Cell).filter(
+         db_process.db.m.Cell.x == 1,
+         db_process.db.m.Cell.y == 2,
+      ).one()
+      assert cell.empty == 1
+
+def test_apply_user_reports_nothing_changed(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+
+   cell_types_was, counters_by_coords = db_process.apply_user_reports(user_id, map_type, [(1, 1, ct.spider)], time)
+
+   assert cell_types_was == [ct.spider]
+   assert counters_by_coords == {}
+
+def test_iter_cell_counters(db_process):
+   map_type = mt.hard
+   db_process.update_cell(1, 2, ct.spider, map_type, +1)
+   db_process.update_cell(1, 2, ct.empty, map_type, +1)
+   db_process.update_cell(3, 3, ct.spider, mt.normal, +1)
+
+   expected_counters = [0] * len(ct)
+   expected_counters[ct.spider.value] = 1
+   expected_counters[ct.empty.value] = 1
+   assert db_process.iter_cell_counters(map_type) == [(1, 2, expected_counters)]
+
+def test_iter_cell_counters_null(db_process):
+   map_type = mt.hard
+   # rows of old schema have no defaults
+   counters = dict([(x.name, None) for x in ct])
+   counters['spider'] = 2
+   with db_process.db.Session() as s:
+      s.add(db_process.db.m.Cell(x = 1, y = 2, map_type = map_type, **counters))
+      s.commit()
+
+   rows = db_process.iter_cell_counters(map_type)
+
+   expected_counters = [0] * len(ct)
+   expected_counters[ct.spider.value] = 2
+   assert rows == [(1, 2, expected_counters)]
+
+   view = View(map_type)
+   view.load_cells(rows)
+   assert view.get_cell(1, 2).val.tolist() == expected_counters
+   assert view.get_cell_type(1, 2) == ct.spider
+
+def test_iter_user_records(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime(2024, 5, 14, 10, 0, 0)
+   db_process.update_user_record(user_id, 2, 1, ct.spider, map_type, time)
+   db_process.update_user_record(user_id, 1, 2, ct.empty, map_type, time)
+   db_process.update_user_record(user_id + 1, 1, 1, ct.spider, map_type, time)
+   db_process.update_user_record(user_id, 1, 1, ct.spider, mt.normal, time)
+
+   records = db_process.iter_user_records(map_type, ['x', 'y', 'cell_type'], user_id)
+   assert records == [(1, 2, ct.empty), (2, 1, ct.spider)]
+
+   records = db_process.iter_user_records(map_type, ['user_id', 'cell_type', 'time'])
+   assert records == [
+      (user_id + 1, ct.spider, time), (user_id, ct.empty, time), (user_id, ct.spider, time),
+   ]
+   assert db_process.iter_user_records(map_type, ['x', 'y'], user_id) == [(1, 2), (2, 1)]
+
+def test_unit_of_work_one_transaction(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   commits = []
+   sa.event.listen(db_process.db.Session, 'after_commit', lambda s: commits.append(s))
+
+   async def process():
+      async with db_process.unit_of_work():
+         db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+         db_process.update_user_record_and_cell(user_id, [1, 2], ct.empty, map_type, time)
+         db_process.set_last_scan(time)
+   asyncio.run(process())
+
+   assert len(commits) == 1
+   assert len(db_process.get_all_user_record(user_id, map_type)) == 2
+
+def test_unit_of_work_rollback(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+
+   async def process():
+      async with db_process.unit_of_work() as scope:
+         db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+         db_process.set_rollback_only()
+      return scope
+   scope = asyncio.run(process())
+
+   assert scope.is_rolled_back
+   assert db_process.get_all_user_record(user_id, map_type) == []
+   assert db_process.get_cell_type_counters(1, 1, map_type) is None
+
+def test_unit_of_work_on_rolled_back_under_lock(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   calls = []
+
+   async def on_rolled_back():
+      # nothing of rolled back unit of work is seen by callback
+      records = await asyncio.to_thread(db_process.get_all_user_record, user_id, map_type)
+      calls.append((db_process.db.lock.locked(), len(records)))
+
+   async def process():
+      async with db_process.unit_of_work(on_rolled_back = on_rolled_back):
+         db_process.update_user_record(user_id, 1, 1, ct.spider, map_type, time)
+      async with db_process.unit_of_work(on_rolled_back = on_rolled_back):
+         db_process.update_user_record(user_id, 1, 2, ct.spider, map_type, time)
+         db_process.set_rollback_only()
+   asyncio.run(process())
+
+   assert calls == [(True, 1)]
+
+def test_async_db_process_joins_unit_of_work(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   adb = AsyncDbProcess(db_process)
+
+   async def process():
+      async with db_process.unit_of_work():
+         await adb.update_user_record(user_id, 1, 1, ct.spider, map_type, time)
+         records = await adb.iter_user_records(map_type, ['x', 'y'], user_id)
+         db_process.set_rollback_only()
+      return records
+   records = asyncio.run(process())
+
+   assert records == [(1, 1)]
+   assert db_process.get_all_user_record(user_id, map_type) == []
+
 def test_get_user_map_types_unique_if_set(db_process):
    set_user_id = 239485720
    map_type1 = mt.normal
@@ -628,6 +771,21 @@ def test_get_user_config_if_set(db_process):
    assert user_config.id == user_id
    assert user_config.map_type == map_type
 
+@pytest.mark.parametrize("color", [(0, 0, 0, 0), (255, 255, 255, 100), (83, 255, 77, 20)])
+def test_user_config_color_packed(db_process, color):
+   user_id = 239485720
+   db_process.add_color_scheme(user_id, 'default', {})
+   db_process.set_user_config(user_id, {'me_color': color})
+
+   with db_process.db.memory_db.connect() as connection:
+      table = db_process.db.m.UserConfig.__table__
+      stored = connection.execute(sa.select(sa.type_coerce(table.c.me_color, sa.Integer))).scalar()
+   assert isinstance(stored, int)
+
+   user_config = db_process.get_user_config(user_id)
+   assert user_config.me_color == color
+   assert isinstance(user_config.me_color, tuple)
+
 def test_set_user_config_if_not_set(db_process):
    user_id = 239485720
    map_type = mt.nightmare
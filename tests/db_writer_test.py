@@ -0,0 +1,91 @@
+import threading
+
+from cave_bot.db_writer import WriteBehindQueue
+
+class Model:
+   __tablename__ = 'model'
+
+def test_write_behind_queue_writes_all():
+   written = []
+   queue = WriteBehindQueue(lambda op, model, hash: written.append((op, hash['id'])))
+   for id in range(5):
+      queue.put('upsert', Model, {'id': id}, (id,))
+   queue.flush()
+
+   assert sorted(written) == [('upsert', id) for id in range(5)]
+   assert queue.get_stats()['depth'] == 0
+   queue.stop()
+
+def test_write_behind_queue_coalesce():
+   written = []
+   lock = threading.Event()
+   def write(op, model, hash):
+      lock.wait()
+      written.append((op, hash['id'], hash['value']))
+
+   queue = WriteBehindQueue(write)
+   queue.put('upsert', Model, {'id': 1, 'value': 0}, (1,))
+   # first write is in progress, next ones are pending
+   queue.put('upsert', Model, {'id': 2, 'value': 1}, (2,))
+   queue.put('upsert', Model, {'id': 2, 'value': 2}, (2,))
+   queue.put('delete', Model, {'id': 2, 'value': 3}, (2,))
+   lock.set()
+   queue.stop()
+
+   assert written[-1] == ('delete', 2, 3)
+   assert ('upsert', 2, 1) not in written
+   assert ('upsert', 2, 2) not in written
+   assert queue.get_stats()['coalesced'] == 2
+
+def test_write_behind_queue_without_pk_not_coalesced():
+   written = []
+   queue = WriteBehindQueue(lambda op, model, hash: written.append(hash['name']))
+   queue.put('upsert', Model, {'name': 'a'}, None)
+   queue.put('upsert', Model, {'name': 'b'}, None)
+   queue.stop()
+
+   assert written == ['a', 'b']
+
+def test_write_behind_queue_after_stop_writes_sync():
+   written = []
+   queue = WriteBehindQueue(lambda op, model, hash: written.append(hash['id']))
+   queue.stop()
+   queue.put('upsert', Model, {'id': 1}, (1,))
+
+   assert written == [1]
+
+def test_write_behind_queue_full_drops_write():
+   written = []
+   started, lock = threading.Event(), threading.Event()
+   def write(op, model, hash):
+      started.set()
+      lock.wait()
+      written.append(hash['id'])
+
+   queue = WriteBehindQueue(write, maxsize = 1)
+   queue.put('upsert', Model, {'id': 1}, (1,))
+   started.wait()
+   queue.put('upsert', Model, {'id': 2}, (2,))
+   # first write is in progress, second is pending - queue is full
+   queue.put('upsert', Model, {'id': 3}, (3,))
+   # pending key is coalesced still
+   queue.put('upsert', Model, {'id': 2}, (2,))
+   lock.set()
+   queue.stop()
+
+   assert written == [1, 2]
+   assert queue.get_stats()['overflow'] == 1
+
+def test_write_behind_queue_failed_not_written():
+   def write(op, model, hash):
+      if hash['id'] == 1:
+         raise Exception('failed')
+
+   queue = WriteBehindQueue(write)
+   queue.put('upsert', Model, {'id': 1}, (1,))
+   queue.put('upsert', Model, {'id': 2}, (2,))
+   queue.stop()
+
+   stats = queue.get_stats()
+   assert stats['written'] == 1
+   assert stats['errors'] == 1
@@ -0,0 +1,18 @@
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.mutation_bus import MutationBus, MutationKind, RecordMutation
+
+def test_mutation_kind():
+   assert RecordMutation(1, 1, 1, None, ct.empty).kind == MutationKind.added
+   assert RecordMutation(1, 1, 1, ct.spider, ct.empty).kind == MutationKind.changed
+   assert RecordMutation(1, 1, 1, ct.spider, None).kind == MutationKind.removed
+
+def test_publish():
+   bus = MutationBus()
+   batches = []
+   bus.subscribe(lambda map_type, mutations: batches.append((map_type, len(mutations))))
+   bus.subscribe(lambda map_type, mutations: batches.append((map_type, 0)))
+
+   bus.publish(mt.hard, [])
+   bus.publish(mt.hard, [RecordMutation(1, 1, 1, None, ct.empty), RecordMutation(1, 2, 1, None, ct.empty)])
+
+   assert batches == [(mt.hard, 2), (mt.hard, 0)]
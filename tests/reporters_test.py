@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.reporters import ReportersIndex
+from cave_bot.mutation_bus import RecordMutation
+
+def get_time(hour):
+   return datetime(2024, 1, 1, hour, tzinfo = timezone.utc)
+
+def test_reporters_index(db_process):
+   map_type = mt.normal
+   db_process.update_user_record_and_cell(1, [1, 1], ct.spider, map_type, get_time(3))
+   db_process.update_user_record_and_cell(2, [1, 1], ct.empty, map_type, get_time(1))
+   db_process.update_user_record_and_cell(3, [2, 2], ct.empty, map_type, get_time(1))
+   reporters = ReportersIndex(db_process)
+
+   assert reporters.get(map_type, 1, 1) == [(get_time(1), 2, ct.empty), (get_time(3), 1, ct.spider)]
+   assert reporters.get(map_type, 5, 5) == []
+
+   reporters.set(3, map_type, [(1, 1, ct.spider)], get_time(2))
+   reporters.set(2, map_type, [(1, 1, ct.spider)], get_time(4))
+   assert reporters.get(map_type, 1, 1) == [(get_time(2), 3, ct.spider), (get_time(3), 1, ct.spider), (get_time(4), 2, ct.spider)]
+
+   reporters.apply_mutations(map_type, [
+      RecordMutation(3, 1, 1, ct.spider, None),
+      RecordMutation(3, 2, 2, ct.empty, None),
+   ])
+   assert reporters.get(map_type, 2, 2) == []
+   assert reporters.get(map_type, 1, 1)[0] == (get_time(3), 1, ct.spider)
+
+def test_get_first_finders(db_process):
+   map_type = mt.normal
+   db_process.update_user_record_and_cell(1, [1, 1], ct.spider, map_type, get_time(3))
+   db_process.update_user_record_and_cell(2, [1, 1], ct.empty, map_type, get_time(1))
+   db_process.update_user_record_and_cell(3, [1, 1], ct.spider, map_type, get_time(2))
+   reporters = ReportersIndex(db_process)
+
+   most_grid = [[ct.unknown.value] * map_type.value for _ in range(map_type.value)]
+   most_grid[0][0] = ct.spider.value
+
+   assert reporters.get_first_finders(map_type, most_grid) == {(1, 1): (3, ct.spider, get_time(2))}
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.user_records import UserRecords, UserRecordsCache
+from cave_bot.mutation_bus import RecordMutation
+
+def test_user_records():
+   user_records = UserRecords(mt.normal)
+   user_records.load([(3, 1, ct.spider), (1, 2, ct.empty), (20, 20, ct.spider)])
+   user_records.set(3, 1, ct.empty)
+   user_records.delete(20, 20)
+
+   assert user_records.get(3, 1) == ct.empty
+   assert user_records.get(20, 20) is None
+   assert user_records.get_records() == [(1, 2, ct.empty), (3, 1, ct.empty)]
+   assert user_records.get_known_coords() == {(1, 2), (3, 1)}
+   assert user_records.get_cell_type_amount(ct.empty) == 2
+   assert len(user_records) == 2
+
+def test_user_records_cache(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+   cache = UserRecordsCache(db_process, limit = 1)
+
+   user_records = cache.get(user_id, map_type)
+   assert user_records.get_records() == [(1, 1, ct.spider)]
+   assert cache.get(user_id, map_type) is user_records
+
+   cache.apply_mutations(map_type, [
+      RecordMutation(user_id, 2, 2, None, ct.empty, time),
+      RecordMutation(user_id, 1, 1, ct.spider, None),
+   ])
+   assert user_records.get_records() == [(2, 2, ct.empty)]
+
+   # least recently used is dropped, not cached user isn't loaded on write
+   cache.get(user_id + 1, map_type)
+   cache.apply_mutations(map_type, [RecordMutation(user_id, 3, 3, None, ct.empty, time)])
+   assert list(cache.cache.keys()) == [(user_id + 1, map_type)]
+   assert cache.get(user_id, map_type).get_records() == [(1, 1, ct.spider)]
+
+def test_apply_user_reports_with_known_user_cell_types(db_process):
+   user_id, map_type, time = 2879234928, mt.hard, datetime.now()
+   db_process.update_user_record_and_cell(user_id, [1, 1], ct.spider, map_type, time)
+   user_cell_types = {(1, 1): ct.spider}
+
+   reports = [(1, 1, ct.empty), (1, 2, ct.empty)]
+   cell_types_was, counters_by_coords = db_process.apply_user_reports(user_id, map_type, reports, time, user_cell_types)
+
+   assert cell_types_was == [ct.spider, None]
+   assert user_cell_types == {(1, 1): ct.spider}
+   assert counters_by_coords[(1, 1)][ct.spider.value] == 0
+   assert counters_by_coords[(1, 2)][ct.empty.value] == 1
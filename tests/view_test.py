@@ -0,0 +1,146 @@
+import random
+
+from cave_bot.const import CellType as ct, MapType as mt
+from cave_bot.view import View
+from cave_bot.mutation_bus import RecordMutation
+
+def build_counters(values):
+   counters = [0] * len(ct)
+   for cell_type, amount in values.items():
+      counters[cell_type.value] = amount
+   return counters
+
+def test_load_cells():
+   view = View(mt.normal)
+   view.load_cells([
+      (1, 2, build_counters({ct.spider: 2, ct.empty: 1})),
+      (20, 20, build_counters({ct.empty: 1, ct.idle_reward: 1})),
+   ])
+
+   assert view.get_cell_type(1, 2) == ct.spider
+   # first max wins
+   assert view.get_cell_type(20, 20) == ct.empty
+   assert view.get_cell_type(3, 3) == ct.unknown
+   assert view.get_explored_cells() == 2
+   assert view.get_cell_type_amount(ct.spider) == 1
+   assert view.get_most_grid()[0][1] == ct.spider.value
+
+def test_update_cells():
+   view = View(mt.normal)
+   view.load_cells([(1, 1, build_counters({ct.empty: 1}))])
+   version = view.version
+
+   changed = view.update_cells(
+      [(1, 1), (2, 2)],
+      [build_counters({ct.empty: 2}), build_counters({ct.spider: 1})],
+   )
+
+   assert changed.tolist() == [False, True]
+   assert view.version == version + 1
+   cell = view.get_cell(1, 1)
+   assert cell.get_most_cell_type() == ct.empty
+   assert cell.get_cell_type_counter(ct.empty) == 2
+
+def test_update_cell_to_unknown():
+   view = View(mt.hard)
+   view.update_cell(25, 25, build_counters({ct.demon_head: 1}))
+   version = view.version
+
+   view.update_cell(25, 25, build_counters({}))
+
+   assert view.get_cell_type(25, 25) == ct.unknown
+   assert view.version == version + 1
+
+   view.update_cell(25, 25, build_counters({ct.empty: 1, ct.spider: 1}))
+   view.update_cell(25, 25, build_counters({ct.empty: 2, ct.spider: 1}))
+   assert view.version == version + 2
+
+def test_histogram_kept_on_updates():
+   random.seed(7)
+   view = View(mt.normal)
+   view.load_cells([(1, 1, build_counters({ct.spider: 1}))])
+   for _ in range(200):
+      coords = list({(random.randint(1, 20), random.randint(1, 20)) for _ in range(5)})
+      counters = [build_counters({random.choice(list(ct)): random.randint(0, 2)}) for _ in coords]
+      view.update_cells(coords, counters)
+
+   most = view.get_most_grid()
+   for cell_type in ct:
+      assert view.get_cell_type_amount(cell_type) == int((most == cell_type.value).sum())
+   assert view.get_explored_cells() == int((most != ct.unknown.value).sum())
+
+def test_snapshot():
+   view = View(mt.normal)
+   view.load_cells([(1, 1, build_counters({ct.spider: 1}))])
+
+   snapshot = view.snapshot()
+   assert view.snapshot() is snapshot
+   assert not snapshot.get_most_grid().flags.writeable
+
+   view.update_cell(2, 2, build_counters({ct.empty: 1}))
+   view.update_cell(1, 1, build_counters({ct.spider: 1, ct.empty: 2}))
+
+   assert snapshot.get_cell_type(1, 1) == ct.spider
+   assert snapshot.get_cell_type(2, 2) == ct.unknown
+   assert snapshot.get_explored_cells() == 1
+   assert snapshot.get_cell(1, 1).get_cell_type_counter(ct.empty) == 0
+
+   new_snapshot = view.snapshot()
+   assert new_snapshot is not snapshot
+   assert new_snapshot.version > snapshot.version
+   assert new_snapshot.counters_version > snapshot.counters_version
+   assert new_snapshot.get_cell_type(1, 1) == ct.empty
+   assert new_snapshot.get_cell_type_amount(ct.empty) == 2
+
+def test_contested_cells():
+   view = View(mt.normal)
+   view.load_cells([
+      (1, 1, build_counters({ct.spider: 3, ct.empty: 1})),
+      (2, 2, build_counters({ct.spider: 1})),
+   ])
+   assert view.get_contested_cells() == [(1, 1, 2)]
+
+   view.update_cells(
+      [(2, 2), (3, 3)],
+      [build_counters({ct.spider: 1, ct.empty: 1}), build_counters({ct.idle_reward: 2})],
+   )
+   assert view.get_contested_cells() == [(2, 2, 0), (1, 1, 2)]
+
+   snapshot = view.snapshot()
+   view.update_cell(1, 1, build_counters({ct.spider: 3}))
+   assert view.get_contested_cells() == [(2, 2, 0)]
+   assert snapshot.get_contested_cells() == [(2, 2, 0), (1, 1, 2)]
+   assert view.snapshot().get_contested_cells() == [(2, 2, 0)]
+
+def test_snapshot_kept_by_counters_version():
+   view = View(mt.normal)
+   view.update_cell(1, 1, build_counters({ct.spider: 2}))
+   snapshot = view.snapshot()
+
+   # most is same, but counters changed
+   view.update_cell(1, 1, build_counters({ct.spider: 3}))
+   assert view.version == snapshot.version
+   new_snapshot = view.snapshot()
+   assert new_snapshot is not snapshot
+   assert new_snapshot.get_cell(1, 1).get_cell_type_counter(ct.spider) == 3
+   assert view.snapshot() is new_snapshot
+
+def test_apply_mutations():
+   view = View(mt.normal)
+   view.load_cells([(1, 1, build_counters({ct.spider: 1}))])
+
+   changed = view.apply_mutations([
+      RecordMutation(1, 1, 1, None, ct.empty),
+      RecordMutation(2, 2, 2, None, ct.spider),
+      RecordMutation(2, 1, 1, None, ct.empty),
+      RecordMutation(3, 1, 1, ct.spider, ct.empty),
+   ])
+
+   assert changed.tolist() == [True, True]
+   assert view.get_cell(1, 1).get_cell_type_counter(ct.empty) == 3
+   assert view.get_cell(1, 1).get_cell_type_counter(ct.spider) == 0
+   assert view.get_cell_type(2, 2) == ct.spider
+
+   view.apply_mutations([RecordMutation(2, 2, 2, ct.spider, None), RecordMutation(2, 2, 2, ct.spider, None)])
+   assert view.get_cell_type(2, 2) == ct.unknown
+   assert view.get_cell(2, 2).get_cell_type_counter(ct.spider) == 0